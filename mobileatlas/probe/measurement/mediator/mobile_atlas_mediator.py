@@ -10,6 +10,8 @@ import logging
 from datetime import datetime
 from threading import Event, Thread, Lock
 from mobileatlas.probe.measurement.utils.format_logging import format_extra
+from mobileatlas.probe.netns import HOST_ADDRESS, NS_ADDRESS, NS_VETH, set_default_gateway, set_link
+from pyroute2 import IPRoute
 
 #import gi
 #gi.require_version('ModemManager', '1.0')
@@ -351,18 +353,20 @@ class MobileAtlasMediator(MMCallbackClass, NMCallbackClass):
         #os.system("ip netns exec default ip addr add 10.29.183.2/24 dev veth1")
         #os.system("ip netns exec default ip route add 10.29.183.0/24 dev veth1")
         # actually this should be enought:
-        os.system("ip link set veth0 up")
-        os.system("ip addr add 10.29.183.1/24 dev veth0")
+        with IPRoute() as ipr:
+            set_link(ipr, NS_VETH, True, NS_ADDRESS)
 
     def _disable_veth_bridge(self):
-        os.system("ip link set veth0 down")
+        with IPRoute() as ipr:
+            set_link(ipr, NS_VETH, False)
 
-    # TODO: use pyroute2 lib?
     def _enable_veth_gateway(self):
-        os.system("route add default gw 10.29.183.2")
+        with IPRoute() as ipr:
+            set_default_gateway(ipr, HOST_ADDRESS, True)
 
     def _disable_veth_gateway(self):
-        os.system("route delete default gw 10.29.183.2")
+        with IPRoute() as ipr:
+            set_default_gateway(ipr, HOST_ADDRESS, False)
 
     # TODO: use Semaphore class instead of Lock + Cnt?
     def enable_veth_bridge(self):
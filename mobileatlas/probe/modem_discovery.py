@@ -0,0 +1,132 @@
+import logging
+import time
+
+import pyudev
+
+logger = logging.getLogger(__name__)
+
+MODEM_IDS = [
+    ("2c7c", "0125"),  # 4G Quectel EG25-G
+    ("2c7c", "0800"),  # 5G Quectel RM500Q
+]
+
+
+class ModemDiscovery:
+    """
+    Waits for a modem to be enumerated using udev events
+
+    The monitor is started on construction, so create the ModemDiscovery before
+    power cycling the modem to include the removal and enumeration in the timeline.
+    """
+
+    def __init__(self, modem_ids=MODEM_IDS, ports=("tty",), port_timeout=10):
+        """
+        modem_ids: (vendor ID, product ID) of the expected modems
+        ports: subsystems of the ports the modem has to provide (e.g., "tty", "net")
+        port_timeout: seconds to wait for the ports once the modem is enumerated
+        """
+        self.modem_ids = set(modem_ids)
+        self.ports = set(ports)
+        self.port_timeout = port_timeout
+        # (seconds since start, action, subsystem, sys_name) of every event
+        self.timeline = []
+
+        self._context = pyudev.Context()
+        self._monitor = pyudev.Monitor.from_netlink(self._context)
+        for subsystem in {"usb"} | self.ports:
+            self._monitor.filter_by(subsystem)
+        self._monitor.start()
+        self._start = time.monotonic()
+
+    def _is_modem(self, device):
+        return (
+            device.subsystem == "usb"
+            and device.device_type == "usb_device"
+            and (device.get("ID_VENDOR_ID"), device.get("ID_MODEL_ID"))
+            in self.modem_ids
+        )
+
+    def _find_modem(self):
+        for vendor_id, model_id in self.modem_ids:
+            for device in self._context.list_devices(
+                subsystem="usb", ID_VENDOR_ID=vendor_id, ID_MODEL_ID=model_id
+            ):
+                if device.device_type == "usb_device":
+                    return device
+        return None
+
+    def _missing_ports(self, modem):
+        return self.ports - {child.subsystem for child in modem.children}
+
+    def _record(self, device):
+        entry = (
+            time.monotonic() - self._start,
+            device.action,
+            device.subsystem,
+            device.sys_name,
+        )
+        self.timeline.append(entry)
+        logger.debug(
+            f"udev event after {entry[0]:.2f}s: {entry[1]} {entry[2]} {entry[3]}"
+        )
+
+    def wait(self, timeout=None):
+        """
+        Wait until an expected modem and its ports are present
+
+        Returns the modem's udev device or None if timeout seconds passed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # the monitor is already running, so no event is missed between the
+        # enumeration and polling
+        modem = self._find_modem()
+        modem_found = time.monotonic() if modem is not None else None
+
+        while True:
+            if modem is not None:
+                missing = self._missing_ports(modem)
+
+                if not missing:
+                    self.log_timeline()
+                    return modem
+
+                if time.monotonic() - modem_found >= self.port_timeout:
+                    logger.warning(f"modem is missing {', '.join(missing)} ports")
+                    self.log_timeline()
+                    return modem
+
+            poll_timeout = None
+            if modem is not None:
+                poll_timeout = modem_found + self.port_timeout - time.monotonic()
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.log_timeline()
+                    return None
+                poll_timeout = (
+                    remaining if poll_timeout is None else min(poll_timeout, remaining)
+                )
+
+            device = self._monitor.poll(
+                timeout=None if poll_timeout is None else max(poll_timeout, 0)
+            )
+            if device is None:
+                continue
+
+            self._record(device)
+
+            if modem is None and device.action == "add" and self._is_modem(device):
+                modem = device
+                modem_found = time.monotonic()
+            elif modem is not None and device.action == "remove":
+                if device.sys_path == modem.sys_path:
+                    modem = None
+
+    def log_timeline(self):
+        logger.info(
+            "udev events: "
+            + ", ".join(
+                f"{t:.2f}s {action} {subsystem} {name}"
+                for t, action, subsystem, name in self.timeline
+            )
+        )
@@ -0,0 +1,193 @@
+"""
+Measurement network namespace
+
+NetnsManager provisions the measurement namespace with the veth pair connecting it
+to the default namespace, IP forwarding and the NAT rules. Every step checks the
+current state first, so provisioning can be repeated and an already prepared
+namespace is reused. The bridge into the namespace is handed out disabled, as
+the mediator enables it only while it is needed.
+"""
+
+import concurrent.futures
+import errno
+import logging
+import subprocess
+
+from pyroute2 import IPRoute, NetlinkError, NetNS, netns
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "ns_mobileatlas"
+NS_VETH = "veth0"
+HOST_VETH = "veth1"
+NS_ADDRESS = "10.29.183.1"
+HOST_ADDRESS = "10.29.183.2"
+PREFIXLEN = 24
+SUBNET = f"10.29.183.0/{PREFIXLEN}"
+
+IP_FORWARD = "/proc/sys/net/ipv4/ip_forward"
+
+
+def _ignore(code, f, *args, **kwargs):
+    """Call f ignoring netlink errors with the given errno"""
+    try:
+        return f(*args, **kwargs)
+    except NetlinkError as e:
+        if e.code != code:
+            raise
+        return None
+
+
+def set_link(ipr, ifname, up, address=None, prefixlen=PREFIXLEN):
+    """Set a link up (adding address if it is missing) or down"""
+    index = ipr.link_lookup(ifname=ifname)
+    if not index:
+        logger.warning(f"link {ifname} does not exist")
+        return
+
+    ipr.link("set", index=index[0], state="up" if up else "down")
+    if up and address is not None:
+        _ignore(
+            errno.EEXIST,
+            ipr.addr,
+            "add",
+            index=index[0],
+            address=address,
+            prefixlen=prefixlen,
+        )
+
+
+def set_default_gateway(ipr, gateway, enabled):
+    """Add or remove a default route via gateway (with metric 0)"""
+    if enabled:
+        ipr.route("replace", dst="0.0.0.0/0", gateway=gateway, priority=0)
+    else:
+        _ignore(
+            errno.ESRCH, ipr.route, "del", dst="0.0.0.0/0", gateway=gateway, priority=0
+        )
+
+
+class NetnsManager:
+    def __init__(self, name=NAMESPACE, nat_interface="wg+"):
+        """
+        name: name of the namespace (as used by `ip netns`)
+        nat_interface: outgoing interface(s) traffic of the namespace is NATed to
+        """
+        self.name = name
+        self.nat_interface = nat_interface
+
+    def _iptables_rules(self):
+        return [
+            ["-A", "INPUT", "!", "-i", HOST_VETH, "-s", SUBNET, "-j", "DROP"],
+            [
+                "-t",
+                "nat",
+                "-A",
+                "POSTROUTING",
+                "-s",
+                SUBNET,
+                "-o",
+                self.nat_interface,
+                "-j",
+                "MASQUERADE",
+            ],
+        ]
+
+    @staticmethod
+    def _iptables(rule, action):
+        rule = [action if x == "-A" else x for x in rule]
+        return subprocess.run(["iptables", *rule], capture_output=True).returncode == 0
+
+    def setup(self):
+        """
+        Create everything that is missing; independent steps run concurrently
+        """
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(self.ensure_veth),
+                executor.submit(self.ensure_forwarding),
+                executor.submit(self.ensure_nat),
+            ]
+            for future in futures:
+                future.result()
+        logger.info(f"namespace {self.name} is ready")
+
+    def teardown(self):
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = [
+                executor.submit(self._remove_veth_and_namespace),
+                executor.submit(self._set_forwarding, False),
+                executor.submit(self._remove_nat),
+            ]
+            for future in futures:
+                future.result()
+        logger.info(f"namespace {self.name} removed")
+
+    def ensure_namespace(self):
+        if self.name not in netns.listnetns():
+            netns.create(self.name)
+            logger.debug(f"created namespace {self.name}")
+
+    def ensure_veth(self):
+        self.ensure_namespace()
+
+        with NetNS(self.name) as ns:
+            ns_veth = ns.link_lookup(ifname=NS_VETH)
+
+        with IPRoute() as ipr:
+            host_veth = ipr.link_lookup(ifname=HOST_VETH)
+
+            if not ns_veth or not host_veth:
+                # a veth without its peer cannot be repaired
+                if host_veth:
+                    ipr.link("del", index=host_veth[0])
+                if ns_veth:
+                    with NetNS(self.name) as ns:
+                        ns.link("del", index=ns_veth[0])
+
+                ipr.link("add", ifname=HOST_VETH, kind="veth", peer=NS_VETH)
+                ipr.link(
+                    "set",
+                    index=ipr.link_lookup(ifname=NS_VETH)[0],
+                    net_ns_fd=self.name,
+                )
+                logger.debug(f"created veth pair {HOST_VETH}/{NS_VETH}")
+            else:
+                # a previous run might have left the bridge enabled
+                with NetNS(self.name) as ns:
+                    set_default_gateway(ns, HOST_ADDRESS, False)
+                    set_link(ns, NS_VETH, False)
+
+            # the connected route is added together with the address
+            set_link(ipr, HOST_VETH, True, HOST_ADDRESS)
+
+    def ensure_forwarding(self):
+        self._set_forwarding(True)
+
+    def _set_forwarding(self, enabled):
+        value = "1" if enabled else "0"
+        with open(IP_FORWARD, "r+") as f:
+            if f.read().strip() != value:
+                f.seek(0)
+                f.write(value)
+
+    def ensure_nat(self):
+        for rule in self._iptables_rules():
+            if not self._iptables(rule, "-C"):
+                if not self._iptables(rule, "-A"):
+                    raise RuntimeError(f"Adding iptables rule {rule} failed.")
+
+    def _remove_nat(self):
+        for rule in self._iptables_rules():
+            while self._iptables(rule, "-D"):
+                pass
+
+    def _remove_veth_and_namespace(self):
+        with IPRoute() as ipr:
+            index = ipr.link_lookup(ifname=HOST_VETH)
+            if index:
+                # removes the peer as well
+                ipr.link("del", index=index[0])
+
+        if self.name in netns.listnetns():
+            netns.remove(self.name)
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from .measurement.test.test_args import TestParser
 
 
@@ -24,6 +26,11 @@ class ProbeParser(TestParser):
             action="store_false",
             help="Do not start a separate measurement namespace (start test in native environment)",
         )
+        self.parser.add_argument(
+            "--teardown-namespace",
+            action="store_true",
+            help="Remove the measurement namespace after the test instead of keeping it for the next test",
+        )
         self.parser.add_argument(
             "--cafile",
             help="CA certificates used to verify SIM server certificate. (File of concatenated certificates in PEM format.)",
@@ -56,6 +63,12 @@ class ProbeParser(TestParser):
             default="DEBUG",
             help="Select the loglevel the pico should use",
         )
+        self.parser.add_argument(
+            "--latency-report-interval",
+            type=float,
+            default=60,
+            help="Seconds between summaries of the APDU round trip latencies (default: %(default)s)",
+        )
 
         self.parser.add_argument("--cert", help="Client certificate for mTLS.")
         self.parser.add_argument("--key", help="Key for client certificate.")
@@ -140,6 +153,9 @@ class ProbeParser(TestParser):
     def is_measurement_namespace_enabled(self):
         return self.test_args.start_namespace
 
+    def get_teardown_namespace(self):
+        return self.test_args.teardown_namespace
+
     def get_use_reader(self):
         return self.test_args.reader
 
@@ -149,6 +165,12 @@ class ProbeParser(TestParser):
     def get_pico_loglevel(self):
         return self.test_args.pico_loglevel
 
+    def get_latency_report_interval(self):
+        return self.test_args.latency_report_interval
+
+    def get_latency_path(self):
+        return Path(TestParser.DEFAULT_LOG_DIRECTORY) / "tunnel_latency.json"
+
     def get_blacklisted_modules(self):
         return self.test_config.get("module_blacklist", [])
 
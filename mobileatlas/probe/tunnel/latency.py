@@ -0,0 +1,219 @@
+"""
+Latency accounting for tunnelled APDUs
+
+Every APDU is timestamped when the modem's command is handed to the tunnel
+(modem read), after it was sent to the SIM provider (network send), when the
+response arrived (network receive) and when it is handed back for the modem
+(modem write). The serial transfer itself happens in VirtualSim and is not part
+of the timings. Timings are aggregated per command class into histograms of the
+round trip and per-phase totals.
+"""
+
+import bisect
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in ms) of the histogram buckets; the last bucket is unbounded
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+PHASES = ("send", "network", "return")
+
+# INS -> command class
+COMMAND_CLASSES = {
+    0x04: "DEACTIVATE FILE",
+    0x10: "TERMINAL PROFILE",
+    0x12: "FETCH",
+    0x14: "TERMINAL RESPONSE",
+    0x20: "VERIFY PIN",
+    0x24: "CHANGE PIN",
+    0x2C: "UNBLOCK PIN",
+    0x32: "INCREASE",
+    0x44: "ACTIVATE FILE",
+    0x70: "MANAGE CHANNEL",
+    0x84: "GET CHALLENGE",
+    0x88: "AUTHENTICATE",
+    0xA2: "SEARCH RECORD",
+    0xA4: "SELECT",
+    0xB0: "READ BINARY",
+    0xB2: "READ RECORD",
+    0xC0: "GET RESPONSE",
+    0xC2: "ENVELOPE",
+    0xCB: "RETRIEVE DATA",
+    0xD6: "UPDATE BINARY",
+    0xDC: "UPDATE RECORD",
+    0xF2: "STATUS",
+}
+
+
+def command_class(apdu):
+    if len(apdu) < 2:
+        return "INVALID"
+    return COMMAND_CLASSES.get(apdu[1], f"INS {apdu[1]:02X}")
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.n = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.n += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket containing the q-quantile"""
+        if self.n == 0:
+            return None
+
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= q * self.n:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.n,
+            "mean_ms": self.total / self.n if self.n else None,
+            "min_ms": self.min,
+            "max_ms": self.max,
+            "buckets_ms": list(BUCKETS_MS),
+            "counts": list(self.counts),
+        }
+
+
+class CommandStats:
+    def __init__(self):
+        self.round_trip = Histogram()
+        # accumulated time (ms) of every phase
+        self.phases = dict.fromkeys(PHASES, 0.0)
+
+    def to_dict(self):
+        d = self.round_trip.to_dict()
+        d["phases_ms"] = dict(self.phases)
+        return d
+
+
+class TunnelLatency:
+    """
+    Collects the timings of all APDUs of a tunnel
+
+    Every report_interval seconds a summary is logged and, if path is set, the
+    statistics are written to path. The file is written by a background thread,
+    so that the APDU which triggers the report is not delayed by it.
+    """
+
+    def __init__(self, report_interval=60, path=None):
+        self.report_interval = report_interval
+        self.path = path
+        self.stats = {}
+        self._lock = threading.Lock()
+        self._last_report = time.perf_counter()
+
+        # serializes writes of the background thread and explicit dumps
+        self._dump_lock = threading.Lock()
+        self._dump_requested = threading.Event()
+        if path is not None:
+            threading.Thread(
+                target=self._dump_loop, name="latency-dump", daemon=True
+            ).start()
+
+    def start(self, apdu):
+        """Timestamps of an APDU read from the modem"""
+        return ApduTiming(self, apdu)
+
+    def record(self, timing):
+        send = timing.net_send - timing.modem_read
+        network = timing.net_recv - timing.net_send
+        ret = timing.modem_write - timing.net_recv
+        total = timing.modem_write - timing.modem_read
+
+        with self._lock:
+            stats = self.stats.get(timing.command_class)
+            if stats is None:
+                stats = self.stats[timing.command_class] = CommandStats()
+
+            stats.round_trip.add(total * 1e3)
+            stats.phases["send"] += send * 1e3
+            stats.phases["network"] += network * 1e3
+            stats.phases["return"] += ret * 1e3
+
+            report = timing.modem_write - self._last_report >= self.report_interval
+            if report:
+                self._last_report = timing.modem_write
+
+        if report:
+            logger.info(self.summary())
+            if self.path is not None:
+                self._dump_requested.set()
+
+    def summary(self):
+        """Single line summary of all command classes"""
+        with self._lock:
+            parts = [
+                f"{name}: n={s.round_trip.n} mean={s.round_trip.total / s.round_trip.n:.1f}ms"
+                f" p90<={s.round_trip.quantile(0.9)}ms max={s.round_trip.max:.1f}ms"
+                for name, s in sorted(self.stats.items())
+            ]
+        return "APDU latency " + ("; ".join(parts) if parts else "(no APDUs)")
+
+    def to_dict(self):
+        with self._lock:
+            return {name: s.to_dict() for name, s in self.stats.items()}
+
+    def dump(self, path=None):
+        with self._dump_lock, open(path or self.path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def _dump_loop(self):
+        while True:
+            self._dump_requested.wait()
+            self._dump_requested.clear()
+            try:
+                self.dump()
+            except OSError as e:
+                logger.warning(f"writing APDU latencies to {self.path} failed: {e}")
+
+
+class ApduTiming:
+    """
+    perf_counter timestamps of a single APDU
+    """
+
+    __slots__ = (
+        "latency",
+        "command_class",
+        "modem_read",
+        "net_send",
+        "net_recv",
+        "modem_write",
+    )
+
+    def __init__(self, latency, apdu):
+        self.latency = latency
+        self.command_class = command_class(apdu)
+        self.modem_read = time.perf_counter()
+        self.net_send = None
+        self.net_recv = None
+        self.modem_write = None
+
+    def sent(self):
+        self.net_send = time.perf_counter()
+
+    def received(self):
+        self.net_recv = time.perf_counter()
+
+    def done(self):
+        self.modem_write = time.perf_counter()
+        self.latency.record(self)
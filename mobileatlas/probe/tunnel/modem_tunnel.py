@@ -17,6 +17,8 @@ from moatt_clients.probe_client import ProbeClient
 from moatt_clients.moat_management import register_probe, deregister_probe
 from moatt_types.connect import Imsi
 
+from mobileatlas.probe.tunnel.latency import TunnelLatency
+
 logger = logging.getLogger(__name__)
 
 
@@ -78,6 +80,8 @@ class ModemTunnel(VirtualSim):
         tls_ctx=None,
         tls_server_name=None,
         direct_connection=False,
+        latency_path=None,
+        latency_report_interval=60,
     ):
         self._modem_type = modem_type
         self._clock = ModemTunnel.get_modem_clk(modem_type)
@@ -96,6 +100,9 @@ class ModemTunnel(VirtualSim):
         self._tls_ctx = tls_ctx
         self._tls_server_name = tls_server_name
         self._direct_connection = direct_connection
+        # APDU round trip timings; written to latency_path (if set) periodically
+        # and on shutdown
+        self.latency = TunnelLatency(latency_report_interval, latency_path)
 
         # bugfix for strange bug at raspi, see https://www.raspberrypi.org/forums/viewtopic.php?t=270917
         # alternatively execute 'read -t 0.1 < /dev/ttyAMA1' after startup
@@ -201,9 +208,11 @@ class ModemTunnel(VirtualSim):
             GPIO.wait_for_edge(self._rst_pin, GPIO.RISING)
             logger.info(f"reset pin was pulled up [{x}]")
 
-    def handle_apdu_indirect(self, apdu):
+    def handle_apdu_indirect(self, apdu, timing):
         self.connection.send_apdu(apdu)  # forward apdu to sim-bank
+        timing.sent()
         response = self.connection.recv()
+        timing.received()
 
         if response is None:
             logger.error("peer closed connection unexpectedly.")
@@ -213,9 +222,11 @@ class ModemTunnel(VirtualSim):
         logger.debug("received answer: " + str(b2h(response.payload)))
         return response.payload
 
-    def handle_apdu_direct(self, apdu):
+    def handle_apdu_direct(self, apdu, timing):
         self._s.send(apdu)
+        timing.sent()
         response = self._s.recv(65535)
+        timing.received()
         logger.debug("received answer: " + str(b2h(response)))
         return response
 
@@ -223,10 +234,15 @@ class ModemTunnel(VirtualSim):
     def handle_apdu(self, apdu):
         logger.info("forward apdu[" + str(len(apdu)) + "]: " + str(b2h(apdu)))
 
+        timing = self.latency.start(apdu)
+
         if self._direct_connection:
-            return self.handle_apdu_direct(apdu)
+            response = self.handle_apdu_direct(apdu, timing)
         else:
-            return self.handle_apdu_indirect(apdu)
+            response = self.handle_apdu_indirect(apdu, timing)
+
+        timing.done()
+        return response
 
     def setup(self):
         # self._f = open("apdu_trace_new.txt", "w")
@@ -234,6 +250,10 @@ class ModemTunnel(VirtualSim):
         self._setup_modem()
 
     def shutdown(self):
+        logger.info(self.latency.summary())
+        if self.latency.path is not None:
+            self.latency.dump()
+
         if self._direct_connection:
             if self._tls_ctx is not None:
                 self._s.unwrap()
@@ -241,7 +261,7 @@ class ModemTunnel(VirtualSim):
             self._s.close()
         else:
             self.connection.close()
-            deregister(self._api_url, self._session_token)
+            deregister_probe(self._api_url, self._session_token)
 
         logger.info("shutdown -> stopping virtualsim")
         self.stop()
@@ -0,0 +1,441 @@
+"""
+asyncio SIM provider daemon
+
+Serves all SIM cards of a SimProvider concurrently from a single event loop.
+Card I/O is blocking and runs in a single-threaded executor per reader, so each
+card handles one exchange at a time while sessions on other readers proceed
+independently. Sessions of the tunnel server share a single multiplexed
+connection if the server supports it.
+"""
+
+import asyncio
+import concurrent.futures
+import logging
+import os
+import re
+import struct
+import time
+
+from moatt_clients.aio.provider_client import ProviderClient
+from moatt_clients.errors import AuthError, ProtocolError, SimRequestError
+from moatt_types.connect import ApduOp, ConnectStatus, Iccid, Imsi, SimId, SimIndex
+
+from mobileatlas.simprovider.trace import TraceRecorder
+from mobileatlas.simprovider.tunnel.card_link import CardLink
+
+LOGGER = logging.getLogger(__name__)
+
+# bytes read per APDU on direct connections (see SimTunnel.process_packet_direct)
+DIRECT_READ_SIZE = 256
+
+
+class SimSlot:
+    """
+    A SIM card of the SimProvider together with the executor running its card I/O
+    """
+
+    def __init__(self, sim_info):
+        self.info = sim_info
+        self.card = CardLink(sim_info.sl)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"card-{sim_info.device_name}"
+        )
+        self.in_use = False
+
+        # utilisation counters
+        self.busy = 0.0
+        self.sessions = 0
+        self.apdus = 0
+
+    async def run(self, f, *args):
+        """Run blocking card I/O in the executor of this card."""
+        start = time.monotonic()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, f, *args
+            )
+        finally:
+            self.busy += time.monotonic() - start
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+class ProviderDaemon:
+    def __init__(self, sim_provider, report_interval=60, record_dir=None):
+        """
+        Parameters
+        ----------
+        sim_provider
+            SimProvider whose SIM cards are served.
+        report_interval
+            Seconds between reports of the utilisation of every SIM card.
+        record_dir
+            Optional directory every session is recorded to (see trace.py).
+        """
+        self.sim_provider = sim_provider
+        self.report_interval = report_interval
+        self.record_dir = record_dir
+        self._slots = {}
+        # reserved by accepted connection requests until their sessions start,
+        # together with the task that accepted the request
+        self._reserved = {}
+        self._sessions = set()
+
+    def _slot(self, sim_info):
+        slot = self._slots.get(sim_info.device_name)
+
+        if slot is None or slot.info is not sim_info:
+            if slot is not None:
+                slot.close()
+            slot = SimSlot(sim_info)
+            self._slots[sim_info.device_name] = slot
+
+        return slot
+
+    def find_sim(self, ident):
+        """
+        Look up a SIM card of the SimProvider
+
+        SimIds refer to SimInfo.id and SimIndexes to the position among the SIMs
+        ordered by their IDs (same as on the tunnel server).
+        """
+        sims = self.sim_provider.get_sims()
+
+        if isinstance(ident, SimId):
+            return next((x for x in sims if x.id == ident.id), None)
+        if isinstance(ident, SimIndex):
+            sims = sorted(sims, key=lambda x: x.id)
+            return sims[ident.index] if ident.index < len(sims) else None
+
+        return next((x for x in sims if _matches(x, ident)), None)
+
+    def _reserve(self, ident, sim_info):
+        if sim_info is None:
+            return ConnectStatus.NotFound
+
+        slot = self._slot(sim_info)
+
+        if slot.in_use:
+            return ConnectStatus.NotAvailable
+
+        # requests are decided on the event loop, so no other request can reserve
+        # the card before the session takes over the reservation
+        slot.in_use = True
+        self._reserved[ident] = (slot, asyncio.current_task())
+        return ConnectStatus.Success
+
+    def _release_reserved(self, task=None):
+        # reservations of requests whose sessions never started (only those
+        # accepted by task if given)
+        for ident, (slot, owner) in list(self._reserved.items()):
+            if task is None or owner is task:
+                slot.in_use = False
+                del self._reserved[ident]
+
+    def provides_sim(self, req):
+        """ConnectCallback reserving the requested SIM card for the session."""
+        return self._reserve(req.identifier, self.find_sim(req.identifier))
+
+    def stats(self):
+        """Current utilisation counters of every SIM card."""
+        return {
+            name: {
+                "in_use": slot.in_use,
+                "busy": slot.busy,
+                "sessions": slot.sessions,
+                "apdus": slot.apdus,
+            }
+            for name, slot in self._slots.items()
+        }
+
+    async def report(self):
+        """Periodically log the utilisation of every SIM card."""
+        last = {}
+        while True:
+            await asyncio.sleep(self.report_interval)
+
+            current = {x.device_name for x in self.sim_provider.get_sims()}
+            for name, slot in list(self._slots.items()):
+                if name not in current and not slot.in_use:
+                    slot.close()
+                    del self._slots[name]
+                    last.pop(name, None)
+
+            for name, s in self.stats().items():
+                busy, sessions, apdus = last.get(name, (0.0, 0, 0))
+                LOGGER.info(
+                    f"{name}: utilisation {(s['busy'] - busy) / self.report_interval:.1%}"
+                    f", sessions {s['sessions'] - sessions}, apdus {s['apdus'] - apdus}"
+                    f"{' (in use)' if s['in_use'] else ''}"
+                )
+                last[name] = (s["busy"], s["sessions"], s["apdus"])
+
+    async def _serve_session(self, ident, stream, send_atr=False):
+        slot, _ = self._reserved.pop(ident, (None, None))
+
+        if slot is None:
+            LOGGER.warning(f"session for unreserved SIM {ident}. Closing it.")
+            await stream.close()
+            return
+
+        sl = slot.info.sl
+        LOGGER.info(f"requested SIM {ident} is on device {slot.info.device_name}")
+        slot.sessions += 1
+        prefetch = None
+
+        try:
+            await slot.run(sl.connect)
+
+            if self.record_dir is not None:
+                slot.card.recorder = self._recorder(slot.info)
+
+            # the ATR is not part of the tunnel protocol
+            if send_atr:
+                await stream.send_apdu(sl.get_atr())
+
+            while (packet := await stream.recv()) is not None:
+                # the card's executor runs the prefetch before the next exchange
+                if prefetch is not None:
+                    await prefetch
+                    prefetch = None
+
+                if packet.op == ApduOp.Reset:
+                    await slot.run(slot.card.reset)
+                    continue
+
+                response = await slot.run(slot.card.transmit, packet.payload)
+                await stream.send_apdu(response)
+                slot.apdus += 1
+
+                prefetch = asyncio.ensure_future(slot.run(slot.card.prefetch))
+        except Exception as e:
+            LOGGER.warning(f"session with SIM {ident} failed: {e!r}")
+        finally:
+            if prefetch is not None:
+                await asyncio.gather(prefetch, return_exceptions=True)
+
+            try:
+                await slot.run(sl.disconnect)
+            except Exception as e:
+                LOGGER.warning(f"disconnecting {slot.info.device_name} failed: {e!r}")
+
+            if slot.card.recorder is not None:
+                slot.card.recorder.close()
+                slot.card.recorder = None
+
+            await stream.close()
+            slot.in_use = False
+            LOGGER.info(f"session with SIM {ident} closed")
+
+    def _recorder(self, sim_info):
+        name = re.sub(r"[^\w.-]", "_", sim_info.device_name)
+        path = os.path.join(self.record_dir, f"{name}-{time.time_ns()}.trace")
+
+        recorder = TraceRecorder.open(path, sim_info.iccid, sim_info.imsi)
+        recorder.atr(sim_info.sl.get_atr())
+        LOGGER.info(f"recording session with {sim_info.device_name} to {path}")
+        return recorder
+
+    def _start_session(self, ident, stream):
+        task = asyncio.create_task(self._serve_session(ident, stream))
+        self._sessions.add(task)
+        task.add_done_callback(self._sessions.discard)
+
+    async def serve_tunnel(
+        self, session_token, host, port, tls_ctx=None, server_hostname=None
+    ):
+        """
+        Serve connection requests of the tunnel server until authentication fails
+        or connecting fails repeatedly
+        """
+        client = ProviderClient(
+            session_token,
+            host,
+            port,
+            self.provides_sim,
+            tls_ctx=tls_ctx,
+            server_hostname=server_hostname,
+        )
+
+        reporter = asyncio.create_task(self.report())
+        try:
+            try:
+                await self._serve_multiplexed(client)
+            except ProtocolError:
+                LOGGER.info(
+                    "Tunnel server does not support multiplexed connections. "
+                    "Using one connection per SIM session."
+                )
+                await self._serve_connections(client)
+        finally:
+            reporter.cancel()
+            for task in list(self._sessions):
+                task.cancel()
+            await asyncio.gather(*self._sessions, return_exceptions=True)
+
+    async def _retry(self, connect):
+        failed_connections = 0
+
+        while True:
+            try:
+                result = await connect()
+            except (AuthError, ProtocolError, SimRequestError):
+                raise
+            except Exception as e:
+                LOGGER.warning(f"Error while establishing connection: {e!r}")
+                failed_connections += 1
+
+                if failed_connections > 10:
+                    raise ConnectionError(
+                        "Multiple consecutive connection attempts failed."
+                    ) from e
+
+                await asyncio.sleep(1)
+                continue
+
+            return result
+
+    async def _serve_multiplexed(self, client):
+        established = False
+
+        async def connect():
+            nonlocal established
+
+            try:
+                mux = await client.connect_multiplexed()
+            except (EOFError, ConnectionResetError) as e:
+                # servers without version 2 reject the AuthRequest by closing the
+                # connection; once version 2 worked this is a transient failure
+                if established:
+                    raise
+                raise ProtocolError(
+                    "Server closed the connection during version 2 authentication."
+                ) from e
+
+            established = True
+            return mux
+
+        while True:
+            mux = await self._retry(connect)
+
+            try:
+                while True:
+                    self._start_session(*await mux.wait_for_connection())
+            except ConnectionError:
+                LOGGER.info("multiplexed connection closed. Reconnecting.")
+            finally:
+                await mux.close()
+                self._release_reserved()
+
+    async def _serve_connections(self, client):
+        async def connect():
+            served = False
+            try:
+                result = await client.wait_for_connection()
+                served = True
+                return result
+            finally:
+                # the request might have been accepted before sending the
+                # response failed
+                if not served:
+                    self._release_reserved(asyncio.current_task())
+
+        async def accept():
+            while True:
+                try:
+                    ident, stream = await self._retry(connect)
+                except SimRequestError:
+                    continue
+
+                self._start_session(ident, stream)
+
+        # one waiting connection per SIM card so that cards are requested
+        # concurrently
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(max(len(self.sim_provider.get_sims()), 1)):
+                tg.create_task(accept())
+
+    async def serve_direct(self, host, port, tls_ctx=None):
+        """
+        Serve direct connections of probes (8 byte IMSI followed by raw APDUs)
+        """
+        reporter = asyncio.create_task(self.report())
+        server = await asyncio.start_server(
+            self._handle_direct, host, port, ssl=tls_ctx, backlog=128
+        )
+
+        LOGGER.info(f"serving direct connections on {host} port {port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reporter.cancel()
+
+    async def _handle_direct(self, reader, writer):
+        try:
+            (requested_imsi,) = struct.unpack("!Q", await reader.readexactly(8))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+
+        sim_info = next(
+            (
+                x
+                for x in self.sim_provider.get_sims()
+                if str(x.imsi) == str(requested_imsi)
+            ),
+            None,
+        )
+
+        if self._reserve(requested_imsi, sim_info) != ConnectStatus.Success:
+            LOGGER.info(f"requested imsi {requested_imsi} is currently not available")
+            writer.close()
+            return
+
+        await self._serve_session(
+            requested_imsi, _DirectStream(reader, writer), send_atr=True
+        )
+
+
+class _DirectStream:
+    """
+    Adapts a direct connection to the interface of an ApduStream
+    """
+
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    async def recv(self):
+        apdu = await self._reader.read(DIRECT_READ_SIZE)
+
+        if len(apdu) < 5:
+            return None
+
+        return _DirectPacket(apdu)
+
+    async def send_apdu(self, payload):
+        self._writer.write(payload)
+        await self._writer.drain()
+
+    async def close(self):
+        self._writer.close()
+
+
+class _DirectPacket:
+    op = ApduOp.Apdu
+
+    def __init__(self, payload):
+        self.payload = payload
+
+
+def _matches(sim_info, ident):
+    # the IMSI of cards without one is a hash that is no valid Imsi
+    try:
+        if sim_info.imsi is not None and Imsi(str(sim_info.imsi)) == ident:
+            return True
+    except ValueError:
+        pass
+
+    return sim_info.iccid is not None and Iccid(sim_info.iccid) == ident
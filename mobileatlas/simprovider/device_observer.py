@@ -1,33 +1,54 @@
 #!/usr/bin/env python3
 
 import os
+import queue
 import logging
 from threading import Event, Thread
 from serial.tools import list_ports
+from smartcard import scard
 from smartcard.CardMonitoring import CardMonitor, CardObserver
 from smartcard.System import readers
 
+try:
+    import pyudev
+except ImportError:
+    pyudev = None
+
 
 class Observer(Thread):
+    """
+    Calls observe() every sleeping_time seconds and whenever it is woken up.
+    A sleeping_time of None disables polling.
+    """
+
     def __init__(self, sleeping_time):
         super().__init__()
         self.stop_event = Event()
+        self.wakeup_event = Event()
         self.sleeping_time = sleeping_time
 
     def observe():
         raise NotImplementedError()
 
+    def wake(self):
+        self.wakeup_event.set()
+
     def run(self):
-        while not self.stop_event.wait(self.sleeping_time):
+        while not self.stop_event.is_set():
             self.observe()
+            self.wakeup_event.wait(self.sleeping_time)
+            # events arriving from here on trigger another observe()
+            self.wakeup_event.clear()
 
     def stop(self):
         self.stop_event.set()
+        self.wakeup_event.set()
 
 
 class DeviceEvent:
     DEVICE_TYPE_SERIAL = "Serial"
     DEVICE_TYPE_SCARD = "PC/SC"
+    DEVICE_TYPE_EMULATED = "Emulated"
 
     def device_added(self, device_type, device):
         raise NotImplementedError
@@ -103,20 +124,202 @@ class SerialObserver(Observer):
         self.listener.remove(obj)
 
 
+class UdevWatcher:
+    """
+    Wakes up an Observer whenever a serial device is added or removed
+    """
+
+    def __init__(self, observer):
+        if pyudev is None:
+            raise OSError("pyudev is not installed")
+
+        self.observer = observer
+        monitor = pyudev.Monitor.from_netlink(pyudev.Context())
+        monitor.filter_by(subsystem="tty")
+        self.monitor_observer = pyudev.MonitorObserver(
+            monitor, callback=self.handle_event, name="udev-observer"
+        )
+
+    def handle_event(self, device):
+        if device.action in ("add", "remove"):
+            logging.debug(f"udev: {device.action} {device.device_node}")
+            self.observer.wake()
+
+    def start(self):
+        self.monitor_observer.start()
+
+    def stop(self):
+        self.monitor_observer.send_stop()
+
+
+class PcscWatcher(Thread):
+    """
+    Waits for PC/SC reader and card events with SCardGetStatusChange
+
+    Added or removed readers wake up the Observer. Inserted and removed cards are
+    passed to the Observer as device events.
+    """
+
+    PNP_NOTIFICATION = "\\\\?PnP?\\Notification"
+
+    def __init__(self, observer):
+        super().__init__(name="pcsc-observer", daemon=True)
+        self.observer = observer
+
+        hresult, self.context = scard.SCardEstablishContext(scard.SCARD_SCOPE_USER)
+        if hresult != scard.SCARD_S_SUCCESS:
+            raise OSError(scard.SCardGetErrorMessage(hresult))
+
+        hresult, states = scard.SCardGetStatusChange(
+            self.context,
+            0,
+            [(PcscWatcher.PNP_NOTIFICATION, scard.SCARD_STATE_UNAWARE)],
+        )
+        if (
+            hresult not in (scard.SCARD_S_SUCCESS, scard.SCARD_E_TIMEOUT)
+            or states[0][1] & scard.SCARD_STATE_UNKNOWN
+        ):
+            scard.SCardReleaseContext(self.context)
+            raise OSError("PC/SC reader notifications are not supported")
+
+        self.stopped = False
+
+    def list_readers(self):
+        hresult, names = scard.SCardListReaders(self.context, [])
+        if hresult != scard.SCARD_S_SUCCESS:
+            # SCARD_E_NO_READERS_AVAILABLE
+            return []
+        return names
+
+    def run(self):
+        states = {PcscWatcher.PNP_NOTIFICATION: scard.SCARD_STATE_UNAWARE}
+
+        try:
+            while not self.stopped:
+                states = {
+                    r: states.get(r, scard.SCARD_STATE_UNAWARE)
+                    for r in [PcscWatcher.PNP_NOTIFICATION] + self.list_readers()
+                }
+
+                hresult, new_states = scard.SCardGetStatusChange(
+                    self.context, scard.INFINITE, list(states.items())
+                )
+
+                if hresult == scard.SCARD_E_CANCELLED:
+                    break
+                if hresult != scard.SCARD_S_SUCCESS:
+                    # e.g. a reader was removed while waiting; list readers again
+                    logging.debug(
+                        f"SCardGetStatusChange: {scard.SCardGetErrorMessage(hresult)}"
+                    )
+                    continue
+
+                for reader, event_state, _ in new_states:
+                    self.handle_state(reader, states[reader], event_state)
+                    states[reader] = event_state & ~scard.SCARD_STATE_CHANGED
+        except Exception as e:
+            logging.exception("Exception " + repr(e))
+        finally:
+            scard.SCardReleaseContext(self.context)
+
+    def handle_state(self, reader, current_state, event_state):
+        if not event_state & scard.SCARD_STATE_CHANGED:
+            return
+
+        if reader == PcscWatcher.PNP_NOTIFICATION:
+            self.observer.wake()
+            return
+
+        # cards that are present initially are found by the observer's first scan
+        if current_state == scard.SCARD_STATE_UNAWARE:
+            return
+
+        was_present = current_state & scard.SCARD_STATE_PRESENT
+        is_present = event_state & scard.SCARD_STATE_PRESENT
+
+        if is_present and not was_present:
+            device = DeviceObserver.get_scard_reader(reader)
+            if device is not None:
+                self.observer.post(True, DeviceEvent.DEVICE_TYPE_SCARD, device)
+        elif was_present and not is_present:
+            self.observer.post(False, DeviceEvent.DEVICE_TYPE_SCARD, reader)
+
+    def stop(self):
+        self.stopped = True
+        scard.SCardCancel(self.context)
+
+
 class DeviceObserver(SerialObserver, CardObserver):
+    """
+    Observes serial devices and PC/SC readers
+
+    Devices are discovered through udev and PC/SC events. Event sources that are
+    unavailable are replaced by polling (serial devices and readers) and pyscard's
+    CardMonitor (cards).
+    """
+
     def __init__(self):
         super().__init__()
-        self.cardmonitor = CardMonitor()
+        self.cardmonitor = None
+        self.watchers = []
+        # card events of the PcscWatcher; notified by the observer's thread
+        self.events = queue.SimpleQueue()
+
+    def start_watcher(self, watcher_type):
+        try:
+            watcher = watcher_type(self)
+        except Exception as e:
+            logging.info(f"{watcher_type.__name__} unavailable: {e}")
+            return False
+
+        watcher.start()
+        self.watchers.append(watcher)
+        return True
 
     def start(self):
-        self.cardmonitor.addObserver(self)
+        udev = self.start_watcher(UdevWatcher)
+        pcsc = self.start_watcher(PcscWatcher)
+
+        if udev and pcsc:
+            self.sleeping_time = None
+        else:
+            logging.info(f"Polling for devices every {self.sleeping_time} second(s).")
+
+        if not pcsc:
+            self.cardmonitor = CardMonitor()
+            self.cardmonitor.addObserver(self)
+
         super().start()
 
     def stop(self):
-        self.cardmonitor.deleteObserver(self)
+        if self.cardmonitor is not None:
+            self.cardmonitor.deleteObserver(self)
+        for watcher in self.watchers:
+            watcher.stop()
         super().stop()
         # self.join()
 
+    def post(self, added, device_type, device):
+        self.events.put((added, device_type, device))
+        self.wake()
+
+    def observe(self):
+        while True:
+            try:
+                added, device_type, device = self.events.get_nowait()
+            except queue.Empty:
+                break
+
+            try:
+                if added:
+                    self.notify_add(device_type, device)
+                else:
+                    self.notify_remove(device_type, device)
+            except Exception as e:
+                logging.exception("Exception " + repr(e))
+
+        super().observe()
+
     # callback from cardobserver --> convert to notifications
     def update(self, observable, actions):
         (addedcards, removedcards) = actions
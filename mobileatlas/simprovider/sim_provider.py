@@ -5,6 +5,8 @@ SIM Provider Main
 import hashlib
 import logging
 from mobileatlas.simprovider.device_observer import DeviceEvent, DeviceObserver
+from mobileatlas.simprovider.emulator import EmulatorLink
+from mobileatlas.simprovider.trace import ReplayLink
 from pySim.transport.serial import SerialSimLink
 from pySim.transport.pcsc import PcscSimLink
 from pySim.transport.bluetooth_rsap import BluetoothSapSimLink
@@ -19,35 +21,54 @@ class SimInfo:
         self.device_name = device_name
         self.atr = atr
         self.sl = sl
+        # ID the SIM is registered with; assigned by SimProvider and stable while
+        # the SIM is provided
+        self.id = None
 
 class SimProvider(DeviceEvent):
-    def __init__(self, bluetooth_mac=None):
+    def __init__(self, bluetooth_mac=None, replay_traces=(), replay_latency=False, emulated_cards=()):
         self.sims = []
         self.device_change_callback = None
+        # (device name, ICCID) -> IMSI of cards that were queried before
+        self.sim_info_cache = {}
         if bluetooth_mac:
             sl = BluetoothSapSimLink(bluetooth_mac) #("80:5A:04:0E:90:F6")
             sim = SimProvider.query_sim_info("Bluetooth[rSAP]", sl)
-            self.sims.append(sim)
+            self.add_sim(sim)
+        for path in replay_traces:
+            self.add_replay(path, replay_latency)
+        for card in emulated_cards:
+            self.add_emulated(card)
         observer = DeviceObserver()
         observer.add_observer(self)
         observer.start()
 
     def set_device_change_callback(self, callback):
+        """
+        callback(added, removed) is called with the SimInfos that were added and
+        removed whenever the set of SIM cards changes
+        """
         self.device_change_callback = callback
 
+    def notify_change(self, added, removed):
+        if (added or removed) and self.device_change_callback != None:
+            self.device_change_callback(added, removed)
+
     def device_added(self, device_type, device):
         device_name = f"{device_type}[{device}]"
-        self.prepare_sim_interface(device_name, device_type, device)
+        # a device may be reported again (e.g. a card inserted into a known reader)
+        removed = [e for e in self.sims if e.device_name == device_name]
+        self.sims = [e for e in self.sims if e.device_name != device_name]
 
-        if self.device_change_callback != None:
-            self.device_change_callback()
+        sim = self.prepare_sim_interface(device_name, device_type, device)
+        self.notify_change([sim] if sim is not None else [], removed)
 
     def device_removed(self, device_type, device):
         device_name = f"{device_type}[{device}]"
+        removed = [e for e in self.sims if e.device_name == device_name]
         self.sims = [e for e in self.sims if e.device_name != device_name]
 
-        if self.device_change_callback != None:
-            self.device_change_callback()
+        self.notify_change([], removed)
     
     def prepare_sim_interface(self, device_name, device_type, device):
         try:
@@ -55,15 +76,82 @@ class SimProvider(DeviceEvent):
                 sl = SerialSimLink(device=device)
             elif device_type == DeviceEvent.DEVICE_TYPE_SCARD:
                 sl = PcscSimLink(device.index)
-            sim = SimProvider.query_sim_info(device_name, sl)
-            self.sims.append(sim)
+            sim = self.query_sim_info_cached(device_name, sl)
         except Exception as e:
             logging.warn(f"prepare sim interface error {repr(e)}")
+            return None
+
+        if sim is not None:
+            self.add_sim(sim)
+        return sim
+
+    def add_sim(self, sim):
+        # lowest free ID, so that IDs of other SIMs are not affected
+        ids = {e.id for e in self.sims}
+        sim.id = next(i for i in range(len(self.sims) + 1) if i not in ids)
+        self.sims.append(sim)
+
+    def add_replay(self, path, latency=False):
+        """
+        Provide a recorded session (see trace.py) as if it were a card
+        """
+        sl = ReplayLink.from_file(path, latency=latency)
+        sim = SimInfo(sl.trace.iccid, sl.trace.imsi, f"Replay[{path}]", sl.get_atr(), sl)
+        self.add_sim(sim)
+        logging.info(f"replaying {path} --> imsi {sim.imsi}, iccid {sim.iccid}")
+
+    def add_emulated(self, card):
+        """
+        Provide a software SIM card (see emulator.py)
+        """
+        sl = EmulatorLink(card)
+        device_name = f"{DeviceEvent.DEVICE_TYPE_EMULATED}[{card.iccid}]"
+        self.add_sim(SimInfo(card.iccid, card.imsi, device_name, sl.get_atr(), sl))
+        logging.debug(f"emulating {device_name} --> imsi {card.imsi}")
+
+    def query_sim_info_cached(self, device_name, sl):
+        """
+        Like query_sim_info, but the IMSI of a card that was queried in the same
+        device before is not read again. The ICCID is read every time, so a card
+        that was swapped for another one is queried in full.
+        """
+        sl.connect()
+        try:
+            if SimProvider.is_scard_t1(sl):
+                return SimProvider.query_sim_info(device_name, sl, is_connected=True)
+
+            iccid, sw = SimCard(SimCardCommands(transport=sl)).read_iccid()
+            key = (device_name, iccid)
+
+            if iccid and sw == '9000' and key in self.sim_info_cache:
+                imsi = self.sim_info_cache[key]
+                logging.info(f"device {device_name} --> known card with iccid {iccid}")
+                return SimInfo(iccid, imsi, device_name, sl.get_atr(), sl)
+
+            sim = SimProvider.query_sim_info(device_name, sl, is_connected=True)
+        finally:
+            sl.disconnect()
+
+        if sim is not None:
+            self.sim_info_cache[(device_name, sim.iccid)] = sim.imsi
+        return sim
 
     def get_sims(self):
         logging.info(f"get sims {list(map(lambda x: (x.device_name,x.imsi), self.sims))}")
         return self.sims
 
+    @staticmethod
+    def is_scard_t1(sl):
+        """ https://github.com/LudovicRousseau/pyscard/blob/master/smartcard/CardConnection.py#L150
+            defaultprotocol: a bit mask of L{CardConnection.T0_protocol},
+                L{CardConnection.T1_protocol}, L{CardConnection.RAW_protocol},
+                L{CardConnection.T15_protocol}
+                Example:
+                0010 = 2 -> T1
+                0011 = 3 -> T0,T1
+        """
+        return hasattr(sl, '_con') and sl._con.component.defaultprotocol % 4 == 2
+
     @staticmethod
     def query_sim_info(device_name, sl, is_connected=False):
         """
@@ -112,16 +200,8 @@ class SimProvider(DeviceEvent):
             imsi = abs(int(hashlib.md5(canonical_name.encode()).hexdigest(), 16)) % (2**64)
             return SimInfo(None, imsi, device_name, sl.get_atr(), sl)
         
-        """ https://github.com/LudovicRousseau/pyscard/blob/master/smartcard/CardConnection.py#L150
-            defaultprotocol: a bit mask of L{CardConnection.T0_protocol},
-                L{CardConnection.T1_protocol}, L{CardConnection.RAW_protocol},
-                L{CardConnection.T15_protocol}
-                Example:
-                0010 = 2 -> T1
-                0011 = 3 -> T0,T1
-        """
         logging.info(f"device name {device_name}")
-        if hasattr(sl, '_con') and sl._con.component.defaultprotocol % 4 == 2:
+        if SimProvider.is_scard_t1(sl):
             return do_scard_t1()
         return do_sim()
 
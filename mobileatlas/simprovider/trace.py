@@ -0,0 +1,244 @@
+"""
+APDU traces of SIM card sessions
+
+A trace file holds a single session with a card:
+
+    header:   "MATR" | version (1) | len(iccid) (1) | len(imsi) (1) | iccid | imsi
+    records:  kind (1) | µs since the previous record (4) | kind specific fields
+
+    ATR:      len (2) | atr
+    RESET:    -
+    EXCHANGE: card latency in µs (4) | len(command) (2) | len(response) (2) |
+              command | response
+
+All integers are unsigned and big-endian. Traces are written by TraceRecorder
+while the provider serves a card and replayed by ReplayLink, which can be
+provided instead of a physical card.
+"""
+
+import bisect
+import logging
+import struct
+import time
+
+from pySim.transport import LinkBase
+
+LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"MATR"
+VERSION = 1
+
+ATR = 0
+RESET = 1
+EXCHANGE = 2
+
+_HEADER = struct.Struct("!4sBBB")
+_RECORD = struct.Struct("!BI")
+_ATR = struct.Struct("!H")
+_EXCHANGE = struct.Struct("!IHH")
+
+# answer to commands that are not part of the trace
+SW_NOT_RECORDED = "6f00"
+
+
+class TraceFormatError(Exception):
+    pass
+
+
+class TraceRecorder:
+    """
+    Writes the exchanges of a card session to a trace file
+    """
+
+    def __init__(self, f, iccid, imsi):
+        iccid = (iccid or "").encode()
+        imsi = str(imsi or "").encode()
+
+        self.f = f
+        self.f.write(_HEADER.pack(MAGIC, VERSION, len(iccid), len(imsi)) + iccid + imsi)
+        self.last = time.perf_counter()
+
+    @classmethod
+    def open(cls, path, iccid, imsi):
+        return cls(open(path, "wb"), iccid, imsi)
+
+    def _record(self, kind, at=None):
+        at = time.perf_counter() if at is None else at
+        delta = max(round((at - self.last) * 1e6), 0)
+        self.last = at
+        return _RECORD.pack(kind, min(delta, 0xFFFFFFFF))
+
+    def atr(self, atr):
+        atr = bytes(atr)
+        self.f.write(self._record(ATR) + _ATR.pack(len(atr)) + atr)
+
+    def reset(self):
+        self.f.write(self._record(RESET))
+
+    def exchange(self, command, response, start, end):
+        """Record a command sent at start and its response received at end."""
+        latency = min(round((end - start) * 1e6), 0xFFFFFFFF)
+        self.f.write(
+            self._record(EXCHANGE, at=start)
+            + _EXCHANGE.pack(latency, len(command), len(response))
+            + bytes(command)
+            + bytes(response)
+        )
+
+    def close(self):
+        self.f.close()
+
+
+class Trace:
+    """
+    Contents of a trace file. records is a list of (kind, delay, *fields) tuples
+    with delays in seconds.
+    """
+
+    def __init__(self, iccid, imsi, records):
+        self.iccid = iccid
+        self.imsi = imsi
+        self.records = records
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.decode(f.read())
+
+    @classmethod
+    def decode(cls, buf):
+        buf = memoryview(buf)
+
+        if len(buf) < _HEADER.size:
+            raise TraceFormatError("Trace is truncated.")
+
+        magic, version, iccid_len, imsi_len = _HEADER.unpack_from(buf)
+        if magic != MAGIC or version != VERSION:
+            raise TraceFormatError("Not a trace file or unsupported version.")
+
+        offset = _HEADER.size
+        iccid = bytes(buf[offset : offset + iccid_len]).decode()
+        offset += iccid_len
+        imsi = bytes(buf[offset : offset + imsi_len]).decode()
+        offset += imsi_len
+
+        records = []
+        try:
+            while offset < len(buf):
+                kind, delta = _RECORD.unpack_from(buf, offset)
+                offset += _RECORD.size
+                delay = delta / 1e6
+
+                if kind == ATR:
+                    (n,) = _ATR.unpack_from(buf, offset)
+                    offset += _ATR.size
+                    records.append((ATR, delay, bytes(buf[offset : offset + n])))
+                    offset += n
+                elif kind == RESET:
+                    records.append((RESET, delay))
+                elif kind == EXCHANGE:
+                    latency, cmd_len, resp_len = _EXCHANGE.unpack_from(buf, offset)
+                    offset += _EXCHANGE.size
+                    command = bytes(buf[offset : offset + cmd_len])
+                    offset += cmd_len
+                    response = bytes(buf[offset : offset + resp_len])
+                    offset += resp_len
+                    records.append((EXCHANGE, delay, latency / 1e6, command, response))
+                else:
+                    raise TraceFormatError(f"Unknown record kind: {kind}")
+        except struct.error as e:
+            raise TraceFormatError("Trace is truncated.") from e
+
+        if offset > len(buf):
+            raise TraceFormatError("Trace is truncated.")
+
+        return cls(iccid or None, imsi or None, records)
+
+
+class ReplayLink(LinkBase):
+    """
+    SIM link answering commands with the responses of a recorded session
+
+    Commands are matched against the trace in order. Commands that do not follow
+    the recorded order are answered with the next (or, failing that, the first)
+    recorded response to the same command. Commands that were never recorded are
+    answered with 6F00.
+    """
+
+    def __init__(self, trace, latency=False, speed=1.0):
+        """
+        trace: Trace to replay
+        latency: delay responses by the card latency of the recording
+        speed: factor the recorded latencies are divided by
+        """
+        super().__init__()
+        self.trace = trace
+        self.latency = latency
+        self.speed = speed
+
+        self._atr = next((r[2] for r in trace.records if r[0] == ATR), b"")
+        self._exchanges = [r for r in trace.records if r[0] == EXCHANGE]
+        # positions in self._exchanges following each reset
+        self._resets = []
+        # command -> positions in self._exchanges
+        self._positions = {}
+
+        n = 0
+        for r in trace.records:
+            if r[0] == RESET:
+                self._resets.append(n)
+            elif r[0] == EXCHANGE:
+                self._positions.setdefault(r[3], []).append(n)
+                n += 1
+
+        self._cursor = 0
+
+    @classmethod
+    def from_file(cls, path, latency=False, speed=1.0):
+        return cls(Trace.load(path), latency=latency, speed=speed)
+
+    def connect(self):
+        self._cursor = 0
+
+    def disconnect(self):
+        pass
+
+    def wait_for_card(self, timeout=None, newcardonly=False):
+        pass
+
+    def get_atr(self):
+        return self._atr
+
+    def reset_card(self):
+        # continue after the next recorded reset
+        i = bisect.bisect_left(self._resets, self._cursor)
+        self._cursor = self._resets[i] if i < len(self._resets) else 0
+        return 1
+
+    def _find(self, command):
+        positions = self._positions.get(command)
+
+        if positions is None:
+            return None
+
+        i = bisect.bisect_left(positions, self._cursor)
+        return positions[i] if i < len(positions) else positions[0]
+
+    def _send_apdu_raw(self, pdu):
+        command = bytes.fromhex(pdu)
+        pos = self._find(command)
+
+        if pos is None:
+            LOGGER.warning(f"command not in trace: {pdu}")
+            return "", SW_NOT_RECORDED
+
+        _, _, latency, _, response = self._exchanges[pos]
+        self._cursor = pos + 1
+
+        if self.latency and latency > 0:
+            time.sleep(latency / self.speed)
+
+        return response[:-2].hex(), response[-2:].hex()
+
+    def send_apdu_raw(self, pdu):
+        return self._send_apdu_raw(pdu)
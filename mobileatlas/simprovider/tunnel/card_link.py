@@ -0,0 +1,126 @@
+import logging
+import time
+
+from pySim.utils import b2h, h2b
+
+LOGGER = logging.getLogger(__name__)
+
+INS_GET_RESPONSE = 0xC0
+
+# SW1 values announcing response data that has to be fetched with GET RESPONSE
+# 61xx: ISO/IEC 7816-4; 9Fxx: 3GPP TS 51.011 9.4.1
+SW1_RESPONSE_AVAILABLE = (0x61, 0x9F)
+
+
+class CardLink:
+    """
+    Binary interface to a pySim SimLink
+
+    Whenever the card announces response data (61xx/9Fxx) it can be fetched
+    with prefetch() while the status word is relayed to the probe. The probe's
+    GET RESPONSE is then answered without another exchange with the card.
+    """
+
+    def __init__(self, sl):
+        self.sl = sl
+        # (CLA, Le) of a GET RESPONSE that still has to be sent to the card
+        self._pending = None
+        # (CLA, response) fetched from the card for the probe's GET RESPONSE
+        self._prefetched = None
+        # optional TraceRecorder recording every exchange with the card
+        self.recorder = None
+
+        # PC/SC links accept binary APDUs (see SimProvider.query_sim_info)
+        con = getattr(sl, "_con", None)
+        if con is not None and hasattr(con, "transmit"):
+            self._transmit = self._transmit_pcsc
+        else:
+            self._transmit = self._transmit_hex
+
+    def _transmit_pcsc(self, apdu):
+        data, sw1, sw2 = self.sl._con.transmit(list(apdu))
+        return bytes(data) + bytes([sw1, sw2])
+
+    def _transmit_hex(self, apdu):
+        data, sw = self.sl.send_apdu_raw(b2h(apdu))
+        return h2b(data + sw)
+
+    def _exchange(self, apdu):
+        if self.recorder is None:
+            return self._transmit(apdu)
+
+        start = time.perf_counter()
+        response = self._transmit(apdu)
+        self.recorder.exchange(apdu, response, start, time.perf_counter())
+        return response
+
+    def transmit(self, apdu):
+        """
+        Send a command APDU to the card and return the response APDU (data + SW)
+        """
+        prefetched = self._prefetched
+        self._prefetched = None
+        self._pending = None
+
+        if (
+            prefetched is not None
+            and len(apdu) == 5
+            and apdu[0] == prefetched[0]
+            and apdu[1] == INS_GET_RESPONSE
+            and apdu[2] == 0
+            and apdu[3] == 0
+        ):
+            return self._get_response(prefetched, apdu[4])
+
+        response = self._exchange(apdu)
+
+        if len(response) == 2 and response[0] in SW1_RESPONSE_AVAILABLE:
+            self._pending = (apdu[0], response[1])
+
+        return response
+
+    def prefetch(self):
+        """
+        Fetch the response data announced by the card's last response (if any)
+        """
+        if self._pending is None:
+            return
+
+        cla, le = self._pending
+        self._pending = None
+
+        response = self._exchange(bytes([cla, INS_GET_RESPONSE, 0, 0, le]))
+        LOGGER.debug(f"prefetched response to GET RESPONSE: {len(response)} bytes")
+        self._prefetched = (cla, response)
+
+    def _get_response(self, prefetched, le):
+        cla, response = prefetched
+        data, sw = response[:-2], response[-2:]
+
+        if le == 0:
+            le = 256
+
+        if le > len(data) and sw[0] == 0x90:
+            # wrong length; same as the card would answer (ETSI TS 102 221 7.3.1.1.5)
+            self._prefetched = prefetched
+            return bytes([0x6C, len(data)])
+
+        if le < len(data):
+            if cla == 0xA0:
+                # GSM SIMs return the first le bytes (3GPP TS 51.011 9.2.18)
+                return data[:le] + sw
+
+            rest = data[le:]
+            self._prefetched = (cla, rest + sw)
+            return data[:le] + bytes([0x61, len(rest) % 256])
+
+        return response
+
+    def reset(self):
+        self._pending = None
+        self._prefetched = None
+        self.sl.reset_card()
+
+        if self.recorder is not None:
+            self.recorder.reset()
+            self.recorder.atr(self.sl.get_atr())
@@ -1,8 +1,9 @@
 import socket
 import threading
+import queue
 import logging
-from pySim.transport import LinkBase
-from pySim.utils import b2h, h2b
+from moatt_types.connect import ApduOp
+from mobileatlas.simprovider.tunnel.card_link import CardLink
 
 class APDUMessageException(Exception):
     pass
@@ -10,10 +11,20 @@ class APDUMessageException(Exception):
 class SimTunnel(threading.Thread):
     """
     Connect a SimLink with a TCP Connection
+
+    Packets of the probe are relayed by a pipeline of three threads connected by
+    bounded queues: a reader receiving packets, a worker (this thread) exchanging
+    APDUs with the card and a writer sending the responses. After handing a
+    response to the writer the worker fetches response data announced by the
+    card (61xx/9Fxx), so the probe's GET RESPONSE is answered without waiting
+    for the card.
     """
+    QUEUE_SIZE = 16
+
     def __init__(self, connection, sl, iccid, do_pbs=True, direct_connection=False):
         self.connection = connection
         self.sl = sl
+        self.card = CardLink(sl)
         self.iccid = iccid
         self.probe_endpoint = connection.getpeername()[0]
         self.do_pbs = do_pbs
@@ -36,8 +47,11 @@ class SimTunnel(threading.Thread):
         Loop to receive data for local SIM
         """
         try:
-            while self.connected:
-                self.process_packet()
+            if self.direct_connection:
+                while self.connected:
+                    self.process_packet()
+            else:
+                self.relay()
         except APDUMessageException as e:
             logging.info(e)
         except Exception as e:
@@ -52,19 +66,86 @@ class SimTunnel(threading.Thread):
             except:
                 self.connection.close()
 
-    def process_packet_indirect(self):
-        apdu = self.connection.recv()
+    def relay(self):
+        """
+        Relay packets of the probe until it closes the connection
+        """
+        packets = queue.Queue(maxsize=SimTunnel.QUEUE_SIZE)
+        responses = queue.Queue(maxsize=SimTunnel.QUEUE_SIZE)
+
+        reader = threading.Thread(target=self._read_packets, args=(packets,), daemon=True)
+        writer = threading.Thread(target=self._write_responses, args=(responses,), daemon=True)
+        reader.start()
+        writer.start()
+
+        try:
+            while True:
+                packet = packets.get()
+
+                if isinstance(packet, Exception):
+                    raise packet
+
+                if packet is None:
+                    logging.info("peer closed connection")
+                    break
 
-        if apdu == None:
+                self.process_packet_indirect(packet, responses)
+        finally:
             self.connected = False
-            logging.info("peer closed connection")
+            responses.put(None)
+            writer.join()
+
+            # unblock the reader; it stops once the connection is closed
+            while not packets.empty():
+                packets.get_nowait()
+
+    def _read_packets(self, packets):
+        try:
+            while True:
+                packet = self.connection.recv()
+                packets.put(packet)
+
+                if packet is None:
+                    return
+        except Exception as e:
+            packets.put(e)
+
+    def _write_responses(self, responses):
+        failed = False
+
+        while True:
+            response = responses.get()
+
+            if response is None:
+                return
+
+            # keep consuming after a failure so that the worker is never blocked
+            if failed:
+                continue
+
+            try:
+                self.connection.send_apdu(response)
+            except Exception as e:
+                logging.warning(f"sending response failed: {e!r}")
+                failed = True
+
+    def process_packet_indirect(self, packet, responses):
+        if packet.op == ApduOp.Reset:
+            logging.debug("resetting card")
+            self.card.reset()
             return
 
-        logging.info(f"received apdu[{len(apdu.payload)}]: {b2h(apdu.payload)}")
-        data, sw = self.sl.send_apdu(b2h(apdu.payload))
-        resp = h2b(data + sw)
-        self.connection.send_apdu(resp) # TODO: handle apdu ops
-        logging.info(f"sent data: {resp}")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"received apdu[{len(packet.payload)}]: {packet.payload.hex()}")
+
+        resp = self.card.transmit(packet.payload)
+        responses.put(resp)
+
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug(f"sent data: {resp.hex()}")
+
+        # overlaps with relaying the response
+        self.card.prefetch()
 
     def process_packet_direct(self):
         # receive 5 header bytes (cla, ins, p1, p2, p3)
@@ -74,19 +155,14 @@ class SimTunnel(threading.Thread):
             self.connected = False
             raise APDUMessageException(f"not enough bytes received: {apdu}")
 
-        logging.info(f"received apdu[{len(apdu)}]: {b2h(apdu)}")
-        data, sw = self.sl.send_apdu(b2h(apdu))
+        logging.debug(f"received apdu[{len(apdu)}]: {apdu.hex()}")
 
-        resp = h2b(data + sw)
+        resp = self.card.transmit(apdu)
         self.connection.send(resp)
-        logging.info(f"sent data: {resp}")
+        logging.debug(f"sent data: {resp.hex()}")
 
     def process_packet(self):
         """
-        Retrieve and process packets
+        Retrieve and process packets of direct connections
         """
-
-        if self.direct_connection:
-            self.process_packet_direct()
-        else:
-            self.process_packet_indirect()
+        self.process_packet_direct()
@@ -0,0 +1,96 @@
+"""Micro-benchmarks of the wire protocol types in `moatt_types.connect`.
+
+Every message type is encoded and decoded both into fresh and into
+caller-provided buffers. The round-trip and truncation properties of the codecs
+are checked by the tests of `moatt_types`.
+
+Example:
+
+    python bench/bench_codecs.py --number 100000
+"""
+
+import argparse
+import random
+import timeit
+import uuid
+
+from moatt_types.connect import (
+    ApduOp,
+    ApduPacket,
+    AuthRequest,
+    AuthResponse,
+    AuthStatus,
+    AuthType,
+    ConnectionRequestFlags,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    Iccid,
+    Imsi,
+    MuxOp,
+    MuxPacket,
+    SimId,
+    SimIndex,
+    Token,
+)
+
+
+def messages(rng: random.Random) -> list:
+    """A typical message of every type"""
+    provider = uuid.UUID(bytes=rng.randbytes(16))
+
+    return [
+        # typical command APDU
+        ApduPacket(ApduOp.Apdu, rng.randbytes(13)),
+        MuxPacket(rng.getrandbits(32), MuxOp.Apdu, rng.randbytes(13)),
+        Imsi("232010000000001"),
+        Iccid("89430000000000000001"),
+        SimId(provider, 1),
+        SimIndex(provider, 1),
+        AuthRequest(AuthType.Probe, Token(rng.randbytes(32)), version=2),
+        AuthResponse(AuthStatus.Success, version=2),
+        ConnectRequest(SimId(provider, 1), ConnectionRequestFlags.NO_WAIT),
+        ConnectResponse(ConnectStatus.Success),
+    ]
+
+
+def bench(rng: random.Random, number: int) -> None:
+    print(
+        f"{'type':<16}{'encode':>12}{'encode_into':>14}{'decode':>12}"
+        f"{'decode_from':>14}  (ns/op)"
+    )
+
+    for msg in messages(rng):
+        cls = type(msg)
+        encoded = msg.encode()
+        buf = bytearray(len(encoded))
+        view = memoryview(encoded)
+
+        res = []
+        for stmt in (
+            lambda: msg.encode(),
+            lambda: msg.encode_into(buf),
+            lambda: cls.decode(encoded),
+            lambda: cls.decode_from(view),
+        ):
+            t = min(timeit.repeat(stmt, number=number, repeat=5))
+            res.append(t / number * 1e9)
+
+        print(
+            f"{cls.__name__:<16}{res[0]:>12.0f}{res[1]:>14.0f}{res[2]:>12.0f}"
+            f"{res[3]:>14.0f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--number", type=int, default=100_000, help="Calls per measurement."
+    )
+    args = parser.parse_args()
+
+    bench(random.Random(0), args.number)
+
+
+if __name__ == "__main__":
+    main()
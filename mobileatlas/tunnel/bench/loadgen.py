@@ -0,0 +1,612 @@
+"""Load generator for the tunnel server.
+
+Starts a tunnel server backed by a local database and a permissive auth handler,
+connects simulated providers serving scripted in-memory SIM cards and lets
+probes (`ProbeClient`) open sessions to random SIM cards.
+
+Reports connection setup latency, APDU round trip times and throughput.
+
+The server, the providers and the probes run in separate processes so that they
+do not compete for the same interpreter. Probes use one thread each.
+
+Example:
+
+    python bench/loadgen.py --providers 1000 --sims 2 --probes 500 --sessions 10
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import ssl
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Optional
+from uuid import UUID
+
+import uvloop
+from sqlalchemy import Engine, delete, event, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from moatt_clients.probe_client import ProbeClient
+from moatt_clients.streams import RawStream
+from moatt_server import auth, config
+from moatt_server import models as dbm
+from moatt_server.auth_handler import AuthHandler, AuthResult, SimIdent
+from moatt_server.tunnel import cli
+from moatt_server.tunnel.server import Server
+from moatt_server.tunnel.util import read_msg, write_msg
+from moatt_types.connect import (
+    ApduOp,
+    ApduPacket,
+    AuthRequest,
+    AuthResponse,
+    AuthStatus,
+    AuthType,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    MuxOp,
+    MuxPacket,
+    SimId,
+    Token,
+)
+
+LOGGER = logging.getLogger("loadgen")
+
+DEFAULT_CONFIG = Path(__file__).parent / "bench-config.toml"
+
+# SELECT MF, READ BINARY (9 bytes)
+DEFAULT_APDUS = ["00A40004023F00", "00B0000009"]
+
+SW_OK = b"\x90\x00"
+
+
+class BenchAuthHandler(AuthHandler):
+    """Allows everything. Tokens consist of a prefix and the client's ID."""
+
+    PROVIDER_PREFIX = b"provider:"
+    PROBE_PREFIX = b"probe:"
+
+    @staticmethod
+    def provider_token(provider_id: UUID) -> Token:
+        return Token(BenchAuthHandler.PROVIDER_PREFIX + provider_id.bytes)
+
+    @staticmethod
+    def probe_token(probe_id: UUID) -> Token:
+        return Token(BenchAuthHandler.PROBE_PREFIX + probe_id.bytes)
+
+    async def allowed_provider_registration(self, token: Token) -> AuthResult:
+        return AuthResult.Success
+
+    async def allowed_sim_registration(
+        self, token: Token, sims: list[SimIdent]
+    ) -> AuthResult:
+        return AuthResult.Success
+
+    async def allowed_probe_registration(self, token: Token) -> AuthResult:
+        return AuthResult.Success
+
+    async def allowed_sim_request(
+        self, token: Token, provider_id: UUID, sim_id: SimIdent
+    ) -> AuthResult:
+        return AuthResult.Success
+
+    async def identity(self, token: Token) -> UUID | None:
+        for prefix in (self.PROVIDER_PREFIX, self.PROBE_PREFIX):
+            if token.token.startswith(prefix):
+                return UUID(bytes=token.token[len(prefix) :])
+
+        return None
+
+
+class ScriptedSim:
+    """In-memory SIM card answering commands from a fixed script.
+
+    Responses are looked up by the instruction byte of a command. READ BINARY and
+    READ RECORD commands are answered with as many bytes as were requested.
+    Unknown instructions are answered with "instruction not supported".
+    """
+
+    DEFAULT_SCRIPT = {
+        0xA4: SW_OK,  # SELECT
+        0xC0: SW_OK,  # GET RESPONSE
+        0xF2: SW_OK,  # STATUS
+        0x20: SW_OK,  # VERIFY PIN
+        0x88: bytes(16) + SW_OK,  # AUTHENTICATE
+    }
+
+    def __init__(self, script: Optional[dict[int, bytes]] = None):
+        self.script = script if script is not None else ScriptedSim.DEFAULT_SCRIPT
+
+    def respond(self, command: bytes) -> bytes:
+        if len(command) < 4:
+            return b"\x67\x00"  # wrong length
+
+        ins = command[1]
+
+        if ins in (0xB0, 0xB2):
+            le = command[4] if len(command) > 4 else 0
+            return bytes(le if le != 0 else 256) + SW_OK
+
+        return self.script.get(ins, b"\x6d\x00")
+
+
+@dataclass
+class ProbeResult:
+    setup: list[float] = field(default_factory=list)
+    rtt: list[float] = field(default_factory=list)
+    failed_sessions: int = 0
+    apdu_bytes: int = 0
+
+    def merge(self, other: "ProbeResult") -> None:
+        self.setup.extend(other.setup)
+        self.rtt.extend(other.rtt)
+        self.failed_sessions += other.failed_sessions
+        self.apdu_bytes += other.apdu_bytes
+
+
+async def _authenticate(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    token: Token,
+    version: int,
+) -> int:
+    await write_msg(writer, AuthRequest(AuthType.Provider, token, version=version))
+    auth_res = await read_msg(reader, AuthResponse.decode)
+
+    if auth_res.status != AuthStatus.Success:
+        raise ConnectionError(f"Authentication failed: {auth_res.status}")
+
+    return auth_res.version
+
+
+async def _provider_v1(
+    args: argparse.Namespace,
+    token: Token,
+    sim: ScriptedSim,
+    ready: Optional[Callable[[], None]],
+) -> None:
+    """Provider waiting for sessions on a connection each (protocol version 1)."""
+    while True:
+        reader, writer = await asyncio.open_connection(
+            args.host, args.port, ssl=args.client_tls
+        )
+
+        try:
+            await _authenticate(reader, writer, token, version=1)
+
+            if ready is not None:
+                ready()
+                ready = None
+
+            await read_msg(reader, ConnectRequest.decode)
+            await write_msg(writer, ConnectResponse(ConnectStatus.Success))
+
+            while True:
+                packet = await read_msg(reader, ApduPacket.decode)
+
+                if packet.op == ApduOp.Apdu:
+                    await write_msg(
+                        writer, ApduPacket(ApduOp.Apdu, sim.respond(packet.payload))
+                    )
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _provider_mux(
+    args: argparse.Namespace, token: Token, sim: ScriptedSim, ready: Callable[[], None]
+) -> None:
+    """Provider serving all sessions on a single connection (protocol version 2)."""
+    reader, writer = await asyncio.open_connection(
+        args.host, args.port, ssl=args.client_tls
+    )
+
+    try:
+        if await _authenticate(reader, writer, token, version=2) != 2:
+            raise ConnectionError("Server does not support multiplexed connections.")
+
+        ready()
+
+        while True:
+            packet = await read_msg(reader, MuxPacket.decode)
+
+            match packet.op:
+                case MuxOp.ConnectRequest:
+                    writer.write(
+                        MuxPacket(
+                            packet.stream_id,
+                            MuxOp.ConnectResponse,
+                            ConnectResponse(ConnectStatus.Success).encode(),
+                        ).encode()
+                    )
+                case MuxOp.Apdu:
+                    writer.write(
+                        MuxPacket(
+                            packet.stream_id, MuxOp.Apdu, sim.respond(packet.payload)
+                        ).encode()
+                    )
+
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+def _run_providers(
+    args: argparse.Namespace, provider_ids: list[UUID], ready_event
+) -> None:
+    sim = ScriptedSim()
+    pending = len(provider_ids) * (1 if args.protocol == 2 else args.sims)
+
+    def ready():
+        nonlocal pending
+        pending -= 1
+        if pending == 0:
+            ready_event.set()
+
+    async def run():
+        async with asyncio.TaskGroup() as tg:
+            for provider_id in provider_ids:
+                token = BenchAuthHandler.provider_token(provider_id)
+
+                if args.protocol == 2:
+                    tg.create_task(_provider_mux(args, token, sim, ready))
+                else:
+                    for _ in range(args.sims):
+                        tg.create_task(_provider_v1(args, token, sim, ready))
+
+                # start connecting while the remaining tasks are created
+                await asyncio.sleep(0)
+
+    uvloop.run(run())
+
+
+def _run_server(args: argparse.Namespace) -> None:
+    # the server shuts down gracefully (flushing buffered APDU logs) when it
+    # receives SIGINT
+    if config.get_config().TUNNEL_WORKERS > 1:
+        cli._run_workers(args.host, args.port, args.server_tls)
+        return
+
+    server = Server(config.get_config(), args.host, args.port, args.server_tls)
+
+    try:
+        uvloop.run(server.start())
+    except KeyboardInterrupt:
+        pass
+
+
+def _run_probe(
+    args: argparse.Namespace, sims: list[SimId], apdus: list[bytes]
+) -> ProbeResult:
+    res = ProbeResult()
+    client = ProbeClient(
+        BenchAuthHandler.probe_token(uuid.uuid4()),
+        args.host,
+        args.port,
+        tls_ctx=args.client_tls,
+    )
+
+    for _ in range(args.sessions):
+        sim = random.choice(sims)
+        start = time.perf_counter()
+
+        try:
+            if args.client_tls is not None:
+                stream = client.connect(sim)
+            else:
+                # ProbeClient.connect always uses TLS
+                stream = client._connect(
+                    RawStream(socket.create_connection((args.host, args.port))), sim
+                )
+        except Exception as e:
+            LOGGER.debug(f"Session setup failed: {e!r}")
+            res.failed_sessions += 1
+            continue
+
+        res.setup.append(time.perf_counter() - start)
+
+        try:
+            for i in range(args.apdus):
+                command = apdus[i % len(apdus)]
+
+                start = time.perf_counter()
+                stream.send_apdu(command)
+                response = stream.recv()
+                res.rtt.append(time.perf_counter() - start)
+
+                if response is None:
+                    raise ConnectionError("Provider closed session.")
+
+                res.apdu_bytes += len(command) + len(response.payload)
+        except Exception as e:
+            LOGGER.debug(f"Session failed: {e!r}")
+            res.failed_sessions += 1
+        finally:
+            stream.close()
+
+    return res
+
+
+async def _register_providers(
+    provider_ids: list[UUID], sims_per_provider: int
+) -> list[SimId]:
+    engine = create_async_engine(config.get_config().db_url())
+    sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(dbm.Base.metadata.create_all)
+
+    sims = []
+    async with sessionmaker() as session, session.begin():
+        for provider_id in provider_ids:
+            await auth.register_provider(
+                session,
+                BenchAuthHandler.provider_token(provider_id),
+                {i: (None, None) for i in range(sims_per_provider)},
+            )
+            sims.extend(SimId(provider_id, i) for i in range(sims_per_provider))
+
+    await engine.dispose()
+    return sims
+
+
+async def _remove_providers(provider_ids: list[UUID]) -> None:
+    engine = create_async_engine(config.get_config().db_url())
+
+    async with engine.begin() as conn:
+        await conn.execute(delete(dbm.Sim).where(dbm.Sim.provider_id.in_(provider_ids)))
+        await conn.execute(
+            delete(dbm.Provider).where(dbm.Provider.id.in_(provider_ids))
+        )
+
+    await engine.dispose()
+
+
+def _use_immediate_transactions() -> None:
+    """Make SQLite transactions take the write lock when they begin.
+
+    SQLite cannot upgrade the read locks of concurrent transactions to write locks
+    and fails with "database is locked" instead of waiting for each other.
+    """
+
+    @event.listens_for(Engine, "connect")
+    def connect(dbapi_connection, _):
+        # disable pysqlite's own transaction handling
+        dbapi_connection.isolation_level = None
+
+        # readers do not have to wait for writers
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+    @event.listens_for(Engine, "begin")
+    def begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _wait_for_server(host: str, port: int, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            socket.create_connection((host, port)).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+
+def _summary(values: list[float]) -> dict[str, Any]:
+    if len(values) == 0:
+        return {"count": 0}
+
+    values = sorted(values)
+
+    def pct(p: float) -> float:
+        return values[min(len(values) - 1, int(p * len(values)))] * 1000
+
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": pct(0.5),
+        "p90_ms": pct(0.9),
+        "p99_ms": pct(0.99),
+        "p999_ms": pct(0.999),
+        "max_ms": values[-1] * 1000,
+    }
+
+
+def _report(res: ProbeResult, elapsed: float) -> dict[str, Any]:
+    return {
+        "elapsed_s": elapsed,
+        "sessions": len(res.setup),
+        "failed_sessions": res.failed_sessions,
+        "sessions_per_s": len(res.setup) / elapsed,
+        "apdus_per_s": len(res.rtt) / elapsed,
+        "apdu_bytes_per_s": res.apdu_bytes / elapsed,
+        "setup_latency": _summary(res.setup),
+        "apdu_rtt": _summary(res.rtt),
+    }
+
+
+def _print_report(report: dict[str, Any]) -> None:
+    print(
+        f"{report['sessions']} sessions ({report['failed_sessions']} failed) "
+        f"in {report['elapsed_s']:.2f}s"
+    )
+    print(
+        f"throughput: {report['sessions_per_s']:.1f} sessions/s, "
+        f"{report['apdus_per_s']:.1f} APDUs/s, "
+        f"{report['apdu_bytes_per_s'] / 1024:.1f} KiB/s"
+    )
+
+    for name in ("setup_latency", "apdu_rtt"):
+        s = report[name]
+        if s["count"] == 0:
+            print(f"{name}: no samples")
+            continue
+
+        print(
+            f"{name} (ms): "
+            + " ".join(
+                f"{k.removesuffix('_ms')}={v:.3f}"
+                for k, v in s.items()
+                if k.endswith("_ms")
+            )
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+
+    parser.add_argument("--config", default=DEFAULT_CONFIG, help="Server config.")
+    parser.add_argument(
+        "--db-url",
+        help="SQLAlchemy URL of the database to use. (default: temporary SQLite DB)",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, help="(default: random free port)")
+    parser.add_argument("--workers", type=int, help="Number of server workers.")
+    parser.add_argument("--cert", help="Server certificate. (default: plain TCP)")
+    parser.add_argument("--cert-key", help="Key for the server certificate.")
+    parser.add_argument("--providers", type=int, default=100)
+    parser.add_argument("--sims", type=int, default=1, help="SIM cards per provider.")
+    parser.add_argument(
+        "--protocol",
+        type=int,
+        choices=(1, 2),
+        default=2,
+        help="Provider protocol version (2: multiplexed connections).",
+    )
+    parser.add_argument("--probes", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=10, help="Sessions per probe.")
+    parser.add_argument("--apdus", type=int, default=20, help="APDUs per session.")
+    parser.add_argument(
+        "--apdu",
+        action="append",
+        help="Hex encoded APDU sent by the probes. (can be repeated)",
+    )
+    parser.add_argument("--json", action="store_true", help="Print report as JSON.")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    if args.db_url is None and args.workers is not None and args.workers > 1:
+        # workers interrupted in the middle of a transaction keep the SQLite
+        # database locked and fail to exit
+        parser.error("Multiple workers require a database server (--db-url).")
+
+    tmpdir = tempfile.TemporaryDirectory(prefix="moat-loadgen-")
+
+    os.environ["DB_URL"] = (
+        args.db_url
+        if args.db_url is not None
+        else f"sqlite+aiosqlite:///{tmpdir.name}/moat.db?timeout=60"
+    )
+    if make_url(os.environ["DB_URL"]).get_backend_name() == "sqlite":
+        _use_immediate_transactions()
+
+    os.environ["AUTH_HANDLER"] = f"{__name__}:BenchAuthHandler"
+    config.init_config(
+        args.config,
+        True,
+        argparse.Namespace(
+            host=None, port=None, cert=None, cert_key=None, workers=args.workers
+        ),
+    )
+
+    if args.port is None:
+        args.port = _free_port(args.host)
+
+    args.server_tls = None
+    args.client_tls = None
+    if args.cert is not None:
+        args.server_tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        args.server_tls.load_cert_chain(args.cert, args.cert_key)
+        args.client_tls = ssl.create_default_context(cafile=args.cert)
+
+    apdus = [bytes.fromhex(a) for a in (args.apdu or DEFAULT_APDUS)]
+    provider_ids = [uuid.uuid4() for _ in range(args.providers)]
+    sims = uvloop.run(_register_providers(provider_ids, args.sims))
+
+    ctx = multiprocessing.get_context("fork")
+    ready = ctx.Event()
+    server = ctx.Process(target=_run_server, args=(args,), name="server")
+    providers = ctx.Process(
+        target=_run_providers, args=(args, provider_ids, ready), name="providers"
+    )
+
+    try:
+        server.start()
+        _wait_for_server(args.host, args.port, 60)
+
+        start = time.perf_counter()
+        providers.start()
+        if not ready.wait(600):
+            raise TimeoutError("Providers did not connect in time.")
+        LOGGER.info(
+            f"{args.providers} providers connected in "
+            f"{time.perf_counter() - start:.2f}s."
+        )
+
+        res = ProbeResult()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.probes) as executor:
+            for r in executor.map(
+                lambda _: _run_probe(args, sims, apdus), range(args.probes)
+            ):
+                res.merge(r)
+        elapsed = time.perf_counter() - start
+    finally:
+        if providers.is_alive():
+            providers.terminate()
+        if providers.pid is not None:
+            providers.join()
+
+        if server.is_alive():
+            os.kill(server.pid, signal.SIGINT)
+        if server.pid is not None:
+            server.join(30)
+            if server.is_alive():
+                LOGGER.warning("Server did not shut down in time. Killing it.")
+                server.kill()
+                server.join()
+
+        if args.db_url is not None:
+            uvloop.run(_remove_providers(provider_ids))
+        tmpdir.cleanup()
+
+    report = _report(res, elapsed)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        _print_report(report)
+
+
+if __name__ == "__main__":
+    main()
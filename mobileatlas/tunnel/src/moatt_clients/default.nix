@@ -13,6 +13,7 @@ in rec {
     moatt-types
 
     requests
+    urllib3
     pydantic
   ];
 
@@ -0,0 +1,7 @@
+"""asyncio versions of the tunnel clients.
+
+The modules of this package mirror the blocking clients (`moatt_clients.streams`,
+`moatt_clients.probe_client`, ...) but all network operations are coroutines.
+Any number of sessions can be served by a single event loop and every blocking
+operation accepts an optional timeout and can be cancelled.
+"""
@@ -0,0 +1,111 @@
+import asyncio
+import inspect
+import logging
+import ssl
+from collections.abc import Awaitable, Callable
+from typing import Optional
+
+from moatt_clients.aio.streams import RawStream
+from moatt_clients.errors import AuthError, ProtocolError
+from moatt_types.connect import (
+    AuthRequest,
+    AuthResponse,
+    AuthStatus,
+    AuthType,
+    ConnectRequest,
+    ConnectStatus,
+    Token,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+# decides whether a requested SIM card is available; may be a coroutine function
+ConnectCallback = Callable[[ConnectRequest], ConnectStatus | Awaitable[ConnectStatus]]
+
+# seconds between heartbeats of idle provider connections; has to be shorter than
+# the server's provider idle timeout
+HEARTBEAT_INTERVAL = 30.0
+
+
+async def _decide(cb: ConnectCallback, conn_req: ConnectRequest) -> ConnectStatus:
+    status = cb(conn_req)
+
+    if inspect.isawaitable(status):
+        status = await status
+
+    return status
+
+
+async def _send_heartbeats(
+    send: Callable[[], Awaitable[None]], interval: float
+) -> None:
+    """Call send every interval seconds until cancelled or the connection fails."""
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            await send()
+    except (ConnectionError, OSError) as e:
+        LOGGER.debug(f"Stopped sending heartbeats: {e!r}")
+
+
+class _Client:
+    """
+    Base class for the asyncio Provider- and ProbeClient classes.
+    Should not be used directly.
+    """
+
+    def __init__(
+        self,
+        session_token: Token,
+        host,
+        port,
+        tls_ctx: Optional[ssl.SSLContext] = None,
+        server_hostname=None,
+    ):
+        self.session_token = session_token
+        self.host = host
+        self.port = port
+        self.tls_ctx = tls_ctx if tls_ctx is not None else ssl.create_default_context()
+        self.server_hostname = server_hostname if server_hostname is not None else host
+
+    async def _open_stream(self) -> RawStream:
+        LOGGER.debug("Opening connection.")
+        try:
+            reader, writer = await asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=self.tls_ctx,
+                server_hostname=self.server_hostname,
+            )
+        except OSError as e:
+            LOGGER.warning(f"Could not connect to server: {e}")
+            raise ConnectionError from e
+
+        return RawStream(reader, writer)
+
+    async def _authenticate(
+        self, auth_type: AuthType, stream: RawStream, version: int = 1
+    ) -> int:
+        """Authenticate with the server.
+
+        Returns
+        -------
+        The protocol version chosen by the server. (At most `version`.)
+        """
+        LOGGER.debug("Sending authorisation message.")
+        await stream.write_all(
+            AuthRequest(auth_type, self.session_token, version=version).encode()
+        )
+        LOGGER.debug("Waiting for authorisation response.")
+        auth_res = await stream.read_message(AuthResponse.decode)
+
+        if auth_res.status != AuthStatus.Success:
+            LOGGER.warning("Authentication failed!")
+            raise AuthError(auth_res.status)
+
+        if auth_res.version > version:
+            raise ProtocolError(
+                f"Server chose unsupported protocol version {auth_res.version}."
+            )
+
+        return auth_res.version
@@ -0,0 +1,310 @@
+import asyncio
+import logging
+from typing import Optional
+
+from moatt_clients.aio.client import (
+    HEARTBEAT_INTERVAL,
+    ConnectCallback,
+    _decide,
+    _send_heartbeats,
+)
+from moatt_clients.aio.streams import RawStream
+from moatt_clients.errors import ProtocolError
+from moatt_types.connect import (
+    ApduOp,
+    ApduPacket,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    MuxOp,
+    MuxPacket,
+    SimIdentifierType,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MultiplexedConnection:
+    """Provider connection carrying multiple SIM sessions (protocol version 2).
+
+    Packets are received by a background task and dispatched to the sessions
+    returned by `wait_for_connection`. Must be created from within a running event
+    loop.
+    """
+
+    def __init__(
+        self,
+        stream: RawStream,
+        cb: ConnectCallback,
+        heartbeat_interval: Optional[float] = HEARTBEAT_INTERVAL,
+    ):
+        """
+        Parameters
+        ----------
+        stream
+            Authenticated stream using protocol version 2.
+        cb
+            Callback (or coroutine function) deciding whether requested SIM card
+            is available.
+        heartbeat_interval
+            Seconds between heartbeats keeping the connection alive or None to not
+            send heartbeats.
+        """
+        self._stream = stream
+        self._cb = cb
+        self._streams: dict[int, MuxApduStream] = {}
+        self._requests: asyncio.Queue[
+            Optional[tuple[SimIdentifierType, MuxApduStream]]
+        ] = asyncio.Queue()
+        self._closed = False
+        # connection requests whose callbacks are still running
+        self._pending: set[asyncio.Task] = set()
+
+        self._reader = asyncio.create_task(self._read_loop(), name="mux-reader")
+        self._heartbeats = None
+        if heartbeat_interval is not None:
+            self._heartbeats = asyncio.create_task(
+                _send_heartbeats(self.send_heartbeat, heartbeat_interval),
+                name="mux-heartbeats",
+            )
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def getpeername(self):
+        return self._stream.getpeername()
+
+    async def wait_for_connection(
+        self, timeout: Optional[float] = None
+    ) -> tuple[SimIdentifierType, "MuxApduStream"]:
+        """Wait for the next accepted connection request.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        Identifier of the requested SIM card and an ApduStream-like session.
+
+        Raises
+        ------
+        ConnectionError
+            If the connection was closed.
+        TimeoutError
+            If no request was accepted before the timeout expired.
+        """
+        async with asyncio.timeout(timeout):
+            r = await self._requests.get()
+
+        if r is None:
+            # wake up any other waiting tasks as well
+            self._requests.put_nowait(None)
+            raise ConnectionError("Multiplexed connection was closed.")
+
+        return r
+
+    async def send_heartbeat(self) -> None:
+        """Send a heartbeat to keep the connection alive while it is idle."""
+        await self._write(MuxPacket(0, MuxOp.Heartbeat))
+
+    async def close(self) -> None:
+        """Close the connection and all of its sessions."""
+        if self._closed:
+            return
+
+        self._closed = True
+        self._reader.cancel()
+        if self._heartbeats is not None:
+            self._heartbeats.cancel()
+
+        for task in self._pending:
+            task.cancel()
+
+        try:
+            await self._stream.close()
+        except OSError:
+            pass
+
+        # wait for the sessions to be notified
+        await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def _write(self, packet: MuxPacket) -> None:
+        if self._closed:
+            raise ConnectionError("Multiplexed connection was closed.")
+
+        # a single write is atomic, so packets of concurrent sessions never
+        # interleave
+        await self._stream.write_all(packet.encode())
+
+    async def _close_stream(self, stream: "MuxApduStream") -> None:
+        if self._streams.get(stream.stream_id) is not stream:
+            return
+        del self._streams[stream.stream_id]
+
+        try:
+            await self._write(MuxPacket(stream.stream_id, MuxOp.Close))
+        except (ConnectionError, OSError):
+            pass
+
+    async def _read_loop(self) -> None:
+        try:
+            while True:
+                self._dispatch(await self._stream.read_message(MuxPacket.decode))
+        except EOFError:
+            LOGGER.info("Server closed multiplexed connection.")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if not self._closed:
+                LOGGER.warning(f"Multiplexed connection failed: {e!r}")
+        finally:
+            self._closed = True
+            if self._heartbeats is not None:
+                self._heartbeats.cancel()
+
+            streams = list(self._streams.values())
+            self._streams.clear()
+
+            for s in streams:
+                s._feed(None)
+
+            self._requests.put_nowait(None)
+
+    def _dispatch(self, packet: MuxPacket) -> None:
+        match packet.op:
+            case MuxOp.ConnectRequest:
+                task = asyncio.create_task(
+                    self._handle_request(packet.stream_id, packet.payload)
+                )
+                self._pending.add(task)
+                task.add_done_callback(self._pending.discard)
+            case MuxOp.Apdu | MuxOp.Reset:
+                stream = self._streams.get(packet.stream_id)
+                if stream is not None:
+                    stream._feed(packet.to_apdu())
+            case MuxOp.Heartbeat:
+                pass
+            case MuxOp.Close:
+                stream = self._streams.pop(packet.stream_id, None)
+                if stream is not None:
+                    stream._feed(None)
+            case _:
+                raise ProtocolError(f"Unexpected packet: {packet.op}")
+
+    async def _handle_request(self, stream_id: int, payload: bytes) -> None:
+        # requests are handled concurrently so that slow callbacks do not hold up
+        # the sessions sharing this connection
+        try:
+            conn_req = ConnectRequest.decode(payload)
+            LOGGER.debug(f"Received request for SIM: {conn_req.identifier}")
+
+            status = await _decide(self._cb, conn_req)
+
+            stream = None
+            if status == ConnectStatus.Success:
+                # register the session before responding so that no APDU is missed
+                stream = MuxApduStream(self, stream_id)
+                self._streams[stream_id] = stream
+
+            LOGGER.debug(f"Sending connection response with status: {status}")
+            await self._write(
+                MuxPacket(
+                    stream_id, MuxOp.ConnectResponse, ConnectResponse(status).encode()
+                )
+            )
+        except (ConnectionError, OSError):
+            return
+        except Exception as e:
+            LOGGER.warning(f"Handling connection request failed: {e!r}")
+            # same as a malformed packet; ends the connection
+            self._reader.cancel()
+            return
+
+        if stream is None:
+            LOGGER.info(
+                f"Rejected request for SIM '{conn_req.identifier}' with '{status}'"
+            )
+            return
+
+        self._requests.put_nowait((conn_req.identifier, stream))
+
+
+class MuxApduStream:
+    """A single SIM session of a MultiplexedConnection.
+
+    Provides the same interface as `moatt_clients.aio.streams.ApduStream`.
+    """
+
+    def __init__(self, connection: MultiplexedConnection, stream_id: int):
+        self.stream_id = stream_id
+        self._connection = connection
+        self._packets: asyncio.Queue[Optional[ApduPacket]] = asyncio.Queue()
+        self._closed = False
+
+    def _feed(self, packet: Optional[ApduPacket]) -> None:
+        self._packets.put_nowait(packet)
+
+    def getpeername(self):
+        return self._connection.getpeername()
+
+    async def send_apdu(self, payload: bytes) -> None:
+        """Wraps payload in an APDU packet and sends it.
+
+        Parameters
+        ----------
+        payload
+            Payload to send.
+        """
+        await self.send(ApduPacket(ApduOp.Apdu, payload))
+
+    async def send_reset(self) -> None:
+        """Sends a reset signal."""
+        await self.send(ApduPacket(ApduOp.Reset, b""))
+
+    async def send(self, packet: ApduPacket) -> None:
+        """Sends an ApduPacket.
+
+        Parameters
+        ----------
+        packet
+            APDU to send.
+        """
+        await self._connection._write(MuxPacket.from_apdu(self.stream_id, packet))
+
+    async def recv(self, timeout: Optional[float] = None) -> Optional[ApduPacket]:
+        """Receive an APDU.
+
+        Cancelling this coroutine never loses packets.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        An APDU or None if the session was closed.
+
+        Raises
+        ------
+        TimeoutError
+            If no APDU was received before the timeout expired.
+        """
+        if self._closed:
+            return None
+
+        async with asyncio.timeout(timeout):
+            p = await self._packets.get()
+
+        if p is None:
+            self._closed = True
+
+        return p
+
+    async def close(self) -> None:
+        """Close the session. The underlying connection stays open."""
+        self._closed = True
+        await self._connection._close_stream(self)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import ssl
+from typing import Optional
+
+from moatt_clients.aio.client import _Client
+from moatt_clients.aio.streams import ApduStream, RawStream
+from moatt_clients.errors import SimRequestError
+from moatt_clients.probe_client import fmt_error
+from moatt_types.connect import (
+    AuthType,
+    ConnectionRequestFlags,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    Iccid,
+    Imsi,
+    SimId,
+    SimIndex,
+    Token,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ProbeClient(_Client):
+    """Client able to establish connections with SIM providers."""
+
+    def __init__(
+        self,
+        session_token: Token,
+        host: str,
+        port: str | int,
+        tls_ctx: Optional[ssl.SSLContext] = None,
+        server_hostname: Optional[str] = None,
+        no_wait: bool = False,
+        urgent: bool = False,
+    ):
+        """
+
+        Parameters
+        ----------
+        session_token
+            Session token to use for this connection.
+        host
+            Server host.
+        port
+            Server port.
+        tls_ctx
+            Optional TLS configuration.
+        server_hostname
+            Optional TLS server hostname used in server certificate validation.
+        no_wait
+            Whether the client is willing to wait for the requested SIM card to become
+            available.
+        urgent
+            Ask the server to serve the connection request before other waiting
+            requests. (Whether this is honoured depends on the server's configuration.)
+        """
+        super().__init__(
+            session_token, host, port, tls_ctx=tls_ctx, server_hostname=server_hostname
+        )
+        self.no_wait = no_wait
+        self.urgent = urgent
+
+    async def connect(
+        self,
+        sim_id: Imsi | Iccid | SimId | SimIndex,
+        timeout: Optional[float] = None,
+    ) -> ApduStream:
+        """Establish a connection with a SIM provider.
+
+        Parameters
+        ----------
+        sim_id
+            The SIM card to request the connection for.
+        timeout
+            Maximum number of seconds to wait for the connection to be established
+            (including the time the SIM card is busy).
+
+        Raises
+        ------
+        TimeoutError
+            If the connection was not established before the timeout expired.
+        """
+        async with asyncio.timeout(timeout):
+            stream = await self._open_stream()
+
+            try:
+                return await self._connect(stream, sim_id)
+            except BaseException as e:
+                logger.error(f"Connection failed ({fmt_error(e)}). Closing connection.")
+                await stream.close()
+                raise
+
+    async def _connect(
+        self, stream: RawStream, sim_id: Imsi | Iccid | SimId | SimIndex
+    ) -> ApduStream:
+        await self._authenticate(AuthType.Probe, stream)
+
+        logger.debug(f"Sending connection request ({sim_id})")
+
+        flags = ConnectionRequestFlags.DEFAULT
+        if self.no_wait:
+            flags |= ConnectionRequestFlags.NO_WAIT
+        if self.urgent:
+            flags |= ConnectionRequestFlags.URGENT
+
+        await stream.write_all(ConnectRequest(sim_id, flags=flags).encode())
+
+        logger.debug("Waiting for answer to connection request message.")
+        conn_res = await stream.read_message(ConnectResponse.decode)
+
+        if conn_res.status != ConnectStatus.Success:
+            logger.info(f"Requesting SIM {sim_id} failed!")
+            raise SimRequestError(conn_res.status, sim_id)
+
+        return ApduStream(stream)
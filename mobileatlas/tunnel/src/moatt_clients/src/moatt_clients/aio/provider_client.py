@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import ssl
+from typing import Optional
+
+from moatt_clients.aio.client import (
+    HEARTBEAT_INTERVAL,
+    ConnectCallback,
+    _Client,
+    _decide,
+)
+from moatt_clients.aio.multiplex import MultiplexedConnection
+from moatt_clients.aio.streams import ApduStream, RawStream
+from moatt_clients.errors import ProtocolError, SimRequestError
+from moatt_types.connect import (
+    PROTOCOL_VERSION,
+    AuthType,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    SimIdentifierType,
+    Token,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ProviderClient(_Client):
+    """
+    Client used to provide SIM cards to the MobileAtlas tunnel server.
+    """
+
+    def __init__(
+        self,
+        session_token: Token,
+        host: str,
+        port: int,
+        cb: ConnectCallback,
+        tls_ctx: Optional[ssl.SSLContext] = None,
+        server_hostname=None,
+    ):
+        """
+        Parameters
+        ----------
+        session_token
+            Session token to use
+        host
+            Tunnel-Server hostname
+        port
+            Port of the Tunnel-Server
+        cb
+            Callback (or coroutine function) deciding whether requested SIM card
+            is available.
+        tls_ctx
+            Optional TLS configuration.
+        server_hostname
+            Optional TLS server hostname used in server certificate validation.
+        """
+        self.cb = cb
+        super().__init__(
+            session_token, host, port, tls_ctx=tls_ctx, server_hostname=server_hostname
+        )
+
+    async def connect_multiplexed(
+        self,
+        timeout: Optional[float] = None,
+        heartbeat_interval: Optional[float] = HEARTBEAT_INTERVAL,
+    ) -> MultiplexedConnection:
+        """Open a single connection that can carry many SIM sessions.
+
+        Connection requests are accepted by calling `wait_for_connection` on the
+        returned connection. This avoids a TLS handshake and authentication per
+        session.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait for the connection to be established.
+        heartbeat_interval
+            Seconds between heartbeats keeping the connection alive or None to not
+            send heartbeats.
+
+        Raises
+        ------
+        ProtocolError
+            If the server does not support multiplexed connections.
+        TimeoutError
+            If the connection was not established before the timeout expired.
+        """
+        async with asyncio.timeout(timeout):
+            stream = await self._open_stream()
+
+            try:
+                version = await self._authenticate(
+                    AuthType.Provider, stream, version=PROTOCOL_VERSION
+                )
+
+                if version < 2:
+                    raise ProtocolError(
+                        "Server does not support multiplexed connections."
+                    )
+            except BaseException as e:
+                LOGGER.warning(f"Could not open multiplexed connection: {e!r}")
+                await stream.close()
+                raise
+
+        return MultiplexedConnection(stream, self.cb, heartbeat_interval)
+
+    async def wait_for_connection(
+        self, timeout: Optional[float] = None
+    ) -> tuple[SimIdentifierType, ApduStream]:
+        """Wait for a single connection request.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait for a connection request.
+
+        Returns
+        -------
+        Identifier of the requested SIM card and connected ApduStream.
+
+        Raises
+        ------
+        TimeoutError
+            If no connection request was accepted before the timeout expired.
+        """
+        async with asyncio.timeout(timeout):
+            stream = await self._open_stream()
+
+            try:
+                return await self._wait_for_connection(stream)
+            except BaseException as e:
+                LOGGER.warning(
+                    f"Exception was raised while waiting for connection: {e!r}"
+                )
+                await stream.close()
+                raise
+
+    async def _wait_for_connection(
+        self,
+        stream: RawStream,
+    ) -> tuple[SimIdentifierType, ApduStream]:
+        await self._authenticate(AuthType.Provider, stream)
+
+        LOGGER.debug("Waiting for connection request.")
+        conn_req = await stream.read_message(ConnectRequest.decode)
+
+        LOGGER.debug(f"Received request for SIM: {conn_req.identifier}")
+
+        status = await _decide(self.cb, conn_req)
+
+        LOGGER.debug(f"Sending connection response with status: {status}")
+        await stream.write_all(ConnectResponse(status).encode())
+
+        if status != ConnectStatus.Success:
+            LOGGER.info(
+                f"Rejected request for SIM '{conn_req.identifier}' with '{status}'"
+            )
+            raise SimRequestError(status, conn_req.identifier)
+
+        return (conn_req.identifier, ApduStream(stream))
@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import logging
+from collections.abc import Callable
+from typing import Optional, TypeVar
+
+from moatt_types.connect import ApduOp, ApduPacket, PartialInput
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class RawStream:
+    """Buffered connection to the tunnel server.
+
+    Buffering is done by the asyncio.StreamReader. Messages are read with as few
+    reads as their decoders allow.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+
+    def getpeername(self):
+        return self._writer.get_extra_info("peername")
+
+    async def write_all(self, buf: bytes) -> None:
+        self._writer.write(buf)
+        await self._writer.drain()
+
+    async def read_message(self, decoder: Callable[[bytes], T]) -> T:
+        """Read a single message.
+
+        Raises
+        ------
+        EOFError
+            If the stream ends before the message was received completely.
+        """
+        buf = b""
+
+        while True:
+            try:
+                return decoder(buf)
+            except PartialInput as e:
+                buf += await self.read_exactly(e.bytes_missing)
+
+    async def read_exactly(self, n: int, eof_ok: bool = False) -> bytes:
+        """Read exactly n bytes.
+
+        Raises
+        ------
+        EOFError
+            If the stream ends before n bytes were read. If eof_ok is set and the
+            stream ended before any byte was read, b"" is returned instead.
+        """
+        try:
+            return await self._reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            if eof_ok and len(e.partial) == 0:
+                return b""
+            raise EOFError from None
+
+    async def close(self) -> None:
+        self._writer.close()
+
+        # the server might not answer the TLS close_notify
+        with contextlib.suppress(Exception):
+            await self._writer.wait_closed()
+
+
+class ApduStream:
+    def __init__(self, stream: RawStream):
+        self.stream = stream
+
+    def getpeername(self):
+        return self.stream.getpeername()
+
+    async def send_apdu(self, payload: bytes) -> None:
+        """Wraps payload in an APDU packet and sends it.
+
+        Parameters
+        ----------
+        payload
+            Payload to send.
+        """
+        await self.send(ApduPacket(ApduOp.Apdu, payload))
+
+    async def send_reset(self) -> None:
+        """Sends a reset signal."""
+        await self.send(ApduPacket(ApduOp.Reset, b""))
+
+    async def send_heartbeat(self) -> None:
+        """Sends a heartbeat to keep an idle connection alive."""
+        await self.send(ApduPacket(ApduOp.Heartbeat, b""))
+
+    async def send(self, packet: ApduPacket) -> None:
+        """Sends an ApduPacket.
+
+        Parameters
+        ----------
+        packet
+            APDU to send.
+        """
+        await self.stream.write_all(packet.encode())
+
+    async def recv(self, timeout: Optional[float] = None) -> Optional[ApduPacket]:
+        """Receive an APDU. Heartbeats are skipped.
+
+        Cancelling this coroutine (or exceeding the timeout) while a packet was
+        partially received leaves the stream in an undefined state. It should be
+        closed afterwards.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        An APDU or None on EOF
+
+        Raises
+        ------
+        EOFError
+            If a partial APDU was received before EOF of the underlying stream.
+        TimeoutError
+            If no APDU was received before the timeout expired.
+        """
+        async with asyncio.timeout(timeout):
+            while True:
+                p = await self._recv_packet()
+
+                if p is None or p.op != ApduOp.Heartbeat:
+                    return p
+
+    async def _recv_packet(self) -> Optional[ApduPacket]:
+        header = await self.stream.read_exactly(ApduPacket.HEADER_LEN, eof_ok=True)
+
+        if len(header) == 0:
+            return None
+
+        op, plen = ApduPacket.decode_header(header)
+        payload = await self.stream.read_exactly(plen) if plen > 0 else b""
+
+        return ApduPacket(op, payload)
+
+    async def close(self) -> None:
+        """Close the stream."""
+        await self.stream.close()
@@ -1,6 +1,7 @@
 import logging
 import ssl
-from typing import Optional
+import threading
+from typing import Callable, Optional
 
 from moatt_clients.errors import AuthError, ProtocolError
 from moatt_clients.streams import RawStream
@@ -8,6 +9,37 @@ from moatt_types.connect import AuthRequest, AuthResponse, AuthStatus, AuthType,
 
 LOGGER = logging.getLogger(__name__)
 
+# seconds between heartbeats of idle provider connections; has to be shorter than
+# the server's provider idle timeout
+HEARTBEAT_INTERVAL = 30.0
+
+
+def _start_heartbeats(send: Callable[[], None], interval: float) -> Callable[[], None]:
+    """Call send every interval seconds from a background thread.
+
+    Returns
+    -------
+    Function stopping the heartbeats. Once it returned no heartbeat is sent anymore.
+    """
+    stop = threading.Event()
+
+    def loop():
+        try:
+            while not stop.wait(interval):
+                send()
+        except (ConnectionError, OSError) as e:
+            LOGGER.debug(f"Stopped sending heartbeats: {e!r}")
+
+    thread = threading.Thread(target=loop, name="heartbeats", daemon=True)
+    thread.start()
+
+    def stop_heartbeats():
+        stop.set()
+        if thread is not threading.current_thread():
+            thread.join()
+
+    return stop_heartbeats
+
 
 class _Client:
     """
@@ -29,9 +61,19 @@ class _Client:
         self.tls_ctx = tls_ctx if tls_ctx is not None else ssl.create_default_context()
         self.server_hostname = server_hostname if server_hostname is not None else host
 
-    def _authenticate(self, auth_type: AuthType, stream: RawStream) -> None:
+    def _authenticate(
+        self, auth_type: AuthType, stream: RawStream, version: int = 1
+    ) -> int:
+        """Authenticate with the server.
+
+        Returns
+        -------
+        The protocol version chosen by the server. (At most `version`.)
+        """
         LOGGER.debug("Sending authorisation message.")
-        stream.write_all(AuthRequest(auth_type, self.session_token).encode())
+        stream.write_all(
+            AuthRequest(auth_type, self.session_token, version=version).encode()
+        )
         LOGGER.debug("Waiting for authorisation response.")
         auth_res = stream.read_message(AuthResponse.decode)
 
@@ -44,3 +86,10 @@ class _Client:
         if auth_res.status != AuthStatus.Success:
             LOGGER.warn("Authentication failed!")
             raise AuthError(auth_res.status)
+
+        if auth_res.version > version:
+            raise ProtocolError(
+                f"Server chose unsupported protocol version {auth_res.version}."
+            )
+
+        return auth_res.version
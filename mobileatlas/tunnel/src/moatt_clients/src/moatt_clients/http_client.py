@@ -0,0 +1,112 @@
+import logging
+import random
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+LOGGER = logging.getLogger(__name__)
+
+# responses telling the client that its request was not processed
+_NOT_PROCESSED = frozenset([429, 503])
+
+
+class _Retry(Retry):
+    """Retry policy with full jitter backoff.
+
+    Requests with idempotent methods are retried on connection and read errors
+    and on server errors. Other requests (i.e., registrations) are only retried if
+    they cannot have been processed by the server, so that retrying never
+    registers a client twice.
+    """
+
+    def is_retry(
+        self, method: str, status_code: int, has_retry_after: bool = False
+    ) -> bool:
+        if method.upper() not in Retry.DEFAULT_ALLOWED_METHODS:
+            return bool(self.total) and status_code in _NOT_PROCESSED
+
+        return super().is_retry(method, status_code, has_retry_after)
+
+    def get_backoff_time(self) -> float:
+        # spreads out the retries of clients that failed at the same time
+        return random.uniform(0, super().get_backoff_time())
+
+
+class HttpClient:
+    """Pooled HTTP client used for all REST calls of `moatt_clients`.
+
+    Connections are kept alive and reused between calls. Failed requests are
+    retried with exponential backoff. Instances are thread-safe.
+    """
+
+    def __init__(
+        self,
+        retries: int = 5,
+        backoff_factor: float = 0.5,
+        backoff_max: float = 60,
+        timeout: Optional[float | tuple[float, float]] = (10, 60),
+        pool_maxsize: int = 10,
+    ):
+        """
+        Parameters
+        ----------
+        retries
+            Maximum number of retries per request.
+        backoff_factor
+            Upper bound of the delay before the second retry in seconds. The bound
+            doubles with every further retry. (The first retry is immediate.)
+        backoff_max
+            Maximum delay between retries in seconds.
+        timeout
+            Default timeout of requests in seconds. (Either a single value or a
+            tuple of the connect and the read timeout.)
+        pool_maxsize
+            Maximum number of connections kept alive per host.
+        """
+        self.timeout = timeout
+
+        retry = _Retry(
+            total=retries,
+            backoff_factor=backoff_factor,
+            backoff_max=backoff_max,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=pool_maxsize)
+
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Send a request. Takes the same arguments as `requests.request`."""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def close(self) -> None:
+        """Close all pooled connections."""
+        self.session.close()
+
+    def __enter__(self) -> "HttpClient":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+_DEFAULT_LOCK = threading.Lock()
+_default: Optional[HttpClient] = None
+
+
+def default_client() -> HttpClient:
+    """The HttpClient used by REST calls that are not passed a client explicitly."""
+    global _default
+
+    with _DEFAULT_LOCK:
+        if _default is None:
+            _default = HttpClient()
+
+        return _default
@@ -1,15 +1,22 @@
 import logging
+from typing import Optional
 
 import requests
 from moatt_types.connect import Token
 from pydantic import ValidationError
 
 from . import types
+from .http_client import HttpClient, default_client
 
 LOGGER = logging.getLogger(__name__)
 
 
-def register_probe(api_url: str, mam_token: Token, tunnel_token: Token) -> Token:
+def register_probe(
+    api_url: str,
+    mam_token: Token,
+    tunnel_token: Token,
+    client: Optional[HttpClient] = None,
+) -> Token:
     """Register a client using valid management server and SIM tunnel tokens.
 
     Parameters
@@ -20,6 +27,8 @@ def register_probe(api_url: str, mam_token: Token, tunnel_token: Token) -> Token
         MobileAtlas probe API access token (the token used to register the probe)
     tunnel_token
         MobileAtlas SIM tunnel token
+    client
+        HTTP client to use. (default: `http_client.default_client()`)
 
     Returns
     -------
@@ -28,7 +37,9 @@ def register_probe(api_url: str, mam_token: Token, tunnel_token: Token) -> Token
     url = f"{api_url}/tunnel/probe"
 
     headers = {"Authorization": f"Bearer {mam_token.as_base64()}"}
-    r = requests.post(url, headers=headers, json={"token": tunnel_token.as_base64()})
+    r = (client or default_client()).request(
+        "POST", url, headers=headers, json={"token": tunnel_token.as_base64()}
+    )
 
     try:
         r.raise_for_status()
@@ -46,7 +57,9 @@ def register_probe(api_url: str, mam_token: Token, tunnel_token: Token) -> Token
         raise
 
 
-def deregister_probe(api_url: str, session_token: Token) -> bool:
+def deregister_probe(
+    api_url: str, session_token: Token, client: Optional[HttpClient] = None
+) -> bool:
     """Deregister a probe session token.
 
     Parameters
@@ -55,15 +68,19 @@ def deregister_probe(api_url: str, session_token: Token) -> bool:
         API base URL (e.g., 'https://example.com/api/v1')
     session_token
         Session token to deregister.
+    client
+        HTTP client to use. (default: `http_client.default_client()`)
 
     Returns
     -------
     Whether deregistration was successful.
     """
-    return _deregister(f"{api_url}/tunnel/probe", session_token)
+    return _deregister(f"{api_url}/tunnel/probe", session_token, client)
 
 
-def register_provider(api_url: str, tunnel_token: Token) -> Token:
+def register_provider(
+    api_url: str, tunnel_token: Token, client: Optional[HttpClient] = None
+) -> Token:
     """Register a SIM provider using a valid SIM tunnel token.
 
     Parameters
@@ -72,6 +89,8 @@ def register_provider(api_url: str, tunnel_token: Token) -> Token:
         API base URL (e.g., 'https://example.com/api/v1')
     tunnel_token
         MobileAtlas SIM tunnel token
+    client
+        HTTP client to use. (default: `http_client.default_client()`)
 
     Returns
     -------
@@ -80,7 +99,7 @@ def register_provider(api_url: str, tunnel_token: Token) -> Token:
     url = f"{api_url}/tunnel/provider"
 
     headers = {"Authorization": f"Bearer {tunnel_token.as_base64()}"}
-    r = requests.post(url, headers=headers)
+    r = (client or default_client()).request("POST", url, headers=headers)
 
     try:
         r.raise_for_status()
@@ -98,7 +117,9 @@ def register_provider(api_url: str, tunnel_token: Token) -> Token:
         raise
 
 
-def deregister_provider(api_url: str, session_token: Token) -> bool:
+def deregister_provider(
+    api_url: str, session_token: Token, client: Optional[HttpClient] = None
+) -> bool:
     """Deregister a provider session token.
 
     Parameters
@@ -107,17 +128,21 @@ def deregister_provider(api_url: str, session_token: Token) -> bool:
         API base URL (e.g., 'https://example.com/api/v1')
     session_token
         Session token to deregister.
+    client
+        HTTP client to use. (default: `http_client.default_client()`)
 
     Returns
     -------
     Whether deregistration was successful.
     """
 
-    return _deregister(f"{api_url}/tunnel/provider", session_token)
+    return _deregister(f"{api_url}/tunnel/provider", session_token, client)
 
 
-def _deregister(url: str, session_token: Token) -> bool:
-    r = requests.delete(url, json=session_token.as_base64())
+def _deregister(url: str, session_token: Token, client: Optional[HttpClient]) -> bool:
+    r = (client or default_client()).request(
+        "DELETE", url, json=session_token.as_base64()
+    )
 
     if r.status_code != requests.codes.ok:
         return False
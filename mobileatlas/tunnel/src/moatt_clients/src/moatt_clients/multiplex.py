@@ -0,0 +1,272 @@
+import logging
+import queue
+import threading
+from typing import Callable, Optional
+
+from moatt_clients.client import HEARTBEAT_INTERVAL, _start_heartbeats
+from moatt_clients.errors import ProtocolError
+from moatt_clients.streams import RawStream
+from moatt_types.connect import (
+    ApduOp,
+    ApduPacket,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    MuxOp,
+    MuxPacket,
+    SimIdentifierType,
+)
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MultiplexedConnection:
+    """Provider connection carrying multiple SIM sessions (protocol version 2).
+
+    Packets are received by a background thread and dispatched to the sessions
+    returned by `wait_for_connection`.
+    """
+
+    def __init__(
+        self,
+        stream: RawStream,
+        cb: Callable[[ConnectRequest], ConnectStatus],
+        heartbeat_interval: Optional[float] = HEARTBEAT_INTERVAL,
+    ):
+        """
+        Parameters
+        ----------
+        stream
+            Authenticated stream using protocol version 2.
+        cb
+            Callback deciding whether requested SIM card is available.
+        heartbeat_interval
+            Seconds between heartbeats keeping the connection alive or None to not
+            send heartbeats.
+        """
+        self._stream = stream
+        self._cb = cb
+        self._write_lock = threading.Lock()
+        self._streams_lock = threading.Lock()
+        self._streams: dict[int, MuxApduStream] = {}
+        self._requests: queue.Queue[
+            Optional[tuple[SimIdentifierType, MuxApduStream]]
+        ] = queue.Queue()
+        self._closed = False
+
+        self._reader = threading.Thread(
+            target=self._read_loop, name="mux-reader", daemon=True
+        )
+        self._reader.start()
+
+        self._stop_heartbeats = None
+        if heartbeat_interval is not None:
+            self._stop_heartbeats = _start_heartbeats(
+                self.send_heartbeat, heartbeat_interval
+            )
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def getpeername(self):
+        return self._stream.getpeername()
+
+    def wait_for_connection(
+        self, timeout: Optional[float] = None
+    ) -> tuple[SimIdentifierType, "MuxApduStream"]:
+        """Wait for the next accepted connection request.
+
+        Parameters
+        ----------
+        timeout
+            Maximum number of seconds to wait.
+
+        Returns
+        -------
+        Identifier of the requested SIM card and an ApduStream-like session.
+
+        Raises
+        ------
+        ConnectionError
+            If the connection was closed.
+        queue.Empty
+            If no request was accepted before the timeout expired.
+        """
+        r = self._requests.get(timeout=timeout)
+
+        if r is None:
+            # wake up any other waiting threads as well
+            self._requests.put(None)
+            raise ConnectionError("Multiplexed connection was closed.")
+
+        return r
+
+    def send_heartbeat(self) -> None:
+        """Send a heartbeat to keep the connection alive while it is idle."""
+        self._write(MuxPacket(0, MuxOp.Heartbeat))
+
+    def close(self) -> None:
+        """Close the connection and all of its sessions."""
+        if self._closed:
+            return
+
+        self._closed = True
+        if self._stop_heartbeats is not None:
+            self._stop_heartbeats()
+
+        try:
+            self._stream.close()
+        except OSError:
+            pass
+
+    def _write(self, packet: MuxPacket) -> None:
+        if self._closed:
+            raise ConnectionError("Multiplexed connection was closed.")
+
+        with self._write_lock:
+            self._stream.write_all(packet.encode())
+
+    def _close_stream(self, stream: "MuxApduStream") -> None:
+        with self._streams_lock:
+            if self._streams.get(stream.stream_id) is not stream:
+                return
+            del self._streams[stream.stream_id]
+
+        try:
+            self._write(MuxPacket(stream.stream_id, MuxOp.Close))
+        except (ConnectionError, OSError):
+            pass
+
+    def _read_loop(self) -> None:
+        try:
+            while True:
+                self._dispatch(self._stream.read_message(MuxPacket.decode))
+        except EOFError:
+            LOGGER.info("Server closed multiplexed connection.")
+        except Exception as e:
+            if not self._closed:
+                LOGGER.warning(f"Multiplexed connection failed: {e}")
+        finally:
+            self._closed = True
+
+            with self._streams_lock:
+                streams = list(self._streams.values())
+                self._streams.clear()
+
+            for s in streams:
+                s._feed(None)
+
+            self._requests.put(None)
+
+    def _dispatch(self, packet: MuxPacket) -> None:
+        match packet.op:
+            case MuxOp.ConnectRequest:
+                self._handle_request(packet.stream_id, packet.payload)
+            case MuxOp.Apdu | MuxOp.Reset:
+                with self._streams_lock:
+                    stream = self._streams.get(packet.stream_id)
+                if stream is not None:
+                    stream._feed(packet.to_apdu())
+            case MuxOp.Heartbeat:
+                pass
+            case MuxOp.Close:
+                with self._streams_lock:
+                    stream = self._streams.pop(packet.stream_id, None)
+                if stream is not None:
+                    stream._feed(None)
+            case _:
+                raise ProtocolError(f"Unexpected packet: {packet.op}")
+
+    def _handle_request(self, stream_id: int, payload: bytes) -> None:
+        conn_req = ConnectRequest.decode(payload)
+        LOGGER.debug(f"Received request for SIM: {conn_req.identifier}")
+
+        status = self._cb(conn_req)
+
+        stream = None
+        if status == ConnectStatus.Success:
+            # register the session before responding so that no APDU is missed
+            stream = MuxApduStream(self, stream_id)
+            with self._streams_lock:
+                self._streams[stream_id] = stream
+
+        LOGGER.debug(f"Sending connection response with status: {status}")
+        self._write(
+            MuxPacket(
+                stream_id, MuxOp.ConnectResponse, ConnectResponse(status).encode()
+            )
+        )
+
+        if stream is None:
+            LOGGER.info(
+                f"Rejected request for SIM '{conn_req.identifier}' with '{status}'"
+            )
+            return
+
+        self._requests.put((conn_req.identifier, stream))
+
+
+class MuxApduStream:
+    """A single SIM session of a MultiplexedConnection.
+
+    Provides the same interface as ApduStream.
+    """
+
+    def __init__(self, connection: MultiplexedConnection, stream_id: int):
+        self.stream_id = stream_id
+        self._connection = connection
+        self._packets: queue.Queue[Optional[ApduPacket]] = queue.Queue()
+        self._closed = False
+
+    def _feed(self, packet: Optional[ApduPacket]) -> None:
+        self._packets.put(packet)
+
+    def getpeername(self):
+        return self._connection.getpeername()
+
+    def send_apdu(self, payload: bytes) -> None:
+        """Wraps payload in an APDU packet and sends it.
+
+        Parameters
+        ----------
+        payload
+            Payload to send.
+        """
+        self.send(ApduPacket(ApduOp.Apdu, payload))
+
+    def send_reset(self) -> None:
+        """Sends a reset signal."""
+        self.send(ApduPacket(ApduOp.Reset, b""))
+
+    def send(self, packet: ApduPacket) -> None:
+        """Sends an ApduPacket.
+
+        Parameters
+        ----------
+        packet
+            APDU to send.
+        """
+        self._connection._write(MuxPacket.from_apdu(self.stream_id, packet))
+
+    def recv(self) -> Optional[ApduPacket]:
+        """Receive an APDU. Blocks until an APDU is received.
+
+        Returns
+        -------
+        An APDU or None if the session was closed.
+        """
+        if self._closed:
+            return None
+
+        p = self._packets.get()
+
+        if p is None:
+            self._closed = True
+
+        return p
+
+    def close(self) -> None:
+        """Close the session. The underlying connection stays open."""
+        self._closed = True
+        self._connection._close_stream(self)
@@ -33,6 +33,7 @@ class ProbeClient(_Client):
         tls_ctx: Optional[ssl.SSLContext] = None,
         server_hostname: Optional[str] = None,
         no_wait: bool = False,
+        urgent: bool = False,
     ):
         """
 
@@ -51,11 +52,15 @@ class ProbeClient(_Client):
         no_wait
             Whether the client is willing to wait for the requested SIM card to become
             available.
+        urgent
+            Ask the server to serve the connection request before other waiting
+            requests. (Whether this is honoured depends on the server's configuration.)
         """
         super().__init__(
             session_token, host, port, tls_ctx=tls_ctx, server_hostname=server_hostname
         )
         self.no_wait = no_wait
+        self.urgent = urgent
 
     def connect(self, sim_id: Imsi | Iccid | SimId | SimIndex) -> ApduStream:
         """Establish a connection with a SIM provider.
@@ -96,6 +101,8 @@ class ProbeClient(_Client):
         flags = ConnectionRequestFlags.DEFAULT
         if self.no_wait:
             flags |= ConnectionRequestFlags.NO_WAIT
+        if self.urgent:
+            flags |= ConnectionRequestFlags.URGENT
 
         stream.write_all(ConnectRequest(sim_id, flags=flags).encode())
 
@@ -5,10 +5,13 @@ import ssl
 from typing import Any, Callable, Optional
 
 import requests
-from moatt_clients.client import ProtocolError, _Client
+from moatt_clients.client import HEARTBEAT_INTERVAL, ProtocolError, _Client
 from moatt_clients.errors import SimRequestError
+from moatt_clients.http_client import HttpClient, default_client
+from moatt_clients.multiplex import MultiplexedConnection
 from moatt_clients.streams import ApduStream, RawStream
 from moatt_types.connect import (
+    PROTOCOL_VERSION,
     AuthType,
     ConnectRequest,
     ConnectResponse,
@@ -21,6 +24,8 @@ from moatt_types.connect import (
 
 LOGGER = logging.getLogger(__name__)
 
+SIMS_VERSION_HEADER = "Sims-Version"
+
 
 @dataclasses.dataclass
 class SIM:
@@ -44,7 +49,8 @@ def register_sims(
     api_url: str,
     session_token: Token,
     sims: list[SIM],
-) -> None:
+    client: Optional[HttpClient] = None,
+) -> Optional[int]:
     """Register SIM cards with the tunnel server.
 
     Parameters
@@ -55,6 +61,13 @@ def register_sims(
         A valid session token.
     sims
         SIM cards to register.
+    client
+        HTTP client to use. (default: `http_client.default_client()`)
+
+    Returns
+    -------
+    Version of the registered SIMs (used by `update_sims`) or None if the server
+    does not support incremental updates.
 
     Raises
     ------
@@ -62,7 +75,8 @@ def register_sims(
         If registration is not successful.
     """
     headers = {"Authorization": f"Bearer {session_token.as_base64()}"}
-    r = requests.put(
+    r = (client or default_client()).request(
+        "PUT",
         f"{api_url}/provider/sims",
         json=list(map(lambda s: s._to_dict(), sims)),
         headers=headers,
@@ -76,6 +90,68 @@ def register_sims(
         )
         raise
 
+    version = r.headers.get(SIMS_VERSION_HEADER)
+    return int(version) if version is not None else None
+
+
+def update_sims(
+    api_url: str,
+    session_token: Token,
+    version: int,
+    added: list[SIM],
+    removed: list[int],
+    client: Optional[HttpClient] = None,
+) -> int:
+    """Add and remove SIM cards without re-registering the other SIM cards.
+
+    Parameters
+    ----------
+    api_url
+        API base URL (e.g., 'https://example.com/api/v1')
+    session_token
+        A valid session token.
+    version
+        Version of the registered SIMs returned by the last successful call to
+        `register_sims` or `update_sims`.
+    added
+        SIM cards to register. (Replaces registered SIM cards with the same ID.)
+    removed
+        IDs of the SIM cards to deregister.
+    client
+        HTTP client to use. (default: `http_client.default_client()`)
+
+    Returns
+    -------
+    The new version of the registered SIMs.
+
+    Raises
+    ------
+    requests.HTTPError
+        If the update is not successful. (Status 409 if the registered SIMs are
+        not at `version`. Use `register_sims` to register all SIM cards again.)
+    """
+    headers = {"Authorization": f"Bearer {session_token.as_base64()}"}
+    r = (client or default_client()).request(
+        "PATCH",
+        f"{api_url}/provider/sims",
+        json={
+            "version": version,
+            "add": list(map(lambda s: s._to_dict(), added)),
+            "remove": removed,
+        },
+        headers=headers,
+    )
+
+    try:
+        r.raise_for_status()
+    except requests.HTTPError:
+        LOGGER.warning(
+            "SIM update failed. Received status %s from server.", r.status_code
+        )
+        raise
+
+    return r.json()["version"]
+
 
 class ProviderClient(_Client):
     """
@@ -112,6 +188,42 @@ class ProviderClient(_Client):
             session_token, host, port, tls_ctx=tls_ctx, server_hostname=server_hostname
         )
 
+    def connect_multiplexed(
+        self, heartbeat_interval: Optional[float] = HEARTBEAT_INTERVAL
+    ) -> MultiplexedConnection:
+        """Open a single connection that can carry many SIM sessions.
+
+        Connection requests are accepted by calling `wait_for_connection` on the
+        returned connection. This avoids a TLS handshake and authentication per
+        session.
+
+        Parameters
+        ----------
+        heartbeat_interval
+            Seconds between heartbeats keeping the connection alive or None to not
+            send heartbeats.
+
+        Raises
+        ------
+        ProtocolError
+            If the server does not support multiplexed connections.
+        """
+        stream = self._open_stream()
+
+        try:
+            version = self._authenticate(
+                AuthType.Provider, stream, version=PROTOCOL_VERSION
+            )
+
+            if version < 2:
+                raise ProtocolError("Server does not support multiplexed connections.")
+        except Exception as e:
+            LOGGER.warning(f"Could not open multiplexed connection: {e}")
+            stream.close()
+            raise
+
+        return MultiplexedConnection(stream, self.cb, heartbeat_interval)
+
     def wait_for_connection(self) -> tuple[SimIdentifierType, ApduStream]:
         """Wait for a single connection request.
 
@@ -119,17 +231,7 @@ class ProviderClient(_Client):
         -------
         Identifier of the requested SIM card and connected ApduStream.
         """
-        LOGGER.debug("Opening connection.")
-        try:
-            stream = RawStream(
-                self.tls_ctx.wrap_socket(
-                    socket.create_connection((self.host, self.port)),
-                    server_hostname=self.server_hostname,
-                )
-            )
-        except Exception as e:
-            LOGGER.warning(f"Could not connect to server: {e}")
-            raise ConnectionError from e
+        stream = self._open_stream()
 
         try:
             apdu_stream = self._wait_for_connection(stream)
@@ -144,6 +246,19 @@ class ProviderClient(_Client):
 
         return apdu_stream
 
+    def _open_stream(self) -> RawStream:
+        LOGGER.debug("Opening connection.")
+        try:
+            return RawStream(
+                self.tls_ctx.wrap_socket(
+                    socket.create_connection((self.host, self.port)),
+                    server_hostname=self.server_hostname,
+                )
+            )
+        except Exception as e:
+            LOGGER.warning(f"Could not connect to server: {e}")
+            raise ConnectionError from e
+
     def _wait_for_connection(
         self,
         stream: RawStream,
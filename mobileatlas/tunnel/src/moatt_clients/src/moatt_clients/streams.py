@@ -1,7 +1,6 @@
 import logging
 import socket
 import ssl
-import struct
 from collections.abc import Callable
 from typing import Optional, TypeVar
 
@@ -12,9 +11,12 @@ LOGGER = logging.getLogger(__name__)
 
 
 class RawStream:
+    _RECV_SIZE = 64 * 2**10
+
     def __init__(self, socket):
         self._socket = socket
-        self.buf = b""
+        # consuming from the front of a bytearray does not copy the rest of it
+        self.buf = bytearray()
 
     def getpeername(self):
         return self._socket.getpeername()
@@ -41,9 +43,7 @@ class RawStream:
     def read_exactly(self, n: int) -> bytes:
         while True:
             if len(self.buf) >= n:
-                b = self.buf[:n]
-                self.buf = self.buf[n:]
-                return b
+                return self._consume(n)
 
             if not self._fill_buf():
                 raise EOFError
@@ -53,17 +53,17 @@ class RawStream:
             self._fill_buf()
 
         if n == -1:
-            b = self.buf
-            self.buf = b""
-            return b
-        else:
-            b = self.buf[:n]
-            self.buf = self.buf[n:]
-            return b
+            n = len(self.buf)
+
+        return self._consume(min(n, len(self.buf)))
+
+    def _consume(self, n: int) -> bytes:
+        b = bytes(self.buf[:n])
+        del self.buf[:n]
+        return b
 
     def _fill_buf(self) -> bool:
-        b = self._socket.recv(1024)
-        print(f"Received: {b}")  # TODO
+        b = self._socket.recv(RawStream._RECV_SIZE)
         if len(b) == 0:
             return False
         else:
@@ -71,7 +71,7 @@ class RawStream:
             return True
 
     def close(self) -> None:
-        self.buf = b""
+        self.buf.clear()
         if isinstance(self._socket, ssl.SSLSocket):
             self._socket.unwrap()
         self._socket.shutdown(socket.SHUT_RDWR)
@@ -99,6 +99,10 @@ class ApduStream:
         """Sends a reset signal."""
         self.send(ApduPacket(ApduOp.Reset, b""))
 
+    def send_heartbeat(self) -> None:
+        """Sends a heartbeat to keep an idle connection alive."""
+        self.send(ApduPacket(ApduOp.Heartbeat, b""))
+
     def send(self, packet: ApduPacket) -> None:
         """Sends an ApduPacket.
 
@@ -110,7 +114,7 @@ class ApduStream:
         self.stream.write_all(packet.encode())
 
     def recv(self) -> Optional[ApduPacket]:
-        """Receive an APDU. Blocks until an APDU is received.
+        """Receive an APDU. Blocks until an APDU is received. Heartbeats are skipped.
 
         Returns
         -------
@@ -121,6 +125,13 @@ class ApduStream:
         EOFError
             If a partial APDU was received before EOF of the underlying stream.
         """
+        while True:
+            p = self._recv_packet()
+
+            if p is None or p.op != ApduOp.Heartbeat:
+                return p
+
+    def _recv_packet(self) -> Optional[ApduPacket]:
         buf = self.stream.read(n=6)
 
         if len(buf) == 0:
@@ -150,11 +161,9 @@ class ApduStream:
 
     @staticmethod
     def _bytes_missing(msg: bytes) -> int:
-        if len(msg) < 6:
-            return 6 - len(msg)
+        try:
+            _, plen = ApduPacket.decode_header(msg)
+        except PartialInput as e:
+            return e.bytes_missing
 
-        (plen,) = struct.unpack("!I", msg[2:6])
-        if len(msg) < 6 + plen:
-            return (6 + plen) - len(msg)
-        else:
-            return 0
+        return max(ApduPacket.HEADER_LEN + plen - len(msg), 0)
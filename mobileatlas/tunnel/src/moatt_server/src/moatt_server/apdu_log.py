@@ -0,0 +1,304 @@
+"""Storage of the APDU log.
+
+On PostgreSQL the APDU log can be partitioned by time (see
+`Config.APDU_LOG_PARTITION_INTERVAL`). Partitions are created ahead of time by
+`maintenance_coro_factory` and expired partitions are dropped as a whole, which
+keeps both inserts and pruning cheap independently of the size of the log. Other
+databases and APDU logs created before partitioning was enabled are pruned by
+deleting expired rows in batches.
+"""
+
+import datetime
+import logging
+import re
+import zlib
+from collections.abc import Awaitable, Callable
+from typing import Optional
+
+from sqlalchemy import (
+    Connection,
+    MetaData,
+    PrimaryKeyConstraint,
+    Table,
+    delete,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateColumn, CreateTable
+
+from . import metrics
+from . import models as dbm
+from .config import Config
+
+LOGGER = logging.getLogger(__name__)
+
+_PRUNED = metrics.counter(
+    "moat_apdu_log_pruned", "APDU log entries deleted because they expired."
+)
+_DROPPED_PARTITIONS = metrics.counter(
+    "moat_apdu_log_dropped_partitions", "Expired APDU log partitions dropped."
+)
+
+_TABLE: Table = dbm.ApduLog.__table__  # pyright: ignore[reportAssignmentType]
+
+# number of partitions that are created in advance
+_PARTITIONS_AHEAD = 2
+_PRUNE_BATCH_SIZE = 10_000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+_BOUND_FORMAT = "%Y%m%dt%H%M"
+_PARTITION_RE = re.compile(
+    rf"^{_TABLE.name}_(?P<lower>\d{{8}}t\d{{4}})_(?P<upper>\d{{8}}t\d{{4}})$"
+)
+
+
+def encode_payload(payload: bytes, compress: bool) -> tuple[bytes, bool]:
+    """Returns the payload to store and whether it is compressed.
+
+    Payloads are only stored compressed if that makes them smaller.
+    """
+    if compress:
+        compressed = zlib.compress(payload)
+        if len(compressed) < len(payload):
+            return compressed, True
+
+    return payload, False
+
+
+def decode_payload(payload: Optional[bytes], compressed: bool) -> Optional[bytes]:
+    if payload is None or not compressed:
+        return payload
+
+    return zlib.decompress(payload)
+
+
+def _partitioning(conn: Connection, config: Config) -> bool:
+    if config.APDU_LOG_PARTITION_INTERVAL is None:
+        return False
+
+    if conn.dialect.name != "postgresql":
+        LOGGER.warning(
+            "Partitioning of the APDU log is only supported on PostgreSQL. "
+            f"(Database: {conn.dialect.name})"
+        )
+        return False
+
+    return True
+
+
+def _is_partitioned(conn: Connection) -> bool:
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": _TABLE.name},
+    ).scalar()
+    return relkind == "p"
+
+
+def _partitioned_table() -> Table:
+    # partitioned tables need the partition key to be part of the primary key
+    table = _TABLE.to_metadata(MetaData())
+    table.c.timestamp.primary_key = True
+    table.append_constraint(PrimaryKeyConstraint(table.c.id, table.c.timestamp))
+    table.c.id.autoincrement = True
+    table.dialect_options["postgresql"]["partition_by"] = "RANGE (timestamp)"
+    return table
+
+
+def _migrate(conn: Connection, t: Table = _TABLE) -> None:
+    """Add columns and indexes introduced after a table was created."""
+    existing = {c["name"] for c in inspect(conn).get_columns(t.name)}
+    table = conn.dialect.identifier_preparer.format_table(t)
+
+    for column in t.columns:
+        if column.name in existing:
+            continue
+
+        LOGGER.info(f"Adding column {column.name} to {t.name}.")
+        spec = CreateColumn(column).compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {spec}"))
+
+    for index in t.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def _create_partitioned_table(conn: Connection) -> None:
+    LOGGER.info(f"Creating partitioned table {_TABLE.name}.")
+    table = _partitioned_table()
+
+    for column in table.columns:
+        if hasattr(column.type, "create"):
+            column.type.create(conn, checkfirst=True)  # pyright: ignore
+
+    conn.execute(CreateTable(table))
+
+    # catches entries outside of all partitions
+    prepare = conn.dialect.identifier_preparer
+    conn.execute(
+        text(
+            f"CREATE TABLE {prepare.quote(_TABLE.name + '_default')} "
+            f"PARTITION OF {prepare.quote(_TABLE.name)} DEFAULT"
+        )
+    )
+
+
+def create_schema(conn: Connection, config: Config) -> None:
+    """Create all missing tables and columns. Used with `AsyncConnection.run_sync`."""
+    dbm.Base.metadata.create_all(
+        conn, tables=[t for t in dbm.Base.metadata.sorted_tables if t is not _TABLE]
+    )
+
+    if not _partitioning(conn, config):
+        _TABLE.create(conn, checkfirst=True)
+    else:
+        if not inspect(conn).has_table(_TABLE.name):
+            _create_partitioned_table(conn)
+
+        if _is_partitioned(conn):
+            _create_partitions(
+                conn,
+                datetime.datetime.now(tz=datetime.timezone.utc),
+                config.APDU_LOG_PARTITION_INTERVAL,  # pyright: ignore
+            )
+        else:
+            LOGGER.warning(
+                f"Table {_TABLE.name} was created without partitioning. It has to "
+                "be recreated in order to be partitioned. Until then, expired "
+                "entries are deleted row by row."
+            )
+
+    _migrate(conn)
+    _migrate(conn, dbm.Provider.__table__)  # pyright: ignore
+
+
+def _partitions(
+    conn: Connection,
+) -> list[tuple[str, datetime.datetime, datetime.datetime]]:
+    names = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ),
+        {"name": _TABLE.name},
+    ).scalars()
+
+    res = []
+    for name in names:
+        if (m := _PARTITION_RE.match(name)) is None:
+            continue
+
+        lower, upper = (
+            datetime.datetime.strptime(m.group(g), _BOUND_FORMAT).replace(
+                tzinfo=datetime.timezone.utc
+            )
+            for g in ("lower", "upper")
+        )
+        res.append((name, lower, upper))
+
+    return sorted(res, key=lambda p: p[1])
+
+
+def _create_partitions(
+    conn: Connection, now: datetime.datetime, interval: datetime.timedelta
+) -> None:
+    partitions = _partitions(conn)
+    covered = max((upper for _, _, upper in partitions), default=None)
+
+    lower = _EPOCH + (now - _EPOCH) // interval * interval
+    if covered is not None and covered > lower:
+        lower = covered
+
+    until = now + _PARTITIONS_AHEAD * interval
+    prepare = conn.dialect.identifier_preparer
+
+    while lower < until:
+        # partitions are aligned to multiples of interval; the first one might be
+        # shorter if the interval was changed
+        upper = _EPOCH + ((lower - _EPOCH) // interval + 1) * interval
+        name = (
+            f"{_TABLE.name}_{lower.strftime(_BOUND_FORMAT)}"
+            f"_{upper.strftime(_BOUND_FORMAT)}"
+        )
+
+        LOGGER.info(f"Creating APDU log partition {name}.")
+        conn.execute(
+            text(
+                f"CREATE TABLE {prepare.quote(name)} "
+                f"PARTITION OF {prepare.quote(_TABLE.name)} "
+                f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+            )
+        )
+        lower = upper
+
+
+def _drop_partitions(conn: Connection, cutoff: datetime.datetime) -> None:
+    prepare = conn.dialect.identifier_preparer
+
+    for name, _, upper in _partitions(conn):
+        if upper > cutoff:
+            break
+
+        LOGGER.info(f"Dropping expired APDU log partition {name}.")
+        conn.execute(text(f"DROP TABLE {prepare.quote(name)}"))
+        _DROPPED_PARTITIONS.inc()
+
+
+def _delete_expired(conn: Connection, cutoff: datetime.datetime) -> int:
+    expired = (
+        select(_TABLE.c.id)
+        .where(_TABLE.c.timestamp < cutoff)
+        .limit(_PRUNE_BATCH_SIZE)
+        .scalar_subquery()
+    )
+    deleted = conn.execute(delete(_TABLE).where(_TABLE.c.id.in_(expired))).rowcount
+    _PRUNED.inc(deleted)
+    return deleted
+
+
+def maintenance_coro_factory(
+    engine: AsyncEngine, config: Config
+) -> Callable[[], Awaitable[None]]:
+    """Creates upcoming partitions and prunes expired entries of the APDU log.
+
+    Must only be run by a single process.
+    """
+
+    async def f():
+        now = datetime.datetime.now(tz=datetime.timezone.utc)
+
+        async with engine.begin() as conn:
+            partitioned = (
+                config.APDU_LOG_PARTITION_INTERVAL is not None
+                and engine.dialect.name == "postgresql"
+                and await conn.run_sync(_is_partitioned)
+            )
+
+            if partitioned:
+                await conn.run_sync(
+                    _create_partitions, now, config.APDU_LOG_PARTITION_INTERVAL
+                )
+
+                if config.APDU_LOG_RETENTION is not None:
+                    await conn.run_sync(
+                        _drop_partitions, now - config.APDU_LOG_RETENTION
+                    )
+
+        if config.APDU_LOG_RETENTION is None:
+            return
+
+        # entries outside of any partition (or of an unpartitioned log)
+        cutoff = now - config.APDU_LOG_RETENTION
+        deleted = _PRUNE_BATCH_SIZE
+        total = 0
+
+        while deleted == _PRUNE_BATCH_SIZE:
+            async with engine.begin() as conn:
+                deleted = await conn.run_sync(_delete_expired, cutoff)
+            total += deleted
+
+        if total > 0:
+            LOGGER.info(f"Deleted {total} expired APDU log entries.")
+
+    return f
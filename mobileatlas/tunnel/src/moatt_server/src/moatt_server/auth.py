@@ -9,6 +9,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import selectinload
 
 from . import models as dbm
+from . import sim_registry
 from .auth_handler import AuthResult, SimIdent
 from .config import get_config
 
@@ -43,20 +44,20 @@ def now() -> datetime.datetime:
     return datetime.datetime.now(tz=datetime.timezone.utc)
 
 
-async def register_provider(
-    session: AsyncSession,
-    session_token: Token,
+def _normalize(
     sims_in: dict[int, tuple[Iccid | None, Imsi | None]],
-) -> bool:
-    LOGGER.debug(f"Registering SIMs. {sims_in}")
-
-    authh = get_config().AUTH_HANDLER
-
-    sims = {
+) -> dict[int, tuple[str | None, str | None]]:
+    return {
         k: (v[0].iccid if v[0] else None, v[1].imsi if v[1] else None)
         for k, v in sims_in.items()
     }
 
+
+async def _authorize_sims(
+    session_token: Token, sims: dict[int, tuple[str | None, str | None]]
+) -> UUID:
+    authh = get_config().AUTH_HANDLER
+
     sim_idents = [SimIdent(id=k, iccid=v[0], imsi=v[1]) for k, v in sims.items()]
     if (
         auth_res := await authh.allowed_sim_registration(session_token, sim_idents)
@@ -70,6 +71,19 @@ async def register_provider(
         LOGGER.info("Couldn't get ID associated with token.")
         raise TokenError(AuthResult.InvalidToken)
 
+    return provider_id
+
+
+async def register_provider(
+    session: AsyncSession,
+    session_token: Token,
+    sims_in: dict[int, tuple[Iccid | None, Imsi | None]],
+) -> bool:
+    LOGGER.debug(f"Registering SIMs. {sims_in}")
+
+    sims = _normalize(sims_in)
+    provider_id = await _authorize_sims(session_token, sims)
+
     provider = await session.get(dbm.Provider, provider_id)
 
     modified = False
@@ -77,7 +91,7 @@ async def register_provider(
 
     if provider is None:
         modified = True
-        provider = dbm.Provider(id=provider_id, last_active=time)
+        provider = dbm.Provider(id=provider_id, last_active=time, sims_version=0)
         session.add(provider)
         await session.flush()
 
@@ -97,9 +111,140 @@ async def register_provider(
     for sim in removed_sims:
         await session.delete(sim)
 
+    if await _add_sims(session, provider, sims):
+        modified = True
+
+    if modified:
+        provider.sims_version += 1
+
+    return modified
+
+
+async def sims_version(session: AsyncSession, session_token: Token) -> int:
+    """Version of the SIMs registered by a provider. (0 if it registered none.)"""
+    provider_id = await identity(session_token)
+
+    if provider_id is None:
+        raise TokenError(AuthResult.InvalidToken)
+
+    provider = await session.get(dbm.Provider, provider_id)
+
+    return provider.sims_version if provider is not None else 0
+
+
+class VersionConflict(Exception):
+    """The registered SIMs do not have the version a delta was based on."""
+
+    def __init__(self, version: int) -> None:
+        self.version = version
+
+
+async def update_sims(
+    session: AsyncSession,
+    session_token: Token,
+    version: int,
+    added_in: dict[int, tuple[Iccid | None, Imsi | None]],
+    removed: set[int],
+) -> int:
+    """Add and remove SIMs of a provider without touching its other SIMs.
+
+    Returns
+    -------
+    The new version of the provider's SIMs.
+
+    Raises
+    ------
+    VersionConflict
+        If the provider's SIMs are not at `version`.
+    """
+    LOGGER.debug(f"Updating SIMs. added: {added_in}, removed: {removed}")
+
+    added = _normalize(added_in)
+    provider_id = await get_config().AUTH_HANDLER.identity(session_token)
+
+    if provider_id is None:
+        LOGGER.info("Couldn't get ID associated with token.")
+        raise TokenError(AuthResult.InvalidToken)
+
+    # serializes concurrent updates of the same provider
+    provider = await session.get(dbm.Provider, provider_id, with_for_update=True)
+    current = provider.sims_version if provider is not None else 0
+
+    if version != current:
+        raise VersionConflict(current)
+
+    # the auth handler decides on the SIMs the provider ends up with (like for a
+    # full registration) and not just on the added ones
+    await _authorize_sims(
+        session_token, await _updated_sims(session, provider_id, added, removed)
+    )
+
+    modified = False
+
+    if provider is None:
+        modified = True
+        provider = dbm.Provider(id=provider_id, last_active=now(), sims_version=0)
+        session.add(provider)
+        await session.flush()
+
+    if len(removed) > 0:
+        removed_sims = await session.scalars(
+            select(dbm.Sim).where(
+                (dbm.Sim.provider_id == provider_id) & dbm.Sim.id.in_(removed)
+            )
+        )
+
+        for sim in removed_sims:
+            modified = True
+            await session.delete(sim)
+
+    if await _add_sims(session, provider, added):
+        modified = True
+
+    if modified:
+        provider.sims_version = current + 1
+
+    return provider.sims_version
+
+
+async def _updated_sims(
+    session: AsyncSession,
+    provider_id: UUID,
+    added: dict[int, tuple[str | None, str | None]],
+    removed: set[int],
+) -> dict[int, tuple[str | None, str | None]]:
+    """SIMs a provider has after removing and adding (see _add_sims) SIMs."""
+    iccids = {v[0] for v in added.values() if v[0] is not None}
+    imsis = {v[1] for v in added.values() if v[1] is not None}
+
+    sims = {
+        sim.id: (sim.iccid, sim.imsi)
+        for sim in await session.scalars(
+            select(dbm.Sim).where(dbm.Sim.provider_id == provider_id)
+        )
+        if sim.id not in removed and sim.iccid not in iccids and sim.imsi not in imsis
+    }
+    sims.update(added)
+
+    return sims
+
+
+async def _add_sims(
+    session: AsyncSession,
+    provider: dbm.Provider,
+    sims: dict[int, tuple[str | None, str | None]],
+) -> bool:
+    """Register SIMs of a provider, replacing SIMs with the same ID or identifiers.
+
+    Returns whether any SIM was added or replaced.
+    """
     if len(sims) == 0:
-        return modified
+        return False
+
+    provider_id = provider.id
+    modified = False
 
+    ids = set(sims.keys())
     iccids, imsis = zip(*sims.values())
     iccids = set(iccids)
     imsis = set(imsis)
@@ -108,7 +253,8 @@ async def register_provider(
         await session.scalars(
             select(dbm.Sim)
             .where(
-                dbm.Sim.id.in_(ids)
+                # SIM IDs are only unique per provider
+                ((dbm.Sim.provider_id == provider_id) & dbm.Sim.id.in_(ids))
                 | dbm.Sim.iccid.in_(iccids)
                 | dbm.Sim.imsi.in_(imsis)
             )
@@ -120,11 +266,13 @@ async def register_provider(
 
     for sim in existing_sims:
         if sim.provider.id == provider_id:
-            new_sim = sims[sim.id]
-            iccid = new_sim[0] if new_sim[0] is not None else None
-            imsi = new_sim[1] if new_sim[1] is not None else None
+            new_sim = sims.get(sim.id)
 
-            if sim.iccid != iccid or sim.imsi != imsi:
+            if new_sim is None:
+                # same card registered under a different ID before
+                modified = True
+                await session.delete(sim)
+            elif sim.iccid != new_sim[0] or sim.imsi != new_sim[1]:
                 modified = True
                 await session.delete(sim)
             else:
@@ -135,6 +283,8 @@ async def register_provider(
         if sim.provider.is_expired(get_config().PROVIDER_EXPIRATION):
             await remove_provider(session, sim.provider)
         elif sim.provider.allow_reregistration:
+            # makes the tunnel server reload the SIMs of the other provider
+            sim.provider.sims_version += 1
             await session.delete(sim)
         else:
             raise AuthError
@@ -170,6 +320,8 @@ async def deregister_provider(session: AsyncSession, session_token: Token) -> No
     if provider is None:
         return
 
+    # auth decisions cached by the tunnel server (a separate process) are not
+    # invalidated and expire after their time to live
     await remove_provider(session, provider)
 
 
@@ -220,23 +372,7 @@ async def get_sim(
 
     authh = get_config().AUTH_HANDLER
 
-    match identifier:
-        case SimId(provider=prov_id, id=id):
-            sim = await session.scalar(
-                select(dbm.Sim).where(
-                    (dbm.Sim.provider_id == prov_id) & (dbm.Sim.id == id)
-                )
-            )
-        case Iccid(iccid=iccid):
-            sim = await session.scalar(select(dbm.Sim).where(dbm.Sim.iccid == iccid))
-        case Imsi(imsi=imsi):
-            sim = await session.scalar(select(dbm.Sim).where(dbm.Sim.imsi == imsi))
-        case SimIndex(provider=prov_id, index=index):
-            sim = await session.scalar(
-                select(dbm.Sim).order_by(dbm.Sim.id.asc()).limit(1).offset(index)
-            )
-        case _:
-            raise NotImplementedError
+    sim = await sim_registry.get_registry().get(session, identifier)
 
     if sim is None:
         LOGGER.debug(f"Couldn't find SIM card with id: {identifier}")
@@ -244,7 +380,7 @@ async def get_sim(
 
     if not await authh.allowed_sim_request(
         token,
-        (await sim.awaitable_attrs.provider).id,
+        sim.provider.id,
         SimIdent(id=sim.id, iccid=sim.iccid, imsi=sim.imsi),
     ):
         raise AuthError
@@ -48,3 +48,6 @@ class AuthHandler(ABC):
 
     @abstractmethod
     async def identity(self, token: Token) -> UUID | None: ...
+
+    async def close(self) -> None:
+        """Release resources held by the handler."""
@@ -0,0 +1,63 @@
+import collections
+import time
+from collections.abc import Callable, Hashable
+from typing import Any, Optional
+
+
+class TtlLruCache:
+    """Bounded cache whose entries expire after a per-entry time to live.
+
+    When the cache is full the least recently used entry is evicted. Expired
+    entries are removed lazily.
+    """
+
+    MISSING = object()
+
+    def __init__(self, maxsize: int):
+        if maxsize < 0:
+            raise ValueError(f"Expected maxsize >= 0. ({maxsize=})")
+
+        self._maxsize = maxsize
+        # key -> (expiry (monotonic), value)
+        self._entries: collections.OrderedDict[Hashable, tuple[float, Any]] = (
+            collections.OrderedDict()
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Any:
+        """Return the cached value or `TtlLruCache.MISSING`."""
+        entry = self._entries.get(key)
+
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return TtlLruCache.MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: Hashable, value: Any, ttl: float) -> None:
+        if self._maxsize == 0 or ttl <= 0:
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, pred: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """Remove all entries whose key matches pred or all entries if pred is None."""
+        if pred is None:
+            self._entries.clear()
+            return
+
+        for key in [k for k in self._entries if pred(k)]:
+            del self._entries[key]
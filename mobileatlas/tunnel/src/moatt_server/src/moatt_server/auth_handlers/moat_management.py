@@ -1,4 +1,6 @@
+import asyncio
 import dataclasses
+import json
 import logging
 from pathlib import Path
 from typing import Any, Optional
@@ -10,6 +12,7 @@ from pydantic import BaseModel
 from pydantic.networks import HttpUrl
 
 from ..auth_handler import AuthHandler, AuthResult, SimIdent
+from .cache import TtlLruCache
 
 LOGGER = logging.getLogger(__name__)
 
@@ -21,6 +24,11 @@ class Settings(BaseModel):
     retries: int = 1
     username: str
     password: str
+    max_connections: int = 32
+    keepalive_expiry: float = 60  # seconds
+    cache_size: int = 4096  # maximum number of cached decisions; 0 disables caching
+    cache_ttl: float = 60  # seconds positive decisions are cached for
+    negative_cache_ttl: float = 10  # seconds negative decisions are cached for
 
 
 class MoatManagementAuth(AuthHandler):
@@ -35,6 +43,11 @@ class MoatManagementAuth(AuthHandler):
         transport = httpx.AsyncHTTPTransport(
             retries=self._settings.retries,
             uds=str(self._settings.uds) if self._settings.uds is not None else None,
+            limits=httpx.Limits(
+                max_connections=self._settings.max_connections,
+                max_keepalive_connections=self._settings.max_connections,
+                keepalive_expiry=self._settings.keepalive_expiry,
+            ),
         )
         self._client = httpx.AsyncClient(
             auth=httpx.BasicAuth(self._settings.username, self._settings.password),
@@ -46,7 +59,9 @@ class MoatManagementAuth(AuthHandler):
             timeout=self._settings.timeout,
             transport=transport,
         )
-        self._id_cache: dict[Token, UUID] = {}
+        # (path, token, request) -> response
+        self._cache = TtlLruCache(self._settings.cache_size)
+        self._inflight: dict[tuple[str, Token, str], asyncio.Future[Any]] = {}
 
         LOGGER.debug(
             "Finished initialization with the following settings: %s", self._settings
@@ -59,6 +74,43 @@ class MoatManagementAuth(AuthHandler):
 
         return AuthResult.Forbidden
 
+    async def close(self) -> None:
+        await self._client.aclose()
+
+    async def _cached_post(self, path: str, token: Token, body: Any) -> Any:
+        """POST request whose response is cached and shared by concurrent callers."""
+        key = (path, token, _json_key(body))
+
+        res = self._cache.get(key)
+        if res is not TtlLruCache.MISSING:
+            return res
+
+        fut = self._inflight.get(key)
+        if fut is None:
+            fut = asyncio.ensure_future(self._post(path, body))
+            self._inflight[key] = fut
+            fut.add_done_callback(lambda f: self._request_done(key, f))
+
+        # one caller being cancelled must not cancel the request of the others
+        return await asyncio.shield(fut)
+
+    def _request_done(
+        self, key: tuple[str, Token, str], fut: asyncio.Future[Any]
+    ) -> None:
+        if self._inflight.get(key) is fut:
+            del self._inflight[key]
+
+        if fut.cancelled() or fut.exception() is not None:
+            return
+
+        res = fut.result()
+        positive = res is True or isinstance(res, str)
+        self._cache.put(
+            key,
+            res,
+            self._settings.cache_ttl if positive else self._settings.negative_cache_ttl,
+        )
+
     async def _post(self, path: str, json: Any) -> Any:
         try:
             res = await self._client.post(path, json=json)
@@ -85,7 +137,9 @@ class MoatManagementAuth(AuthHandler):
         return res.json()
 
     async def allowed_provider_registration(self, token: Token) -> AuthResult:
-        res = await self._post("/allowed-provider-registration", token.as_base64())
+        res = await self._cached_post(
+            "/allowed-provider-registration", token, token.as_base64()
+        )
 
         return MoatManagementAuth._process_result(res)
 
@@ -93,22 +147,27 @@ class MoatManagementAuth(AuthHandler):
         self, token: Token, sims: list[SimIdent]
     ) -> AuthResult:
         sim_list = list(map(dataclasses.asdict, sims))
-        res = await self._post(
-            "/allowed-sim-registration", {"token": token.as_base64(), "sims": sim_list}
+        res = await self._cached_post(
+            "/allowed-sim-registration",
+            token,
+            {"token": token.as_base64(), "sims": sim_list},
         )
 
         return MoatManagementAuth._process_result(res)
 
     async def allowed_probe_registration(self, token: Token) -> AuthResult:
-        res = await self._post("/allowed-probe-registration", token.as_base64())
+        res = await self._cached_post(
+            "/allowed-probe-registration", token, token.as_base64()
+        )
 
         return MoatManagementAuth._process_result(res)
 
     async def allowed_sim_request(
         self, token: Token, provider_id: UUID, sim_id: SimIdent
     ) -> AuthResult:
-        res = await self._post(
+        res = await self._cached_post(
             "/allowed-sim-request",
+            token,
             {
                 "token": token.as_base64(),
                 "request": {
@@ -121,10 +180,7 @@ class MoatManagementAuth(AuthHandler):
         return MoatManagementAuth._process_result(res)
 
     async def identity(self, token: Token) -> UUID | None:
-        if token in self._id_cache:
-            return self._id_cache[token]
-
-        res = await self._post("/identity", token.as_base64())
+        res = await self._cached_post("/identity", token, token.as_base64())
 
         if not isinstance(res, str):
             LOGGER.warning("Failed to parse MobileAtlas management server response.")
@@ -140,6 +196,8 @@ class MoatManagementAuth(AuthHandler):
                 "Failed to parse UUID returned by MobileAtlas management server."
             )
 
-        self._id_cache[token] = uuid
-
         return uuid
+
+
+def _json_key(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
@@ -11,10 +11,11 @@ from datetime import timedelta
 from pathlib import Path
 from typing import Any, Optional
 
-from sqlalchemy import URL
+from sqlalchemy import URL, make_url
 
 from .auth_handler import AuthHandler
 from .auth_handlers import MoatManagementAuth
+from .tunnel.scheduling import SCHEDULERS
 
 LOGGER = logging.getLogger(__name__)
 ISODURATION_RE = re.compile(
@@ -32,26 +33,42 @@ class Config:
     PROVIDER_RESPONSE_TIMEOUT: Optional[timedelta] = timedelta(minutes=10)
     PROVIDER_EXPIRATION: Optional[timedelta] = timedelta(minutes=10)
     PROBE_REQUEST_TIMEOUT: Optional[timedelta] = timedelta(minutes=10)
+    PROVIDER_IDLE_TIMEOUT: Optional[timedelta] = None
     TCP_KEEPIDLE: Optional[timedelta] = timedelta(minutes=10)
     TCP_KEEPINTVL: Optional[timedelta] = timedelta(minutes=10)
     TCP_KEEPCNT: Optional[int] = 10
     TCP_KEEPALIVE: bool = True
     MAX_QUEUE_SIZE: int = 10
+    QUEUE_SCHEDULER: str = "fifo"
+    URGENT_PROBES: list[str] = field(default_factory=list)
     MAX_PROBE_WAITTIME: Optional[timedelta] = timedelta(minutes=5)
 
     GC_INTERVAL: timedelta = timedelta(minutes=1)
     QUEUE_GC_INTERVAL: timedelta = timedelta(minutes=1)
 
+    APDU_LOG_BATCH_SIZE: int = 500
+    APDU_LOG_FLUSH_INTERVAL: timedelta = timedelta(seconds=1)
+    APDU_LOG_MAX_PENDING: int = 100_000
+    APDU_LOG_COMPRESSION: bool = False
+    APDU_LOG_PARTITION_INTERVAL: Optional[timedelta] = None
+    APDU_LOG_RETENTION: Optional[timedelta] = None
+
+    APDU_CACHE_SIZE: int = 0
+    APDU_CACHE_TTL: timedelta = timedelta(hours=1)
+
     DB_HOST: str = "localhost"
     DB_PORT: int = 5432
     DB_USER: str
     DB_PASSWORD: str
     DB_NAME: str
+    DB_URL: Optional[str] = None
 
     TUNNEL_HOST: list[str] = field(default_factory=lambda: ["127.0.0.1" "::1"])
     TUNNEL_PORT: int = 6666
     TUNNEL_CERT: str = "ssl/server.crt"
     TUNNEL_CERT_KEY: str = "ssl/server.key"
+    TUNNEL_WORKERS: int = 1
+    TUNNEL_SOCKET_DIR: Optional[str] = None
 
     API_HOST: str = "localhost"
     API_PORT: int = 8000
@@ -59,9 +76,15 @@ class Config:
 
     LOGGING_CONF_FILE: Optional[str] = None
 
+    METRICS_DIR: Optional[str] = None
+    METRICS_INTERVAL: timedelta = timedelta(seconds=10)
+
     AUTH_HANDLER: AuthHandler
 
     def db_url(self) -> URL:
+        if self.DB_URL is not None:
+            return make_url(self.DB_URL)
+
         return URL.create(
             "postgresql+psycopg",
             username=self.DB_USER,
@@ -173,6 +196,7 @@ def _load_toml_config(
         _set(res, "DB_USER", db.get("user"))
         _set(res, "DB_NAME", db.get("name"))
         _set(res, "DB_PASSWORD", db.get("password"))
+        _set(res, "DB_URL", db.get("url"), _opt_str)
 
     if isinstance(timeouts := cfg.get("timeouts"), dict):
         _set(res, "AUTHMSG_TIMEOUT", timeouts.get("authmsg"), _opt_td)
@@ -186,6 +210,7 @@ def _load_toml_config(
             _opt_td,
         )
         _set(res, "PROBE_REQUEST_TIMEOUT", timeouts.get("probe_request"), _opt_td)
+        _set(res, "PROVIDER_IDLE_TIMEOUT", timeouts.get("provider_idle"), _opt_td)
         _set(res, "TCP_KEEPIDLE", timeouts.get("keepidle"), _opt_td)
         _set(res, "TCP_KEEPINTVL", timeouts.get("keepintvl"), _opt_td)
         _set(
@@ -199,11 +224,34 @@ def _load_toml_config(
 
     if isinstance(limits := cfg.get("limits"), dict):
         _set(res, "MAX_QUEUE_SIZE", limits.get("max_queue_size"))
+        _set(res, "QUEUE_SCHEDULER", limits.get("scheduler"))
+        _set(res, "URGENT_PROBES", limits.get("urgent_probes"), _str_list)
 
     if isinstance(gc := cfg.get("gc"), dict):
         _set(res, "GC_INTERVAL", gc.get("interval"), _td)
         _set(res, "QUEUE_GC_INTERVAL", gc.get("queues_interval"), _td)
 
+    if isinstance(metrics := cfg.get("metrics"), dict):
+        _set(res, "METRICS_DIR", metrics.get("dir"))
+        _set(res, "METRICS_INTERVAL", metrics.get("interval"), _td)
+
+    if isinstance(apdu_log := cfg.get("apdu_log"), dict):
+        _set(res, "APDU_LOG_BATCH_SIZE", apdu_log.get("batch_size"))
+        _set(res, "APDU_LOG_FLUSH_INTERVAL", apdu_log.get("flush_interval"), _td)
+        _set(res, "APDU_LOG_MAX_PENDING", apdu_log.get("max_pending"))
+        _set(res, "APDU_LOG_COMPRESSION", apdu_log.get("compress"))
+        _set(
+            res,
+            "APDU_LOG_PARTITION_INTERVAL",
+            apdu_log.get("partition_interval"),
+            _opt_td,
+        )
+        _set(res, "APDU_LOG_RETENTION", apdu_log.get("retention"), _opt_td)
+
+    if isinstance(apdu_cache := cfg.get("apdu_cache"), dict):
+        _set(res, "APDU_CACHE_SIZE", apdu_cache.get("max_entries"))
+        _set(res, "APDU_CACHE_TTL", apdu_cache.get("ttl"), _td)
+
     if isinstance(auth := cfg.get("auth"), dict):
         _set(
             res,
@@ -217,6 +265,8 @@ def _load_toml_config(
         _set(res, "TUNNEL_PORT", tunnel.get("port"))
         _set(res, "TUNNEL_CERT", tunnel.get("certificate"))
         _set(res, "TUNNEL_CERT_key", tunnel.get("cert_key"))
+        _set(res, "TUNNEL_WORKERS", tunnel.get("workers"))
+        _set(res, "TUNNEL_SOCKET_DIR", tunnel.get("socket_dir"))
 
     if isinstance(logging := cfg.get("logging"), dict):
         _set(res, "LOGGING_CONF_FILE", logging.get("config_file"), _opt_str)
@@ -273,6 +323,30 @@ def _check_config(cfg: dict[str, Any]):
             )
             raise ConfigError
 
+    scheduler = cfg.get("QUEUE_SCHEDULER")
+    if scheduler is not None and scheduler not in SCHEDULERS:
+        LOGGER.error(
+            f"Unknown queue scheduler: '{scheduler}' "
+            f"expected one of: {', '.join(SCHEDULERS)}"
+        )
+        raise ConfigError
+
+    workers = cfg.get("TUNNEL_WORKERS")
+    if workers is not None and workers < 1:
+        LOGGER.error(f"Invalid number of tunnel workers: {workers}")
+        raise ConfigError
+
+    # APDU log partitions are named after their bounds in minutes
+    interval = cfg.get("APDU_LOG_PARTITION_INTERVAL")
+    if interval is not None and (
+        interval < timedelta(minutes=1) or interval % timedelta(minutes=1)
+    ):
+        LOGGER.error(
+            f"Invalid APDU log partition interval: {interval} "
+            "expected a multiple of one minute"
+        )
+        raise ConfigError
+
 
 _CONFIG: Config | None = None
 
@@ -321,6 +395,9 @@ def init_config(
         if cmd_args.cert_key is not None:
             conf["TUNNEL_CERT_KEY"] = cmd_args.cert_key
 
+        if getattr(cmd_args, "workers", None) is not None:
+            conf["TUNNEL_WORKERS"] = cmd_args.workers
+
     try:
         _CONFIG = Config(**conf)
     except TypeError as e:
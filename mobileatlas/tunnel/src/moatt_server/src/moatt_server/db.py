@@ -1,11 +1,17 @@
+import datetime
 import logging
+from collections.abc import Sequence
 from dataclasses import dataclass
+from typing import Any
 from uuid import UUID
 
 from moatt_types.connect import ApduPacket, Token
+from sqlalchemy import Row, Select, func, insert, or_, select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from . import apdu_log
 from . import models as dbm
+from . import sim_registry
 from .config import get_config
 
 LOGGER = logging.getLogger(__name__)
@@ -25,6 +31,9 @@ async def mark_provider_available(session: AsyncSession, provider_id: UUID) -> N
 
     prov.available += 1
 
+    # the provider might have re-registered its SIMs since they were cached
+    await sim_registry.get_registry().refresh_provider(session, prov)
+
 
 async def mark_provider_unavailable(session: AsyncSession, provider_id: UUID) -> None:
     prov = await session.get(dbm.Provider, provider_id)
@@ -73,23 +82,124 @@ async def get_sim_ids(
     return list(map(lambda s: (s.id, s.iccid, s.imsi), sims))
 
 
-async def log_apdu(
-    session: AsyncSession,
+def apdu_log_row(
     provider_id: UUID,
     probe_id: UUID,
+    session_id: UUID,
     sim_id: SimId,
     apdu: ApduPacket,
     sender: dbm.Sender,
-) -> dbm.ApduLog:
-    apdu_log = dbm.ApduLog(
-        provider_id=provider_id,
-        probe_id=probe_id,
-        sim_id=sim_id.id,
-        sim_iccid=sim_id.iccid,
-        sim_imsi=sim_id.imsi,
-        command=apdu.op,
-        payload=apdu.payload,
-        sender=sender,
+) -> dict[str, Any]:
+    payload, compressed = apdu_log.encode_payload(
+        apdu.payload, get_config().APDU_LOG_COMPRESSION
+    )
+
+    return {
+        "timestamp": datetime.datetime.now(tz=datetime.timezone.utc),
+        "provider_id": provider_id,
+        "probe_id": probe_id,
+        "session_id": session_id,
+        "sim_id": sim_id.id,
+        "sim_iccid": sim_id.iccid,
+        "sim_imsi": sim_id.imsi,
+        "command": apdu.op,
+        "payload": payload,
+        "compressed": compressed,
+        "sender": sender,
+    }
+
+
+async def log_apdus(session: AsyncSession, rows: Sequence[dict[str, Any]]) -> None:
+    """Insert multiple rows created by `apdu_log_row` using a single statement."""
+    if len(rows) == 0:
+        return
+
+    await session.execute(insert(dbm.ApduLog), rows)
+
+
+async def apdu_log_session_owners(
+    session: AsyncSession, session_id: UUID
+) -> tuple[UUID, UUID] | None:
+    """Returns the IDs of the provider and the probe of a logged session."""
+    row = (
+        await session.execute(
+            select(dbm.ApduLog.provider_id, dbm.ApduLog.probe_id)
+            .where(dbm.ApduLog.session_id == session_id)
+            .limit(1)
+        )
+    ).one_or_none()
+
+    return None if row is None else (row.provider_id, row.probe_id)
+
+
+async def get_apdu_log_sessions(
+    session: AsyncSession,
+    client_id: UUID,
+    limit: int,
+    before: tuple[datetime.datetime, UUID] | None = None,
+) -> Sequence[Row]:
+    """List logged sessions client took part in, most recent first.
+
+    Parameters
+    ----------
+    before
+        Start time and ID of the last session of the previous page.
+    """
+    start = func.min(dbm.ApduLog.timestamp)
+    query = (
+        select(
+            dbm.ApduLog.session_id,
+            dbm.ApduLog.provider_id,
+            dbm.ApduLog.probe_id,
+            dbm.ApduLog.sim_id,
+            dbm.ApduLog.sim_iccid,
+            dbm.ApduLog.sim_imsi,
+            start.label("start"),
+            func.max(dbm.ApduLog.timestamp).label("end"),
+            func.count().label("apdus"),
+        )
+        .where(
+            dbm.ApduLog.session_id.is_not(None),
+            or_(
+                dbm.ApduLog.provider_id == client_id,
+                dbm.ApduLog.probe_id == client_id,
+            ),
+        )
+        .group_by(
+            dbm.ApduLog.session_id,
+            dbm.ApduLog.provider_id,
+            dbm.ApduLog.probe_id,
+            dbm.ApduLog.sim_id,
+            dbm.ApduLog.sim_iccid,
+            dbm.ApduLog.sim_imsi,
+        )
+        .order_by(start.desc(), dbm.ApduLog.session_id.desc())
+        .limit(limit)
+    )
+
+    if before is not None:
+        query = query.having(tuple_(start, dbm.ApduLog.session_id) < tuple_(*before))
+
+    return (await session.execute(query)).all()
+
+
+def apdu_trace_query(
+    session_id: UUID, after: int | None = None
+) -> Select[tuple[dbm.ApduLog]]:
+    """Query for the APDUs of a session in the order they were relayed.
+
+    Parameters
+    ----------
+    after
+        Only return APDUs with an ID greater than after.
+    """
+    query = (
+        select(dbm.ApduLog)
+        .where(dbm.ApduLog.session_id == session_id)
+        .order_by(dbm.ApduLog.id)
     )
-    session.add(apdu_log)
-    return apdu_log
+
+    if after is not None:
+        query = query.where(dbm.ApduLog.id > after)
+
+    return query
@@ -0,0 +1,341 @@
+"""Minimal metrics library producing the Prometheus text exposition format.
+
+The tunnel server and the REST API run in separate processes. Processes that do
+not serve `/metrics` themselves periodically write a snapshot of their metrics to
+a shared directory (see `snapshot_writer`) from which the REST API renders them.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections.abc import Callable, Iterable
+from datetime import timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+Labels = tuple[str, ...]
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: dict[str, str]) -> Labels:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"Expected labels {self.labelnames} but got {labels}.")
+
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        raise NotImplementedError
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "name": self.name,
+            "help": self.help,
+            "type": self.TYPE,
+            "samples": self.samples(),
+        }
+
+
+class Counter(_Metric):
+    """Monotonically increasing value."""
+
+    TYPE = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        return [
+            (self.name + "_total", dict(zip(self.labelnames, k)), v)
+            for k, v in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Value that can go up and down.
+
+    Instead of being set explicitly, the value can also be computed by a function
+    whenever the gauge is read.
+    """
+
+    TYPE = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        fn: Optional[Callable[[], float | dict[Labels, float]]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self._values: dict[Labels, float] = {}
+        self._fn = fn
+
+    def set(self, value: float, **labels: str) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        values = self._values
+
+        if self._fn is not None:
+            v = self._fn()
+            values = v if isinstance(v, dict) else {(): v}
+
+        return [
+            (self.name, dict(zip(self.labelnames, k)), v) for k, v in values.items()
+        ]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (e.g. latencies in seconds).
+
+    Buckets are log-linear as in HDR histograms: every power of two between lowest
+    and highest is split into `sub_buckets` equally sized buckets. This bounds the
+    relative error of the reported quantiles independently of the magnitude of the
+    observed values and makes recording a value O(1).
+    """
+
+    TYPE = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Iterable[str] = (),
+        lowest: float = 2**-17,  # ~7.6 us
+        highest: float = 2**7,  # 128 s
+        sub_buckets: int = 4,
+    ):
+        super().__init__(name, help, labelnames)
+
+        self._min_exp = math.frexp(lowest)[1]
+        self._max_exp = math.frexp(highest)[1]
+        self._sub_buckets = sub_buckets
+        self.bounds: list[float] = [
+            math.ldexp(0.5 + 0.5 * (s + 1) / sub_buckets, e)
+            for e in range(self._min_exp, self._max_exp)
+            for s in range(sub_buckets)
+        ]
+
+        # label values -> (bucket counts (+Inf bucket last), sum)
+        self._values: dict[Labels, tuple[list[int], list[float]]] = {}
+
+    def _index(self, value: float) -> int:
+        if value <= 0:
+            return 0
+
+        mantissa, exp = math.frexp(value)
+
+        if exp < self._min_exp:
+            return 0
+        if exp >= self._max_exp:
+            return len(self.bounds)
+
+        # mantissa is in [0.5, 1)
+        sub = math.ceil((mantissa - 0.5) * 2 * self._sub_buckets) - 1
+        return (exp - self._min_exp) * self._sub_buckets + max(sub, 0)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        entry = self._values.get(key)
+
+        if entry is None:
+            entry = ([0] * (len(self.bounds) + 1), [0.0])
+            self._values[key] = entry
+
+        entry[0][self._index(value)] += 1
+        entry[1][0] += value
+
+    def time(self, **labels: str) -> "_Timer":
+        """Context manager observing the time spent inside of it."""
+        return _Timer(self, labels)
+
+    def samples(self) -> list[tuple[str, dict[str, str], float]]:
+        res = []
+
+        for key, (counts, total) in self._values.items():
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+
+            for bound, count in zip(self.bounds, counts):
+                cumulative += count
+                # only buckets that received values are exported to keep the
+                # output small; cumulative counts stay correct
+                if count > 0:
+                    res.append(
+                        (
+                            self.name + "_bucket",
+                            labels | {"le": repr(bound)},
+                            cumulative,
+                        )
+                    )
+
+            cumulative += counts[-1]
+            res.append((self.name + "_bucket", labels | {"le": "+Inf"}, cumulative))
+            res.append((self.name + "_sum", labels, total[0]))
+            res.append((self.name + "_count", labels, cumulative))
+
+        return res
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict[str, str]):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._histogram.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+
+        self._metrics[metric.name] = metric
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        return [m.snapshot() for m in self._metrics.values()]
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+    c = Counter(name, help, labelnames)
+    REGISTRY.register(c)
+    return c
+
+
+def gauge(
+    name: str,
+    help: str,
+    labelnames: Iterable[str] = (),
+    fn: Optional[Callable[[], float | dict[Labels, float]]] = None,
+) -> Gauge:
+    g = Gauge(name, help, labelnames, fn)
+    REGISTRY.register(g)
+    return g
+
+
+def histogram(name: str, help: str, labelnames: Iterable[str] = ()) -> Histogram:
+    h = Histogram(name, help, labelnames)
+    REGISTRY.register(h)
+    return h
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render(snapshots: Iterable[tuple[dict[str, str], list[dict[str, Any]]]]) -> str:
+    """Render metric snapshots in the Prometheus text exposition format.
+
+    Parameters
+    ----------
+    snapshots
+        Pairs of labels identifying the process and the snapshot of its registry.
+    """
+    # all samples of a metric have to be grouped together
+    metrics: dict[str, tuple[dict[str, Any], list[str]]] = {}
+
+    for proc_labels, snapshot in snapshots:
+        for m in snapshot:
+            _, lines = metrics.setdefault(m["name"], (m, []))
+
+            for name, labels, value in m["samples"]:
+                labels = proc_labels | labels
+                label_str = ",".join(
+                    f'{k}="{_escape(str(v))}"' for k, v in labels.items()
+                )
+                lines.append(
+                    f"{name}{{{label_str}}} {value}" if label_str else f"{name} {value}"
+                )
+
+    out = []
+    for name, (m, lines) in metrics.items():
+        out.append(f"# HELP {name} {m['help']}")
+        out.append(f"# TYPE {name} {m['type']}")
+        out.extend(lines)
+
+    return "\n".join(out) + "\n"
+
+
+def write_snapshot(directory: Path, name: str) -> None:
+    """Atomically write a snapshot of this process's metrics to directory."""
+    path = directory / f"{name}.json"
+    tmp = directory / f".{name}.json.tmp"
+
+    with open(tmp, "w") as f:
+        json.dump({"time": time.time(), "metrics": REGISTRY.snapshot()}, f)
+
+    os.replace(tmp, path)
+
+
+def read_snapshots(
+    directory: Path, max_age: timedelta
+) -> list[tuple[dict[str, str], list[dict[str, Any]]]]:
+    """Read all snapshots in directory that are not older than max_age."""
+    res = []
+    now = time.time()
+
+    for path in sorted(directory.glob("*.json")):
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f"Failed to read metrics snapshot {path}: {e}")
+            continue
+
+        if now - snapshot["time"] > max_age.total_seconds():
+            continue
+
+        res.append(({"process": path.stem}, snapshot["metrics"]))
+
+    return res
+
+
+async def snapshot_writer(directory: Path, name: str, interval: timedelta) -> None:
+    """Periodically write snapshots of this process's metrics. Runs until cancelled."""
+    directory.mkdir(parents=True, exist_ok=True)
+
+    try:
+        while True:
+            try:
+                write_snapshot(directory, name)
+            except OSError as e:
+                LOGGER.warning(f"Failed to write metrics snapshot: {e}")
+
+            await asyncio.sleep(interval.total_seconds())
+    finally:
+        (directory / f"{name}.json").unlink(missing_ok=True)
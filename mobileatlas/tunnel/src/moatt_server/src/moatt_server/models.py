@@ -36,6 +36,8 @@ class Provider(Base):
     last_active: Mapped[Optional[datetime.datetime]] = mapped_column(
         TIMESTAMP(timezone=True), server_default=func.now()
     )
+    # incremented whenever the provider's SIMs change
+    sims_version: Mapped[int] = mapped_column(server_default="0")
 
     sims: Mapped[List["Sim"]] = relationship(
         "Sim", back_populates="provider", cascade="all, delete", passive_deletes=True
@@ -64,12 +66,17 @@ class ApduLog(Base):
     timestamp: Mapped[datetime.datetime] = mapped_column(
         TIMESTAMP(timezone=True),
         server_default=func.now(),
+        index=True,
     )
     provider_id: Mapped[UUID]
     probe_id: Mapped[UUID]
+    # identifies the connection between probe and SIM card the APDU was relayed on
+    session_id: Mapped[Optional[UUID]] = mapped_column(index=True)
     sim_id: Mapped[int]
     sim_iccid: Mapped[Optional[str]]
     sim_imsi: Mapped[Optional[str]]
     command: Mapped[ApduOp]
     payload: Mapped[Optional[bytes]] = mapped_column(LargeBinary)
+    # whether payload is zlib compressed (see apdu_log.decode_payload)
+    compressed: Mapped[bool] = mapped_column(server_default="FALSE")
     sender: Mapped[Sender]
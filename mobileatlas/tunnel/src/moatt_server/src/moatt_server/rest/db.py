@@ -26,3 +26,12 @@ async def get_db():
 
     async with AsyncSession(_ENGINE, autobegin=False) as session:
         yield session
+
+
+def new_session() -> AsyncSession:
+    """Create a session that outlives the request (e.g. for streaming responses)."""
+    assert (
+        _ENGINE is not None
+    ), "DB session was requested before the setup was completed."
+
+    return AsyncSession(_ENGINE, autobegin=False)
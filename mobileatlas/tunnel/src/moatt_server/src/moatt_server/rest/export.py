@@ -0,0 +1,125 @@
+"""Export formats of APDU traces.
+
+Exporters consume the APDU log entries of a session one by one and produce the
+encoded trace incrementally so that traces never have to be held in memory.
+"""
+
+import datetime
+import struct
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import Optional
+
+from moatt_types.connect import ApduOp
+
+from .. import apdu_log
+from .. import models as dbm
+from . import models as pydantic_models
+
+# LINKTYPE_IPV4
+_PCAP_LINKTYPE = 228
+_PCAP_HEADER = struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 0xFFFF, _PCAP_LINKTYPE)
+_PCAP_RECORD = struct.Struct("<IIII")
+
+_GSMTAP_PORT = 4729
+_GSMTAP_TYPE_SIM = 0x04
+# version 2; header length in 32-bit words; type; all other fields are unused
+_GSMTAP_HEADER = struct.pack(
+    "!BBBBHbbIBBBB", 2, 4, _GSMTAP_TYPE_SIM, 0, 0, 0, 0, 0, 0, 0, 0, 0
+)
+
+_LOCALHOST = bytes([127, 0, 0, 1])
+
+
+def utc(ts: datetime.datetime) -> datetime.datetime:
+    # SQLite does not store time zones
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=datetime.timezone.utc)
+
+    return ts
+
+
+def entry_model(entry: dbm.ApduLog) -> pydantic_models.ApduLogEntry:
+    payload = apdu_log.decode_payload(entry.payload, entry.compressed)
+
+    return pydantic_models.ApduLogEntry(
+        id=entry.id,
+        timestamp=utc(entry.timestamp),
+        sender=entry.sender.name,  # pyright: ignore[reportArgumentType]
+        op=entry.command.name,  # pyright: ignore[reportArgumentType]
+        payload=payload.hex() if payload is not None else None,
+    )
+
+
+async def jsonl(entries: AsyncIterable[dbm.ApduLog]) -> AsyncIterator[bytes]:
+    """One JSON encoded `ApduLogEntry` per line."""
+    async for entry in entries:
+        yield entry_model(entry).model_dump_json().encode() + b"\n"
+
+
+def _checksum(header: bytes) -> int:
+    total = sum(struct.unpack(f"!{len(header) // 2}H", header))
+    while total > 0xFFFF:
+        total = (total & 0xFFFF) + (total >> 16)
+
+    return ~total & 0xFFFF
+
+
+def _pcap_record(ts: datetime.datetime, apdu: bytes) -> bytes:
+    udp_len = 8 + len(_GSMTAP_HEADER) + len(apdu)
+    ip_header = struct.pack(
+        "!BBHHHBBH4s4s",
+        0x45,
+        0,
+        20 + udp_len,
+        0,
+        0x4000,  # don't fragment
+        64,
+        17,  # UDP
+        0,
+        _LOCALHOST,
+        _LOCALHOST,
+    )
+    ip_header = (
+        ip_header[:10] + struct.pack("!H", _checksum(ip_header)) + ip_header[12:]
+    )
+    packet = (
+        ip_header
+        + struct.pack("!HHHH", _GSMTAP_PORT, _GSMTAP_PORT, udp_len, 0)
+        + _GSMTAP_HEADER
+        + apdu
+    )
+
+    ts = utc(ts)
+    seconds = int(ts.timestamp())
+    return _PCAP_RECORD.pack(seconds, ts.microsecond, len(packet), len(packet)) + packet
+
+
+async def pcap(entries: AsyncIterable[dbm.ApduLog]) -> AsyncIterator[bytes]:
+    """pcap capture of GSMTAP SIM packets as produced by SIMtrace.
+
+    Every packet contains a command of the probe followed by the SIM's response.
+    Resets are omitted.
+    """
+    yield _PCAP_HEADER
+
+    command: Optional[tuple[datetime.datetime, bytes]] = None
+
+    async for entry in entries:
+        payload = apdu_log.decode_payload(entry.payload, entry.compressed) or b""
+
+        if entry.command != ApduOp.Apdu:
+            if command is not None:
+                yield _pcap_record(*command)
+            command = None
+        elif entry.sender == dbm.Sender.Probe:
+            if command is not None:
+                yield _pcap_record(*command)
+            command = (entry.timestamp, payload)
+        elif command is not None:
+            yield _pcap_record(command[0], command[1] + payload)
+            command = None
+        else:
+            yield _pcap_record(entry.timestamp, payload)
+
+    if command is not None:
+        yield _pcap_record(*command)
@@ -1,21 +1,28 @@
 import asyncio
+import base64
 import contextlib
+import datetime
 import logging
-from typing import Annotated
+from pathlib import Path
+from typing import Annotated, Literal, Optional
+from uuid import UUID
 
-from fastapi import Depends, FastAPI, Request, Response
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from moatt_types.connect import Token
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .. import auth, db
+from .. import apdu_log, auth, db, metrics
 from ..config import get_config
 from . import auth as rest_auth
 from . import db as db_utils
+from . import export
 from . import models as pydantic_models
 
 LOGGER = logging.getLogger(__name__)
 
+SIMS_VERSION_HEADER = "Sims-Version"
+
 
 @contextlib.asynccontextmanager
 async def lifespan(_: FastAPI):
@@ -24,9 +31,7 @@ async def lifespan(_: FastAPI):
     while True:
         try:
             async with db_utils._ENGINE.begin() as conn:
-                from .. import models as dbm
-
-                await conn.run_sync(dbm.Base.metadata.create_all)
+                await conn.run_sync(apdu_log.create_schema, get_config())
             break
         except Exception:
             LOGGER.exception("Failed to connect to database.\nRetrying in 10s...")
@@ -35,6 +40,7 @@ async def lifespan(_: FastAPI):
     yield
 
     await db_utils.dispose_engine()
+    await get_config().AUTH_HANDLER.close()
 
 
 app = FastAPI(lifespan=lifespan, **get_config().api_doc_settings())
@@ -53,6 +59,31 @@ async def provider_register(
         if await auth.register_provider(session, session_token, sims):
             response.status_code = 201
 
+        version = await auth.sims_version(session, session_token)
+
+    # base version of subsequent PATCH requests
+    response.headers[SIMS_VERSION_HEADER] = str(version)
+
+
+@app.patch("/provider/sims")
+async def provider_update_sims(
+    delta: pydantic_models.SimDelta,
+    session_token: Annotated[Token, Depends(rest_auth.session_token)],
+    session: Annotated[AsyncSession, Depends(db_utils.get_db)],
+) -> pydantic_models.SimsVersion:
+    """Add and remove SIMs without re-registering the provider's other SIMs.
+
+    Fails with 409 if the registered SIMs are not at `delta.version`.
+    """
+    added = {s.id: (s.get_iccid(), s.get_imsi()) for s in delta.add.root}
+
+    async with session.begin():
+        version = await auth.update_sims(
+            session, session_token, delta.version, added, set(delta.remove)
+        )
+
+    return pydantic_models.SimsVersion(version=version)
+
 
 @app.get("/provider/sims")
 async def provider_get_registered_sims(
@@ -76,6 +107,162 @@ async def provider_get_registered_sims(
     )
 
 
+async def _identity(session_token: Token) -> UUID:
+    client_id = await auth.identity(session_token)
+
+    if client_id is None:
+        raise auth.AuthError
+
+    return client_id
+
+
+async def _check_trace_access(
+    session: AsyncSession, session_token: Token, session_id: UUID
+) -> None:
+    """Only the provider and the probe of a session may access its trace."""
+    client_id = await _identity(session_token)
+
+    async with session.begin():
+        owners = await db.apdu_log_session_owners(session, session_id)
+
+    if owners is None:
+        raise HTTPException(status_code=404, detail="Unknown session.")
+
+    if client_id not in owners:
+        raise auth.AuthError
+
+
+def _session_cursor(start: datetime.datetime, session_id: UUID) -> str:
+    # opaque and URL-safe (ISO timestamps contain "+", which decodes to " ")
+    cursor = f"{start.isoformat()}_{session_id}".encode()
+    return base64.urlsafe_b64encode(cursor).rstrip(b"=").decode()
+
+
+def _parse_session_cursor(cursor: str) -> tuple[datetime.datetime, UUID]:
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        start, session_id = decoded.decode().split("_", 1)
+        return datetime.datetime.fromisoformat(start), UUID(session_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Malformed cursor.")
+
+
+@app.get("/apdu-log/sessions")
+async def apdu_log_sessions(
+    session: Annotated[AsyncSession, Depends(db_utils.get_db)],
+    session_token: Annotated[Token, Depends(rest_auth.session_token)],
+    limit: Annotated[int, Query(ge=1, le=1000)] = 100,
+    cursor: Optional[str] = None,
+) -> pydantic_models.ApduSessionPage:
+    """Sessions the client took part in as provider or probe, most recent first."""
+    client_id = await _identity(session_token)
+    before = _parse_session_cursor(cursor) if cursor is not None else None
+
+    async with session.begin():
+        rows = await db.get_apdu_log_sessions(session, client_id, limit, before)
+
+    return pydantic_models.ApduSessionPage(
+        sessions=[
+            pydantic_models.ApduSession(
+                id=r.session_id,
+                provider_id=r.provider_id,
+                probe_id=r.probe_id,
+                sim_id=r.sim_id,
+                iccid=r.sim_iccid,
+                imsi=r.sim_imsi,
+                start=export.utc(r.start),
+                end=export.utc(r.end),
+                apdus=r.apdus,
+            )
+            for r in rows
+        ],
+        next_cursor=(
+            _session_cursor(rows[-1].start, rows[-1].session_id)
+            if len(rows) == limit
+            else None
+        ),
+    )
+
+
+@app.get("/apdu-log/sessions/{session_id}/apdus")
+async def apdu_log_trace(
+    session_id: UUID,
+    session: Annotated[AsyncSession, Depends(db_utils.get_db)],
+    session_token: Annotated[Token, Depends(rest_auth.session_token)],
+    limit: Annotated[int, Query(ge=1, le=10000)] = 1000,
+    after: Optional[int] = None,
+) -> pydantic_models.ApduTracePage:
+    """APDUs of a session in the order they were relayed."""
+    await _check_trace_access(session, session_token, session_id)
+
+    async with session.begin():
+        entries = (
+            await session.scalars(db.apdu_trace_query(session_id, after).limit(limit))
+        ).all()
+        apdus = [export.entry_model(e) for e in entries]
+
+    return pydantic_models.ApduTracePage(
+        apdus=apdus,
+        next_after=apdus[-1].id if len(apdus) == limit else None,
+    )
+
+
+@app.get(
+    "/apdu-log/sessions/{session_id}/export",
+    response_class=StreamingResponse,
+    responses={
+        200: {
+            "content": {"application/x-ndjson": {}, "application/vnd.tcpdump.pcap": {}}
+        }
+    },
+)
+async def apdu_log_export(
+    session_id: UUID,
+    session: Annotated[AsyncSession, Depends(db_utils.get_db)],
+    session_token: Annotated[Token, Depends(rest_auth.session_token)],
+    format: Literal["jsonl", "pcap"] = "jsonl",
+) -> StreamingResponse:
+    """Export the APDUs of a session as JSON lines or as pcap file (GSMTAP SIM)."""
+    await _check_trace_access(session, session_token, session_id)
+
+    async def entries():
+        # the trace is read using a server-side cursor and outlives the request's
+        # session
+        async with db_utils.new_session() as s, s.begin():
+            result = await s.stream_scalars(
+                db.apdu_trace_query(session_id).execution_options(yield_per=1000)
+            )
+            async for entry in result:
+                yield entry
+
+    if format == "pcap":
+        body, media_type = export.pcap(entries()), "application/vnd.tcpdump.pcap"
+    else:
+        body, media_type = export.jsonl(entries()), "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{session_id}.{format}"'
+        },
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics() -> str:
+    cfg = get_config()
+    snapshots = [({"process": "api"}, metrics.REGISTRY.snapshot())]
+
+    if cfg.METRICS_DIR is not None:
+        # snapshots of processes that did not update them recently are stale
+        snapshots += metrics.read_snapshots(
+            Path(cfg.METRICS_DIR), 3 * cfg.METRICS_INTERVAL
+        )
+
+    return metrics.render(snapshots)
+
+
 @app.exception_handler(auth.AuthError)
 def autherror_ex_handler(_: Request, _exc: auth.AuthError) -> JSONResponse:
     return JSONResponse(
@@ -84,6 +271,15 @@ def autherror_ex_handler(_: Request, _exc: auth.AuthError) -> JSONResponse:
     )
 
 
+@app.exception_handler(auth.VersionConflict)
+def versionconflict_ex_handler(_: Request, exc: auth.VersionConflict) -> JSONResponse:
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "Version conflict", "version": exc.version},
+        headers={SIMS_VERSION_HEADER: str(exc.version)},
+    )
+
+
 @app.exception_handler(auth.TokenError)
 def tokenerror_ex_handler(_: Request, _exc: auth.TokenError) -> JSONResponse:
     return JSONResponse(
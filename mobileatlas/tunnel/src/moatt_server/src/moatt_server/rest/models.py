@@ -1,4 +1,6 @@
-from typing import Annotated, Optional
+import datetime
+from typing import Annotated, Literal, Optional
+from uuid import UUID
 
 import moatt_types.connect as mtc
 from pydantic import AfterValidator, BaseModel, Field, RootModel, field_validator
@@ -61,5 +63,49 @@ class SimList(RootModel):
         return sims
 
 
+class SimDelta(BaseModel):
+    # version of the registered SIMs the delta is based on
+    version: int = Field(ge=0)
+    add: SimList = SimList(root=[])
+    remove: list[int] = []
+
+
+class SimsVersion(BaseModel):
+    version: int
+
+
 class RegistrationResp(BaseModel):
     session_token: str
+
+
+class ApduSession(BaseModel):
+    id: UUID
+    provider_id: UUID
+    probe_id: UUID
+    sim_id: int
+    iccid: Optional[str] = None
+    imsi: Optional[str] = None
+    start: datetime.datetime
+    end: datetime.datetime
+    apdus: int
+
+
+class ApduSessionPage(BaseModel):
+    sessions: list[ApduSession]
+    # pass as cursor to retrieve the next page
+    next_cursor: Optional[str] = None
+
+
+class ApduLogEntry(BaseModel):
+    id: int
+    timestamp: datetime.datetime
+    sender: Literal["Probe", "Provider"]
+    op: Literal["Apdu", "Reset"]
+    # hex encoded
+    payload: Optional[str] = None
+
+
+class ApduTracePage(BaseModel):
+    apdus: list[ApduLogEntry]
+    # pass as after to retrieve the next page
+    next_after: Optional[int] = None
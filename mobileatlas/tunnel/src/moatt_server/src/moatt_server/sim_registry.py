@@ -0,0 +1,215 @@
+import bisect
+import logging
+from collections.abc import Awaitable, Callable
+from typing import Optional
+from uuid import UUID
+
+from moatt_types.connect import Iccid, Imsi, SimId, SimIndex
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import selectinload
+
+from . import models as dbm
+
+LOGGER = logging.getLogger(__name__)
+
+
+class SimRegistry:
+    """In-memory index of registered SIM cards.
+
+    SIMs are indexed by every identifier type a probe can use to request them. The
+    registry is only a cache of the database: Lookups that miss fall back to the
+    database. SIMs are registered through the REST API, which runs in a separate
+    process, so modifications cannot invalidate entries directly. Instead the
+    registry is reloaded periodically and a provider's SIMs are reloaded when it
+    connects if their version (`Provider.sims_version`) changed since they were
+    cached. Until then lookups might return outdated SIMs.
+
+    Cached SIMs are detached ORM objects with their provider already loaded. They
+    are shared between connections and must not be modified.
+    """
+
+    def __init__(self):
+        self._sims: dict[tuple[UUID, int], dbm.Sim] = {}
+        self._by_iccid: dict[str, dbm.Sim] = {}
+        self._by_imsi: dict[str, dbm.Sim] = {}
+        # SIMs of each provider ordered by their id
+        self._by_provider: dict[UUID, list[dbm.Sim]] = {}
+        # providers whose SIMs are all known (required to resolve SimIndex lookups)
+        self._complete: set[UUID] = set()
+        # sims_version of complete providers at the time their SIMs were loaded
+        self._versions: dict[UUID, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._sims)
+
+    async def load(self, session: AsyncSession) -> None:
+        """Replace the contents of the registry with all SIMs in the database."""
+        sims = await session.scalars(
+            select(dbm.Sim).options(selectinload(dbm.Sim.provider))
+        )
+
+        registry = SimRegistry()
+        for sim in sims:
+            registry.add(sim)
+        registry._complete = set(registry._by_provider.keys())
+        registry._versions = {
+            provider_id: sims[0].provider.sims_version
+            for provider_id, sims in registry._by_provider.items()
+        }
+
+        self._sims = registry._sims
+        self._by_iccid = registry._by_iccid
+        self._by_imsi = registry._by_imsi
+        self._by_provider = registry._by_provider
+        self._complete = registry._complete
+        self._versions = registry._versions
+
+        LOGGER.debug(f"Loaded {len(self._sims)} SIM(s) into the SIM registry.")
+
+    async def load_provider(self, session: AsyncSession, provider_id: UUID) -> None:
+        """Replace all cached SIMs of a provider with the ones in the database."""
+        sims = list(
+            await session.scalars(
+                select(dbm.Sim)
+                .where(dbm.Sim.provider_id == provider_id)
+                .options(selectinload(dbm.Sim.provider))
+            )
+        )
+
+        self.discard_provider(provider_id)
+        for sim in sims:
+            self.add(sim)
+        self._complete.add(provider_id)
+
+    async def refresh_provider(
+        self, session: AsyncSession, provider: dbm.Provider
+    ) -> None:
+        """Reload the SIMs of a provider if they changed since they were cached."""
+        if self._versions.get(provider.id) == provider.sims_version:
+            return
+
+        await self.load_provider(session, provider.id)
+        self._versions[provider.id] = provider.sims_version
+
+    def add(self, sim: dbm.Sim) -> None:
+        self.discard(sim.provider_id, sim.id)
+
+        # SIMs of other providers that used the same identifiers are outdated
+        for old in (self._by_iccid.get(sim.iccid), self._by_imsi.get(sim.imsi)):
+            if old is not None:
+                self.discard(old.provider_id, old.id)
+
+        self._sims[(sim.provider_id, sim.id)] = sim
+        if sim.iccid is not None:
+            self._by_iccid[sim.iccid] = sim
+        if sim.imsi is not None:
+            self._by_imsi[sim.imsi] = sim
+
+        sims = self._by_provider.setdefault(sim.provider_id, [])
+        sims.insert(bisect.bisect(sims, sim.id, key=lambda s: s.id), sim)
+
+    def discard(self, provider_id: UUID, sim_id: int) -> None:
+        sim = self._sims.pop((provider_id, sim_id), None)
+
+        if sim is None:
+            return
+
+        if sim.iccid is not None and self._by_iccid.get(sim.iccid) is sim:
+            del self._by_iccid[sim.iccid]
+        if sim.imsi is not None and self._by_imsi.get(sim.imsi) is sim:
+            del self._by_imsi[sim.imsi]
+
+        sims = self._by_provider[provider_id]
+        sims.remove(sim)
+        if len(sims) == 0:
+            del self._by_provider[provider_id]
+
+        self._complete.discard(provider_id)
+        self._versions.pop(provider_id, None)
+
+    def discard_provider(self, provider_id: UUID) -> None:
+        for sim in list(self._by_provider.get(provider_id, [])):
+            self.discard(provider_id, sim.id)
+
+        self._complete.discard(provider_id)
+        self._versions.pop(provider_id, None)
+
+    def lookup(self, identifier: SimId | Iccid | Imsi | SimIndex) -> Optional[dbm.Sim]:
+        """Find a SIM without consulting the database."""
+        match identifier:
+            case SimId(provider=prov_id, id=id):
+                return self._sims.get((prov_id, id))
+            case Iccid(iccid=iccid):
+                return self._by_iccid.get(iccid)
+            case Imsi(imsi=imsi):
+                return self._by_imsi.get(imsi)
+            case SimIndex(provider=prov_id, index=index):
+                if prov_id not in self._complete:
+                    return None
+
+                sims = self._by_provider.get(prov_id, [])
+                return sims[index] if 0 <= index < len(sims) else None
+            case _:
+                raise NotImplementedError
+
+    async def get(
+        self, session: AsyncSession, identifier: SimId | Iccid | Imsi | SimIndex
+    ) -> Optional[dbm.Sim]:
+        """Find a SIM, querying the database if it is not cached."""
+        sim = self.lookup(identifier)
+
+        if sim is not None:
+            self.hits += 1
+            return sim
+
+        self.misses += 1
+
+        if isinstance(identifier, SimIndex):
+            # only whole providers can answer index lookups
+            await self.load_provider(session, identifier.provider)
+            return self.lookup(identifier)
+
+        match identifier:
+            case SimId(provider=prov_id, id=id):
+                cond = (dbm.Sim.provider_id == prov_id) & (dbm.Sim.id == id)
+            case Iccid(iccid=iccid):
+                cond = dbm.Sim.iccid == iccid
+            case Imsi(imsi=imsi):
+                cond = dbm.Sim.imsi == imsi
+            case _:
+                raise NotImplementedError
+
+        sim = await session.scalar(
+            select(dbm.Sim).where(cond).options(selectinload(dbm.Sim.provider))
+        )
+
+        if sim is not None:
+            self.add(sim)
+
+        return sim
+
+
+_REGISTRY = SimRegistry()
+
+
+def get_registry() -> SimRegistry:
+    return _REGISTRY
+
+
+def reload_coro_factory(
+    async_session: async_sessionmaker[AsyncSession],
+) -> Callable[[], Awaitable[None]]:
+    async def f():
+        async with async_session() as session, session.begin():
+            await _REGISTRY.load(session)
+
+        LOGGER.debug(
+            f"SIM registry statistics: {len(_REGISTRY)} SIM(s); "
+            f"{_REGISTRY.hits} hit(s); {_REGISTRY.misses} miss(es)"
+        )
+
+    return f
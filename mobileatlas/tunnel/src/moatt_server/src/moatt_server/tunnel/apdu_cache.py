@@ -0,0 +1,351 @@
+"""Cache for the responses of SIM cards to commands reading static files.
+
+While a modem boots it reads the same elementary files (ICCID, IMSI, SPN, PLMN
+lists, ...) in the same order every time. `SessionCache` learns these exchanges
+and answers them without waiting for the provider.
+
+A SIM card's response to a read-only command is determined by the SIM's content
+and by the commands it received since it was reset. Cached responses are
+therefore keyed by a digest of all state changing commands (and their responses)
+since the last reset and are only valid for the content epoch of the SIM they
+were learned for. The epoch is advanced whenever a command that might modify the
+SIM's content is relayed. Responses also expire after a fixed time to live, so
+changes the cache cannot observe are picked up eventually.
+
+Commands answered from the cache never reach the SIM. State changing commands
+answered from the cache (e.g. SELECT) are replayed to the SIM before the next
+command that has to be relayed, so the SIM ends up in the same state as if it had
+received all commands. Replayed responses are compared with the cached ones.
+
+Commands that are not deterministic (e.g. AUTHENTICATE) or whose effect is not
+modelled are always relayed and disable the cache for the rest of the session
+until the SIM is reset.
+
+Only final responses are cached. Status words asking the terminal to do more
+(e.g. to FETCH a proactive command or to GET RESPONSE) depend on state that is not
+modelled and would make the modem act on work the SIM does not have pending.
+"""
+
+import collections
+import enum
+import hashlib
+import logging
+from typing import Optional
+from uuid import UUID
+
+from .. import metrics
+from ..auth_handlers.cache import TtlLruCache
+
+LOGGER = logging.getLogger(__name__)
+
+_LOOKUPS = metrics.counter(
+    "moat_tunnel_apdu_cache_lookups", "APDU response cache lookups.", ["result"]
+)
+_INVALIDATIONS = metrics.counter(
+    "moat_tunnel_apdu_cache_invalidations",
+    "Content epochs of SIM cards advanced by the APDU response cache.",
+    ["reason"],
+)
+
+# (provider ID, SIM ID, ICCID, IMSI)
+SimKey = tuple[UUID, int, Optional[str], Optional[str]]
+
+_INS_GET_RESPONSE = 0xC0
+_INS_ENVELOPE = 0xC2
+
+# BER-TLV tags of ENVELOPEs that download data to the SIM (SMS-PP and cell
+# broadcast data download), which might update files over the air
+_DOWNLOAD_TAGS = (0xD1, 0xD2)
+
+
+class _Kind(enum.Enum):
+    # does not change the SIM's state; can be answered from the cache
+    READ = enum.auto()
+    # changes the SIM's state deterministically; can be answered from the cache
+    # but has to be replayed before the next relayed command
+    STATE = enum.auto()
+    # always relayed; changes the SIM's state deterministically
+    RELAY = enum.auto()
+    # always relayed; might change the SIM's content
+    WRITE = enum.auto()
+    # always relayed; not deterministic but does not change the SIM's content
+    VOLATILE = enum.auto()
+    # always relayed; effect is unknown and might change the SIM's content
+    OTHER = enum.auto()
+
+
+_KINDS = {
+    0xB0: _Kind.READ,  # READ BINARY
+    0xB2: _Kind.READ,  # READ RECORD (see _classify)
+    0xC0: _Kind.READ,  # GET RESPONSE
+    0xF2: _Kind.READ,  # STATUS
+    0xA4: _Kind.STATE,  # SELECT
+    0x20: _Kind.RELAY,  # VERIFY PIN
+    0x10: _Kind.RELAY,  # TERMINAL PROFILE
+    0xD6: _Kind.WRITE,  # UPDATE BINARY
+    0xDC: _Kind.WRITE,  # UPDATE RECORD
+    0x32: _Kind.WRITE,  # INCREASE
+    0xDB: _Kind.WRITE,  # SET DATA
+    0xD0: _Kind.WRITE,  # WRITE BINARY
+    0xD2: _Kind.WRITE,  # WRITE RECORD
+    0xE2: _Kind.WRITE,  # APPEND RECORD
+    0xD4: _Kind.WRITE,  # RESIZE FILE
+    0xE0: _Kind.WRITE,  # CREATE FILE
+    0xE4: _Kind.WRITE,  # DELETE FILE
+    0x04: _Kind.WRITE,  # DEACTIVATE FILE
+    0x44: _Kind.WRITE,  # ACTIVATE FILE
+    0x24: _Kind.WRITE,  # CHANGE PIN
+    0x26: _Kind.WRITE,  # DISABLE PIN
+    0x28: _Kind.WRITE,  # ENABLE PIN
+    0x2C: _Kind.WRITE,  # UNBLOCK PIN
+    0x88: _Kind.VOLATILE,  # AUTHENTICATE
+    0x84: _Kind.VOLATILE,  # GET CHALLENGE
+    0x12: _Kind.VOLATILE,  # FETCH
+    0x14: _Kind.VOLATILE,  # TERMINAL RESPONSE
+    0xC2: _Kind.VOLATILE,  # ENVELOPE (see _classify)
+}
+
+
+def _is_final(response: bytes) -> bool:
+    """Whether the status word completes the command (normal or warning)."""
+    if len(response) < 2:
+        return False
+
+    sw1, sw2 = response[-2:]
+    return (sw1 == 0x90 and sw2 == 0x00) or sw1 in (0x62, 0x63)
+
+
+def _classify(command: bytes) -> _Kind:
+    if len(command) < 4:
+        return _Kind.OTHER
+
+    cla, ins, _, p2 = command[:4]
+
+    # only the basic logical channel without secure messaging is modelled
+    if cla not in (0x00, 0x80, 0xA0):
+        return _Kind.OTHER
+
+    # reading the next or previous record moves the record pointer
+    if ins == 0xB2 and p2 & 0x07 in (0x02, 0x03):
+        return _Kind.STATE
+
+    # other ENVELOPEs (e.g. event downloads or menu selections) only affect the
+    # proactive session
+    if ins == _INS_ENVELOPE and len(command) > 5 and command[5] in _DOWNLOAD_TAGS:
+        return _Kind.WRITE
+
+    return _KINDS.get(ins, _Kind.OTHER)
+
+
+class ResponseCache:
+    """Learned responses of all SIM cards served by this process."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._responses = TtlLruCache(maxsize)
+        self._ttl = ttl
+        self._epochs: dict[SimKey, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    def epoch(self, sim: SimKey) -> int:
+        return self._epochs.get(sim, 0)
+
+    def invalidate(self, sim: SimKey, reason: str) -> None:
+        """Advance the content epoch of sim, invalidating its cached responses.
+
+        Stale entries are not removed but are evicted eventually because they can
+        no longer be looked up.
+        """
+        LOGGER.debug(f"Invalidating cached responses of {sim}. ({reason})")
+        _INVALIDATIONS.inc(reason=reason)
+        self._epochs[sim] = self.epoch(sim) + 1
+
+    def session(self, sim: SimKey) -> "SessionCache":
+        return SessionCache(self, sim)
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        value = self._responses.get(key)
+        return None if value is TtlLruCache.MISSING else value
+
+    def put(self, key: tuple, response: bytes) -> None:
+        self._responses.put(key, response, self._ttl)
+
+
+class SessionCache:
+    """View of a `ResponseCache` for a single session with a SIM card.
+
+    The session has to be informed of every command and response relayed between
+    the probe and the SIM card in order. It expects the probe to wait for the
+    response to a command before sending the next one and disables itself
+    otherwise.
+    """
+
+    def __init__(self, cache: ResponseCache, sim: SimKey):
+        self._cache = cache
+        self._sim = sim
+        self._enabled = True
+        self._digest = hashlib.blake2b(digest_size=16)
+        # command relayed to the SIM that has not been answered yet
+        self._outstanding: Optional[bytes] = None
+        # last command of the probe and whether it was answered from the cache
+        self._last: Optional[tuple[bytes, bool]] = None
+        # state changing commands answered from the cache that the SIM did not
+        # receive yet, together with their cached responses
+        self._pending: list[tuple[bytes, bytes]] = []
+        # cached responses to replayed commands
+        self._replayed: collections.deque[bytes] = collections.deque()
+
+    @property
+    def replaying(self) -> bool:
+        """Whether responses to replayed commands are outstanding."""
+        return len(self._replayed) > 0
+
+    def _key(self, command: bytes) -> tuple:
+        key = (self._sim, self._cache.epoch(self._sim), self._digest.digest())
+
+        # the response to GET RESPONSE depends on the previous command
+        if command[1] == _INS_GET_RESPONSE:
+            key += (self._last[0] if self._last is not None else None,)
+
+        return key + (command,)
+
+    def _advance(self, command: bytes, response: bytes) -> None:
+        for b in (command, response):
+            self._digest.update(len(b).to_bytes(2, "big"))
+            self._digest.update(b)
+
+    def _busy(self) -> bool:
+        return self._outstanding is not None
+
+    def _disable(self, reason: str) -> None:
+        if self._enabled:
+            LOGGER.debug(f"Disabling response cache for session. ({reason})")
+        self._enabled = False
+
+    def lookup(self, command: bytes) -> Optional[bytes]:
+        """Return the cached response to the probe's command or None.
+
+        If None is returned the command has to be relayed to the SIM after the
+        commands returned by `replay`.
+        """
+        if self._busy():
+            self._disable("command sent before previous command was answered")
+
+        if not self._enabled:
+            return None
+
+        kind = _classify(command)
+        if kind not in (_Kind.READ, _Kind.STATE):
+            return None
+
+        response = self._cache.get(self._key(command))
+
+        if response is None:
+            _LOOKUPS.inc(result="miss")
+            return None
+
+        _LOOKUPS.inc(result="hit")
+
+        if kind == _Kind.STATE:
+            self._pending.append((command, response))
+            self._advance(command, response)
+
+        self._last = (command, True)
+        return response
+
+    def replay(self, command: bytes) -> list[bytes]:
+        """Commands that have to be relayed to the SIM before command.
+
+        The responses to these commands must be passed to `replayed` and must not
+        be forwarded to the probe.
+        """
+        replay = self._pending
+        self._pending = []
+
+        # GET RESPONSE retrieves the response to the previous command which
+        # therefore has to reach the SIM first. State changing commands are
+        # already part of replay.
+        if (
+            _classify(command) == _Kind.READ
+            and command[1] == _INS_GET_RESPONSE
+            and self._last is not None
+            and self._last[1]
+            and _classify(self._last[0]) == _Kind.READ
+        ):
+            last = self._last[0]
+            response = None
+
+            if last[1] != _INS_GET_RESPONSE:
+                response = self._cache.get(self._key(last))
+
+            if response is None:
+                self._disable("cannot replay command preceding GET RESPONSE")
+            else:
+                replay.append((last, response))
+
+        self._replayed.extend(r for _, r in replay)
+        return [c for c, _ in replay]
+
+    def replayed(self, response: bytes) -> None:
+        """Response of the SIM to a command returned by `replay`."""
+        expected = self._replayed.popleft()
+
+        if response != expected:
+            self._cache.invalidate(self._sim, "mismatch")
+            self._disable("SIM answered replayed command differently")
+
+    def forwarded(self, command: bytes) -> None:
+        """The probe's command was relayed to the SIM."""
+        if self._busy():
+            self._disable("command sent before previous command was answered")
+
+        self._outstanding = command
+
+    def answered(self, response: bytes) -> None:
+        """Response of the SIM to the last relayed command."""
+        command = self._outstanding
+        self._outstanding = None
+
+        if command is None:
+            return
+
+        kind = _classify(command)
+
+        # commands whose effect is unknown (e.g. proprietary commands) might
+        # modify the SIM's content as well
+        if kind == _Kind.WRITE:
+            self._cache.invalidate(self._sim, "write")
+        elif kind == _Kind.OTHER:
+            self._cache.invalidate(self._sim, "other")
+
+        if not self._enabled:
+            return
+
+        match kind:
+            case _Kind.READ | _Kind.STATE:
+                if _is_final(response):
+                    self._cache.put(self._key(command), response)
+                if kind == _Kind.STATE:
+                    self._advance(command, response)
+            case _Kind.RELAY:
+                self._advance(command, response)
+            case _:
+                self._disable(f"relayed command {command[:4].hex()}")
+
+        self._last = (command, False)
+
+    def reset(self) -> None:
+        """The probe reset the SIM.
+
+        Resets are not answered by the provider and are complete once relayed.
+        """
+        if not self._busy():
+            # the SIM's state no longer depends on earlier commands
+            self._enabled = True
+        else:
+            self._disable("reset before previous command was answered")
+
+        self._digest = hashlib.blake2b(digest_size=16)
+        self._pending = []
+        self._last = None
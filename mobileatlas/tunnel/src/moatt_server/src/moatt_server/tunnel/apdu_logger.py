@@ -0,0 +1,156 @@
+import asyncio
+import collections
+import logging
+from datetime import timedelta
+from typing import Any
+from uuid import UUID
+
+from moatt_types.connect import ApduPacket
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .. import db, metrics
+from .. import models as dbm
+
+LOGGER = logging.getLogger(__name__)
+
+_WRITTEN = metrics.counter(
+    "moat_tunnel_apdu_log_written", "APDU log entries written to the database."
+)
+_DROPPED = metrics.counter(
+    "moat_tunnel_apdu_log_dropped", "APDU log entries dropped because of back pressure."
+)
+_WRITE_LATENCY = metrics.histogram(
+    "moat_tunnel_apdu_log_write_seconds",
+    "Time spent writing a batch of APDU log entries to the database.",
+)
+
+
+class ApduLogger:
+    """Write-behind logger for relayed APDUs.
+
+    Log entries are buffered in memory and written to the database in batches by a
+    background task so that relaying APDUs never has to wait for the database. The
+    buffer is bounded; entries that do not fit into it are dropped and counted.
+    """
+
+    def __init__(
+        self,
+        async_session: async_sessionmaker[AsyncSession],
+        batch_size: int,
+        flush_interval: timedelta,
+        max_pending: int,
+    ):
+        if batch_size < 1 or max_pending < batch_size:
+            raise ValueError(
+                "Expected 0 < batch_size <= max_pending. "
+                f"({batch_size=}; {max_pending=})"
+            )
+
+        self._async_session = async_session
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+
+        self._pending: collections.deque[dict[str, Any]] = collections.deque()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def log(
+        self,
+        provider_id: UUID,
+        probe_id: UUID,
+        session_id: UUID,
+        sim_id: db.SimId,
+        apdu: ApduPacket,
+        sender: dbm.Sender,
+    ) -> bool:
+        """Queue an APDU for logging without blocking.
+
+        Returns
+        -------
+        Whether the entry was queued. Entries are dropped if the buffer is full.
+        """
+        if len(self._pending) >= self._max_pending:
+            self.dropped += 1
+            _DROPPED.inc()
+            # avoid flooding the log while the database is unable to keep up
+            if self.dropped & (self.dropped - 1) == 0:
+                LOGGER.warning(
+                    "APDU log buffer is full. Dropped %d log entries so far.",
+                    self.dropped,
+                )
+            return False
+
+        self._pending.append(
+            db.apdu_log_row(provider_id, probe_id, session_id, sim_id, apdu, sender)
+        )
+
+        if len(self._pending) >= self._batch_size:
+            self._wakeup.set()
+
+        return True
+
+    async def run(self) -> None:
+        """Periodically flush buffered entries. Runs until cancelled."""
+        while True:
+            try:
+                async with asyncio.timeout(self._flush_interval.total_seconds()):
+                    await self._wakeup.wait()
+            except TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Write all buffered entries to the database.
+
+        Stops early if a batch cannot be written. Entries of the failed batch are
+        put back into the buffer as far as it has space for them.
+        """
+        async with self._flush_lock:
+            while len(self._pending) > 0:
+                batch = [
+                    self._pending.popleft()
+                    for _ in range(min(self._batch_size, len(self._pending)))
+                ]
+
+                try:
+                    with _WRITE_LATENCY.time():
+                        async with self._async_session() as session, session.begin():
+                            await db.log_apdus(session, batch)
+                except asyncio.CancelledError:
+                    self._requeue(batch)
+                    raise
+                except Exception:
+                    LOGGER.exception(
+                        "Failed to write %d APDU log entries to the database.",
+                        len(batch),
+                    )
+                    self.failed_flushes += 1
+                    self._requeue(batch)
+                    return
+
+                self.written += len(batch)
+                _WRITTEN.inc(len(batch))
+
+    def _requeue(self, batch: list[dict[str, Any]]) -> None:
+        space = max(self._max_pending - len(self._pending), 0)
+
+        if space < len(batch):
+            self.dropped += len(batch) - space
+            _DROPPED.inc(len(batch) - space)
+            LOGGER.warning(
+                "Dropped %d APDU log entries because the buffer is full.",
+                len(batch) - space,
+            )
+
+        self._pending.extendleft(reversed(batch[:space]))
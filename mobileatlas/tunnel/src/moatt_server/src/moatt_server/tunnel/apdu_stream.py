@@ -1,15 +1,20 @@
 import asyncio
 import logging
-import struct
 from typing import Optional
 from uuid import UUID
 
-from moatt_types.connect import ApduPacket
+from moatt_types.connect import ApduOp, ApduPacket, ConnectRequest, ConnectResponse
 
+from .. import metrics
 from .. import models as dbm
+from .util import read_msg, write_msg
 
 LOGGER = logging.getLogger(__name__)
 
+_HEARTBEATS = metrics.counter(
+    "moat_tunnel_heartbeats", "Heartbeats received during established sessions."
+)
+
 
 class ApduStream:
     def __init__(
@@ -27,31 +32,35 @@ class ApduStream:
         self._send_queue: Optional[asyncio.Queue[ApduPacket]] = None
         self._send_task = None
 
-    async def recv(self) -> Optional[ApduPacket]:
-        buf = await self.reader.read(n=6)
-
-        if len(buf) == 0:
-            return None
+    async def send_connect_request(self, con_req: ConnectRequest) -> None:
+        await write_msg(self.writer, con_req)
 
-        missing = ApduStream._bytes_missing(buf)
-        while missing > 0:
-            r = await self.reader.read(n=missing)
+    async def recv_connect_response(self) -> Optional[ConnectResponse]:
+        return await read_msg(self.reader, ConnectResponse.decode)
 
-            if len(r) == 0:
-                raise asyncio.IncompleteReadError(buf, missing)
+    async def recv(self) -> Optional[ApduPacket]:
+        while True:
+            try:
+                header = await self.reader.readexactly(ApduPacket.HEADER_LEN)
+            except asyncio.IncompleteReadError as e:
+                if len(e.partial) == 0:
+                    return None
+                raise
 
-            buf += r
-            missing = ApduStream._bytes_missing(buf)
+            op, plen = ApduPacket.decode_header(header)
 
-        p = ApduPacket.decode(buf)
+            # the payload is handed on as is; no intermediate buffers are needed
+            payload = await self.reader.readexactly(plen) if plen > 0 else b""
 
-        if p is None:
-            raise ValueError
+            # heartbeats only keep the connection alive and are not relayed
+            if op != ApduOp.Heartbeat:
+                return ApduPacket(op, payload)
 
-        return p
+            _HEARTBEATS.inc()
 
     async def send(self, apdu: ApduPacket):
-        self.writer.write(apdu.encode())
+        # write header and payload separately to avoid concatenating them
+        self.writer.writelines((apdu.encode_header(), apdu.payload))
         await self.writer.drain()
 
     def send_background(self, apdu: ApduPacket):
@@ -70,17 +79,6 @@ class ApduStream:
         self.writer.close()
         await self.writer.wait_closed()
 
-    @staticmethod
-    def _bytes_missing(msg: bytes) -> int:
-        if len(msg) < 6:
-            return 6 - len(msg)
-
-        (plen,) = struct.unpack("!I", msg[2:6])
-        if len(msg) < 6 + plen:
-            return (6 + plen) - len(msg)
-        else:
-            return 0
-
     async def _send_bg_task(self):
         assert self._send_queue is not None
 
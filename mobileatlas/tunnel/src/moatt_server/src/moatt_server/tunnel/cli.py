@@ -1,11 +1,21 @@
 import argparse
 import logging
 import logging.config
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import signal
 import ssl
+import stat
+import sys
+import tempfile
+from pathlib import Path
 
 import uvloop
 
 from .. import config
+from .routing import ShardedRouter
 from .server import Server
 
 LOGGER = logging.getLogger(__name__)
@@ -25,6 +35,9 @@ def main():
     )
     parser.add_argument("--config", default="config.toml")
     parser.add_argument("--allow-auth-plugins", action="store_true")
+    parser.add_argument(
+        "--workers", type=int, help="Number of worker processes. (default: 1)"
+    )
     args = parser.parse_args()
 
     config.init_config(args.config, args.allow_auth_plugins, args)
@@ -42,10 +55,105 @@ def main():
         tls_ctx.verify_mode = ssl.CERT_REQUIRED
         tls_ctx.load_verify_locations(cafile=args.mtls)
 
+    if config.get_config().TUNNEL_WORKERS > 1:
+        _run_workers(args.host, args.port, tls_ctx)
+        return
+
     server = Server(config.get_config(), args.host, args.port, tls_ctx)
 
     uvloop.run(server.start())
 
 
+def _run_worker(
+    worker: int,
+    workers: int,
+    socket_dir: Path,
+    host,
+    port,
+    tls_ctx: ssl.SSLContext,
+) -> None:
+    # shut down gracefully (flushing buffered APDU logs) when terminated
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    server = Server(
+        config.get_config(),
+        host,
+        port,
+        tls_ctx,
+        router=ShardedRouter(worker, workers, socket_dir),
+        reuse_port=True,
+    )
+
+    try:
+        uvloop.run(server.start())
+    except KeyboardInterrupt:
+        pass
+
+
+def _check_socket_dir(socket_dir: Path) -> None:
+    """Make sure that only the server can access the workers' sockets."""
+    st = socket_dir.lstat()
+
+    if not stat.S_ISDIR(st.st_mode):
+        raise config.ConfigError(f"Socket directory {socket_dir} is not a directory.")
+
+    if st.st_uid != os.geteuid():
+        raise config.ConfigError(
+            f"Socket directory {socket_dir} is owned by another user."
+        )
+
+    if st.st_mode & 0o077 != 0:
+        raise config.ConfigError(
+            f"Socket directory {socket_dir} is accessible by other users. "
+            f"(mode {stat.S_IMODE(st.st_mode):o}; expected 700)"
+        )
+
+
+def _run_workers(host, port, tls_ctx: ssl.SSLContext) -> None:
+    cfg = config.get_config()
+
+    if cfg.TUNNEL_SOCKET_DIR is not None:
+        socket_dir = Path(cfg.TUNNEL_SOCKET_DIR)
+        socket_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        _check_socket_dir(socket_dir)
+    else:
+        socket_dir = Path(tempfile.mkdtemp(prefix="moat-tunnel-"))
+
+    LOGGER.info(f"Starting {cfg.TUNNEL_WORKERS} worker processes.")
+
+    ctx = multiprocessing.get_context("fork")
+    workers = [
+        ctx.Process(
+            target=_run_worker,
+            args=(i, cfg.TUNNEL_WORKERS, socket_dir, host, port, tls_ctx),
+            name=f"tunnel-worker-{i}",
+        )
+        for i in range(cfg.TUNNEL_WORKERS)
+    ]
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    try:
+        for w in workers:
+            w.start()
+
+        # workers cannot take over each other's providers, so all of them are
+        # stopped as soon as one exits
+        multiprocessing.connection.wait([w.sentinel for w in workers])
+        LOGGER.warning("A worker process exited. Shutting down...")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for w in workers:
+            if w.is_alive():
+                w.terminate()
+        for w in workers:
+            if w.pid is not None:
+                w.join()
+
+        if cfg.TUNNEL_SOCKET_DIR is None:
+            shutil.rmtree(socket_dir, ignore_errors=True)
+
+
 if __name__ == "__main__":
     main()
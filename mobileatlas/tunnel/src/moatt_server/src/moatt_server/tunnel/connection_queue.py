@@ -1,6 +1,6 @@
 import asyncio
-import collections
 import logging
+import time
 from collections.abc import Awaitable
 from datetime import datetime, timedelta, timezone
 from typing import Callable, Optional
@@ -8,13 +8,35 @@ from uuid import UUID
 
 from moatt_types.connect import ConnectRequest, ConnectResponse, ConnectStatus
 
-from .. import config
+from .. import config, metrics
 from .. import models as dbm
+from .scheduling import QueueStats, Scheduler, create_scheduler
+from .util import watch_idle, write_msg
 
 LOGGER = logging.getLogger(__name__)
 
 _QUEUES: dict[UUID, "Queue"] = {}
 
+_QUEUE_EVENTS = metrics.counter(
+    "moat_tunnel_queue_events",
+    "Connection requests entering or leaving provider queues.",
+    ["event"],
+)
+_QUEUE_WAIT = metrics.histogram(
+    "moat_tunnel_queue_wait_seconds",
+    "Time connection requests waited in queues before being served.",
+)
+metrics.gauge(
+    "moat_tunnel_queued_requests",
+    "Connection requests currently waiting in provider queues.",
+    fn=lambda: sum(len(q._queue) for q in _QUEUES.values()),
+)
+metrics.gauge(
+    "moat_tunnel_waiting_providers",
+    "Provider connections currently waiting for a connection request.",
+    fn=lambda: sum(len(q._getters) for q in _QUEUES.values()),  # type: ignore
+)
+
 
 class QueueEntry:
     def __init__(
@@ -25,6 +47,8 @@ class QueueEntry:
         reader: asyncio.StreamReader,
         writer: asyncio.StreamWriter,
         immediate: bool = False,
+        priority: int = 0,
+        max_wait: Optional[timedelta] = None,
     ):
         self.sim = sim
         self.probe_id = probe_id
@@ -32,14 +56,54 @@ class QueueEntry:
         self.reader = reader
         self.writer = writer
         self.immediate = immediate
+        self.priority = priority
+        # monotonic timestamps
+        self.enqueued = time.monotonic()
+        self.deadline = (
+            self.enqueued + max_wait.total_seconds() if max_wait is not None else None
+        )
+
+        self._watcher: Optional[asyncio.Task] = None
+
+    def watch(self, on_disconnect: Callable[["QueueEntry"], None]) -> None:
+        """Call on_disconnect as soon as the waiting probe disconnects."""
+        self.unwatch()
+        self._watcher = asyncio.create_task(self._watch(on_disconnect))
+
+    def unwatch(self) -> None:
+        if self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch(self, on_disconnect: Callable[["QueueEntry"], None]) -> None:
+        try:
+            await watch_idle(self.reader)
+        except ValueError as e:
+            LOGGER.warning(f"Waiting probe sent unexpected data. {e}")
+
+        self._watcher = None
+        on_disconnect(self)
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        if self.deadline is None:
+            return False
+
+        return (time.monotonic() if now is None else now) > self.deadline
 
 
 class Queue(asyncio.Queue):
+    _queue: Scheduler
+
+    def __init__(self, maxsize: int = 0, scheduler: str = "fifo"):
+        self._scheduler = scheduler
+        super().__init__(maxsize)
+
     # overridable methods from asyncio.Queue
 
     # called at the end of super().__init__
     def _init(self, maxsize):
-        self._queue = collections.deque()
+        self._queue = create_scheduler(self._scheduler)
+        self.stats = QueueStats()
         self._last_active: datetime = datetime.now(tz=timezone.utc)
         self._active: int = 0
         self._gc_task = asyncio.create_task(self._gc())
@@ -47,13 +111,21 @@ class Queue(asyncio.Queue):
     def _get(self) -> QueueEntry:
         self._acquire()
         try:
-            qe = self._queue.popleft()
+            qe = self._queue.pop()
+            qe.unwatch()
+            wait = time.monotonic() - qe.enqueued
+            self.stats.record_wait(wait)
+            _QUEUE_WAIT.observe(wait)
+            _QUEUE_EVENTS.inc(event="served")
             return qe
         finally:
             self._release()
 
     def _put(self, item: QueueEntry):
-        self._queue.append(item)
+        self._queue.push(item)
+        self.stats.enqueued += 1
+        _QUEUE_EVENTS.inc(event="enqueued")
+        item.watch(self._disconnected)
 
     # end of overridable methods
 
@@ -75,23 +147,29 @@ class Queue(asyncio.Queue):
         if self._active == 0:
             self._last_active = datetime.now(tz=timezone.utc)
 
+    def _disconnected(self, qe: QueueEntry) -> None:
+        if len(self._queue.remove_if(lambda e: e is qe)) == 0:
+            return
+
+        LOGGER.info("Probe disconnected while waiting for a connection.")
+        self.stats.abandoned += 1
+        _QUEUE_EVENTS.inc(event="abandoned")
+        qe.writer.close()
+
     def _cleanup(self) -> int:
         self._gc_task.cancel()
 
         num_closed = 0
-        try:
-            while True:
-                writer = self.get_nowait().writer
-                try:
-                    writer.write(
-                        ConnectResponse(ConnectStatus.ProviderTimedOut).encode()
-                    )
-                except Exception:
-                    pass
-                writer.close()
-                num_closed += 1
-        except asyncio.QueueEmpty:
-            pass
+        for qe in self._queue.remove_if(lambda _: True):
+            qe.unwatch()
+            try:
+                qe.writer.write(
+                    ConnectResponse(ConnectStatus.ProviderTimedOut).encode()
+                )
+            except Exception:
+                pass
+            qe.writer.close()
+            num_closed += 1
         return num_closed
 
     async def _gc(self):
@@ -100,15 +178,36 @@ class Queue(asyncio.Queue):
 
             if len(self._queue) != 0:
                 LOGGER.debug("Queue GC starting.")
-                size = len(self._queue)
-                self._queue = collections.deque(
-                    filter(lambda qe: not qe.writer.is_closing(), self._queue)
-                )
-                if len(self._queue) < size:
+                closed = self._queue.remove_if(lambda qe: qe.writer.is_closing())
+                for qe in closed:
+                    qe.unwatch()
+                if len(closed) > 0:
+                    self.stats.abandoned += len(closed)
+                    _QUEUE_EVENTS.inc(len(closed), event="abandoned")
+                    LOGGER.info(f"Removed {len(closed)} closed probe connection(s).")
+
+                now = time.monotonic()
+                expired = self._queue.remove_if(lambda qe: qe.expired(now))
+                for qe in expired:
+                    qe.unwatch()
+                    try:
+                        qe.writer.write(
+                            ConnectResponse(ConnectStatus.ProviderTimedOut).encode()
+                        )
+                    except Exception:
+                        pass
+                    qe.writer.close()
+
+                if len(expired) > 0:
+                    self.stats.expired += len(expired)
+                    _QUEUE_EVENTS.inc(len(expired), event="expired")
                     LOGGER.info(
-                        f"Removed {size - len(self._queue)} closed probe connection(s)."
+                        f"Removed {len(expired)} connection request(s) that exceeded "
+                        "the maximum waiting time."
                     )
 
+                LOGGER.debug("Queue statistics: %s", self.stats)
+
 
 def queue_gc_coro_factory(timeout: timedelta) -> Callable[[], Awaitable[None]]:
     async def f():
@@ -138,22 +237,44 @@ def queue_gc_coro_factory(timeout: timedelta) -> Callable[[], Awaitable[None]]:
 def _get_queue(id: UUID) -> Queue:
     q = _QUEUES.get(id)
     if q is None:
-        q = Queue(maxsize=config.get_config().MAX_QUEUE_SIZE)
+        cfg = config.get_config()
+        q = Queue(maxsize=cfg.MAX_QUEUE_SIZE, scheduler=cfg.QUEUE_SCHEDULER)
         _QUEUES[id] = q
     return q
 
 
+def stats() -> dict[UUID, QueueStats]:
+    """Statistics of all currently existing queues."""
+    return {id: q.stats for id, q in _QUEUES.items()}
+
+
 def put_nowait(id: UUID, qe: QueueEntry) -> None:
     q = _get_queue(id)
     if qe.immediate and len(q._queue) >= len(q._getters):  # type: ignore
+        q.stats.dropped += 1
+        _QUEUE_EVENTS.inc(event="dropped")
         raise asyncio.QueueFull(qe)
     try:
         q.put_nowait(qe)
     except asyncio.QueueFull as e:
+        q.stats.dropped += 1
+        _QUEUE_EVENTS.inc(event="dropped")
         e.args = (qe,)
         raise
 
 
+async def reject_requeued(e: asyncio.QueueFull) -> None:
+    """Tell the probe whose request put_nowait failed to requeue that it timed out."""
+    LOGGER.warn(
+        "Failed to requeue connection request because either the queue"
+        "was full or because the client did not want to wait."
+    )
+    probe_writer = e.args[0].writer
+    await write_msg(probe_writer, ConnectResponse(ConnectStatus.ProviderTimedOut))
+    probe_writer.close()
+    await probe_writer.wait_closed()
+
+
 async def get(id: UUID) -> QueueEntry:
     q = _get_queue(id)
     return await q.get()
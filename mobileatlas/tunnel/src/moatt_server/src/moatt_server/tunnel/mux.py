@@ -0,0 +1,182 @@
+import asyncio
+import logging
+from typing import Optional
+from uuid import UUID
+
+from moatt_types.connect import (
+    ApduPacket,
+    ConnectRequest,
+    ConnectResponse,
+    MuxOp,
+    MuxPacket,
+)
+
+from .. import models as dbm
+from .util import read_msg
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MuxConnection:
+    """Provider connection carrying multiple SIM sessions (protocol version 2)."""
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        idle_timeout: Optional[float] = None,
+    ):
+        self.reader = reader
+        self.writer = writer
+        self.idle_timeout = idle_timeout
+
+        self._streams: dict[int, "MuxStream"] = {}
+        self._next_id = 1
+        self._closed = False
+
+    @property
+    def closed(self) -> bool:
+        return self._closed or self.writer.is_closing()
+
+    def open_stream(self, sim: dbm.Sim, client_id: UUID) -> "MuxStream":
+        if self.closed:
+            raise ConnectionResetError("Multiplexed connection is closed.")
+
+        while self._next_id in self._streams:
+            self._next_id = self._next_id % MuxPacket.MAX_STREAM_ID + 1
+
+        stream = MuxStream(self, self._next_id, sim, client_id)
+        self._streams[stream.stream_id] = stream
+        self._next_id = self._next_id % MuxPacket.MAX_STREAM_ID + 1
+
+        return stream
+
+    async def run(self) -> None:
+        """Dispatch received packets to their streams until the connection is closed."""
+        try:
+            while True:
+                try:
+                    async with asyncio.timeout(self.idle_timeout):
+                        packet = await read_msg(self.reader, MuxPacket.decode)
+                except TimeoutError:
+                    LOGGER.info("Provider was idle for too long. Closing connection.")
+                    return
+                except asyncio.IncompleteReadError as e:
+                    if len(e.partial) == 0:
+                        LOGGER.info("Provider closed multiplexed connection.")
+                    else:
+                        LOGGER.warn("Provider closed connection unexpectedly.")
+                    return
+                except ConnectionResetError:
+                    LOGGER.warn("Provider closed connection unexpectedly.")
+                    return
+                except ValueError:
+                    LOGGER.warn("Received a malformed packet. Closing connection.")
+                    return
+
+                if packet.op == MuxOp.Heartbeat:
+                    continue
+
+                stream = self._streams.get(packet.stream_id)
+                if stream is None:
+                    LOGGER.debug(
+                        "Ignoring packet for unknown stream %d.", packet.stream_id
+                    )
+                    continue
+
+                if packet.op == MuxOp.Close:
+                    del self._streams[packet.stream_id]
+
+                stream._feed(packet)
+        finally:
+            self._closed = True
+            for stream in self._streams.values():
+                stream._feed(None)
+            self._streams.clear()
+
+    def write(self, packet: MuxPacket) -> None:
+        if self.closed:
+            raise ConnectionResetError("Multiplexed connection is closed.")
+
+        self.writer.writelines((packet.encode_header(), packet.payload))
+
+    async def send(self, packet: MuxPacket) -> None:
+        self.write(packet)
+        await self.writer.drain()
+
+    def _close_stream(self, stream: "MuxStream") -> None:
+        if self._streams.get(stream.stream_id) is not stream:
+            return
+
+        del self._streams[stream.stream_id]
+
+        if not self.closed:
+            self.write(MuxPacket(stream.stream_id, MuxOp.Close))
+
+
+class MuxStream:
+    """A single SIM session of a MuxConnection.
+
+    Provides the same interface as ApduStream.
+    """
+
+    def __init__(
+        self, connection: MuxConnection, stream_id: int, sim: dbm.Sim, client_id: UUID
+    ):
+        self.sim = sim
+        self.client_id = client_id
+        self.stream_id = stream_id
+
+        self._connection = connection
+        self._packets: asyncio.Queue[Optional[MuxPacket]] = asyncio.Queue()
+        self._closed = False
+
+    def _feed(self, packet: Optional[MuxPacket]) -> None:
+        self._packets.put_nowait(packet)
+
+    async def _next(self) -> Optional[MuxPacket]:
+        if self._closed:
+            return None
+
+        packet = await self._packets.get()
+
+        if packet is None or packet.op == MuxOp.Close:
+            self._closed = True
+            return None
+
+        return packet
+
+    async def send_connect_request(self, con_req: ConnectRequest) -> None:
+        await self._connection.send(
+            MuxPacket(self.stream_id, MuxOp.ConnectRequest, con_req.encode())
+        )
+
+    async def recv_connect_response(self) -> Optional[ConnectResponse]:
+        packet = await self._next()
+
+        if packet is None:
+            raise EOFError
+
+        if packet.op != MuxOp.ConnectResponse:
+            raise ValueError(f"Expected a ConnectResponse but received {packet.op}.")
+
+        return ConnectResponse.decode(packet.payload)
+
+    async def recv(self) -> Optional[ApduPacket]:
+        packet = await self._next()
+
+        if packet is None:
+            return None
+
+        return packet.to_apdu()
+
+    async def send(self, apdu: ApduPacket) -> None:
+        await self._connection.send(MuxPacket.from_apdu(self.stream_id, apdu))
+
+    def send_background(self, apdu: ApduPacket) -> None:
+        # writes to the shared connection never block and preserve packet order
+        self._connection.write(MuxPacket.from_apdu(self.stream_id, apdu))
+
+    async def close(self) -> None:
+        self._closed = True
+        self._connection._close_stream(self)
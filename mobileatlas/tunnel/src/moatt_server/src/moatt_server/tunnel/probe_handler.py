@@ -2,6 +2,8 @@ import asyncio
 import logging
 
 from moatt_types.connect import (
+    AuthRequest,
+    AuthType,
     ConnectionRequestFlags,
     ConnectRequest,
     ConnectResponse,
@@ -10,18 +12,35 @@ from moatt_types.connect import (
 )
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from .. import auth
+from .. import auth, metrics
 from ..config import Config
 from . import connection_queue
+from .routing import Router
 from .util import read_msg, write_msg
 
 LOGGER = logging.getLogger(__name__)
 
+_CONNECT_REQUESTS = metrics.counter(
+    "moat_tunnel_connect_requests",
+    "Connection requests of probes by their outcome.",
+    ["result"],
+)
+_SIM_LOOKUP_LATENCY = metrics.histogram(
+    "moat_tunnel_sim_lookup_seconds",
+    "Time spent looking up and authorising requested SIM cards.",
+)
+
 
 class ProbeHandler:
-    def __init__(self, config: Config, async_session: async_sessionmaker[AsyncSession]):
+    def __init__(
+        self,
+        config: Config,
+        async_session: async_sessionmaker[AsyncSession],
+        router: Router,
+    ):
         self.config = config
         self.async_session = async_session
+        self.router = router
 
     async def valid_token(self, token: Token) -> None:
         await auth.register_probe(token)
@@ -68,6 +87,7 @@ class ProbeHandler:
         LOGGER.debug(f"got probe connect request {con_req}")
 
         if con_req is None:
+            _CONNECT_REQUESTS.inc(result="malformed")
             LOGGER.warn(
                 "Received malformed connection request message. Closing connection."
             )
@@ -75,9 +95,11 @@ class ProbeHandler:
             return
 
         try:
-            async with self.async_session() as session, session.begin():
-                sim = await auth.get_sim(session, session_token, con_req.identifier)
+            with _SIM_LOOKUP_LATENCY.time():
+                async with self.async_session() as session, session.begin():
+                    sim = await auth.get_sim(session, session_token, con_req.identifier)
         except auth.AuthError:
+            _CONNECT_REQUESTS.inc(result="forbidden")
             LOGGER.debug(
                 "Received disallowed SIM request from probe. Closing connection."
             )
@@ -86,17 +108,31 @@ class ProbeHandler:
             return
 
         if sim is None:
+            _CONNECT_REQUESTS.inc(result="not_found")
             LOGGER.debug("Probe requested unknown SIM. Closing connection.")
             await write_msg(writer, ConnectResponse(ConnectStatus.NotFound))
             await close()
             return
 
         if sim.provider is None:
+            _CONNECT_REQUESTS.inc(result="not_available")
             LOGGER.debug("Requested SIM is unknown. Closing connection.")
             await write_msg(writer, ConnectResponse(ConnectStatus.NotAvailable))
             await close()
             return
 
+        if not self.router.is_local(sim.provider.id):
+            # the provider's connection queue is managed by another worker
+            _CONNECT_REQUESTS.inc(result="forwarded")
+            await self.router.forward(
+                sim.provider.id,
+                AuthRequest(AuthType.Probe, session_token),
+                reader,
+                writer,
+                con_req.encode(),
+            )
+            return
+
         LOGGER.debug("Sending stream to provider handler")
 
         probe_id = await auth.identity(session_token)
@@ -104,6 +140,13 @@ class ProbeHandler:
             "Expected identity of probe to be known after" "successful registration."
         )
 
+        # the urgent flag is set by the probe and only honoured for probes the
+        # server operator allowed to jump the queue
+        urgent = ConnectionRequestFlags.URGENT in con_req.flags
+        if urgent and str(probe_id) not in self.config.URGENT_PROBES:
+            LOGGER.debug(f"Ignoring urgent flag of unprivileged probe. {probe_id=}")
+            urgent = False
+
         try:
             connection_queue.put_nowait(
                 sim.provider.id,
@@ -114,9 +157,12 @@ class ProbeHandler:
                     reader,
                     writer,
                     immediate=ConnectionRequestFlags.NO_WAIT in con_req.flags,
+                    priority=1 if urgent else 0,
+                    max_wait=self.config.MAX_PROBE_WAITTIME,
                 ),
             )
         except asyncio.QueueFull:
+            _CONNECT_REQUESTS.inc(result="not_available")
             if ConnectionRequestFlags.NO_WAIT in con_req.flags:
                 LOGGER.info(
                     f"Requested SIM card is not immediately available. {sim.iccid=}"
@@ -125,3 +171,6 @@ class ProbeHandler:
                 LOGGER.warn(f"Queue for provider is full. {sim.provider.id=}")
             await write_msg(writer, ConnectResponse(ConnectStatus.NotAvailable))
             await close()
+            return
+
+        _CONNECT_REQUESTS.inc(result="queued")
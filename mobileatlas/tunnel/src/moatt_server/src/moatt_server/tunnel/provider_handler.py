@@ -1,29 +1,92 @@
 import asyncio
+import functools
 import logging
-
-from moatt_types.connect import ConnectResponse, ConnectStatus, Token
+import time
+from collections.abc import Callable
+from uuid import UUID, uuid4
+
+from moatt_types.connect import (
+    ApduOp,
+    ApduPacket,
+    ConnectResponse,
+    ConnectStatus,
+    Token,
+)
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-from .. import auth, db
+from .. import auth, db, metrics
 from .. import models as dbm
 from ..config import Config
 from . import connection_queue
+from .apdu_cache import ResponseCache, SessionCache
+from .apdu_logger import ApduLogger
 from .apdu_stream import ApduStream
-from .util import poll_eof, read_msg, write_msg
+from .mux import MuxConnection, MuxStream
+from .util import watch_idle, write_msg
 
 LOGGER = logging.getLogger(__name__)
 
+_SESSIONS = metrics.counter(
+    "moat_tunnel_sessions",
+    "Connection requests handed to providers by their outcome.",
+    ["result"],
+)
+_ACTIVE_SESSIONS = metrics.gauge(
+    "moat_tunnel_active_sessions", "Currently established SIM sessions."
+)
+_SESSION_DURATION = metrics.histogram(
+    "moat_tunnel_session_seconds", "Duration of established SIM sessions."
+)
+_RELAYED_APDUS = metrics.counter(
+    "moat_tunnel_relayed_apdus", "Relayed APDU packets.", ["sender"]
+)
+_RELAYED_BYTES = metrics.counter(
+    "moat_tunnel_relayed_bytes", "Relayed APDU payload bytes.", ["sender"]
+)
+_APDU_RTT = metrics.histogram(
+    "moat_tunnel_apdu_rtt_seconds",
+    "Time between relaying a probe's APDU and receiving the provider's response.",
+)
+
 
 class ProviderHandler:
-    def __init__(self, config: Config, async_session: async_sessionmaker[AsyncSession]):
+    def __init__(
+        self,
+        config: Config,
+        async_session: async_sessionmaker[AsyncSession],
+        apdu_logger: ApduLogger,
+    ):
         self.config = config
         self.async_session = async_session
+        self.apdu_logger = apdu_logger
+        self.apdu_cache = (
+            ResponseCache(config.APDU_CACHE_SIZE, config.APDU_CACHE_TTL.total_seconds())
+            if config.APDU_CACHE_SIZE > 0
+            else None
+        )
 
     async def handle_established_connection(
-        self, probe: ApduStream, provider: ApduStream
+        self, probe: ApduStream, provider: ApduStream | MuxStream
     ):
+        sim_id = db.SimId(
+            id=provider.sim.id, iccid=provider.sim.iccid, imsi=provider.sim.imsi
+        )
+        log = functools.partial(
+            self.apdu_logger.log,
+            provider.client_id,
+            probe.client_id,
+            uuid4(),
+            sim_id,
+        )
+        cache = None
+        if self.apdu_cache is not None:
+            cache = self.apdu_cache.session(
+                (provider.client_id, sim_id.id, sim_id.iccid, sim_id.imsi)
+            )
         probe_task = asyncio.create_task(probe.recv(), name="probe")
         provider_task = asyncio.create_task(provider.recv(), name="provider")
+        # time the last unanswered APDU of the probe was relayed
+        sent_at = None
 
         try:
             while True:
@@ -51,38 +114,90 @@ class ProviderHandler:
                         LOGGER.info(f"{t.get_name()} closed the connection.")
                         return
 
-                    async with self.async_session() as session, session.begin():
-                        await db.log_apdu(
-                            session,
-                            provider.client_id,
-                            probe.client_id,
-                            db.SimId(
-                                id=provider.sim.id,
-                                iccid=provider.sim.iccid,
-                                imsi=provider.sim.imsi,
-                            ),
-                            r,
-                            (
-                                dbm.Sender.Probe
-                                if t.get_name() == "probe"
-                                else dbm.Sender.Provider
-                            ),
-                        )
+                    sender = t.get_name()
 
-                    if t.get_name() == "probe":
-                        provider.send_background(r)
+                    if sender == "probe":
                         probe_task = asyncio.create_task(probe.recv(), name="probe")
-                    elif t.get_name() == "provider":
-                        probe.send_background(r)
+                        log(r, dbm.Sender.Probe)
+
+                        if cache is not None and self._answer_from_cache(
+                            cache, probe, provider, log, r
+                        ):
+                            continue
+
+                        _RELAYED_APDUS.inc(sender=sender)
+                        _RELAYED_BYTES.inc(len(r.payload), sender=sender)
+                        provider.send_background(r)
+                        if sent_at is None:
+                            sent_at = time.perf_counter()
+                    elif sender == "provider":
                         provider_task = asyncio.create_task(
                             provider.recv(), name="provider"
                         )
+
+                        if cache is not None and cache.replaying:
+                            # responses to replayed commands are only logged
+                            cache.replayed(r.payload)
+                            log(r, dbm.Sender.Provider)
+                            continue
+
+                        if cache is not None:
+                            cache.answered(r.payload)
+
+                        _RELAYED_APDUS.inc(sender=sender)
+                        _RELAYED_BYTES.inc(len(r.payload), sender=sender)
+                        log(r, dbm.Sender.Provider)
+
+                        if sent_at is not None:
+                            _APDU_RTT.observe(time.perf_counter() - sent_at)
+                            sent_at = None
+                        probe.send_background(r)
         finally:
             probe_task.cancel()
             provider_task.cancel()
             await probe.close()
             await provider.close()
 
+    def _answer_from_cache(
+        self,
+        cache: SessionCache,
+        probe: ApduStream,
+        provider: ApduStream | MuxStream,
+        log: Callable[[ApduPacket, dbm.Sender], bool],
+        packet: ApduPacket,
+    ) -> bool:
+        """Answer the probe's packet from the cache if possible.
+
+        Otherwise, send the commands that have to be replayed before the packet to
+        the provider and return False; the packet itself has to be relayed by the
+        caller.
+        """
+        if packet.op == ApduOp.Reset:
+            cache.reset()
+            return False
+
+        response = cache.lookup(packet.payload)
+
+        if response is not None:
+            response_packet = ApduPacket(ApduOp.Apdu, response)
+            log(response_packet, dbm.Sender.Provider)
+            probe.send_background(response_packet)
+            return True
+
+        for command in cache.replay(packet.payload):
+            replayed = ApduPacket(ApduOp.Apdu, command)
+            log(replayed, dbm.Sender.Probe)
+            provider.send_background(replayed)
+
+        cache.forwarded(packet.payload)
+        return False
+
+    def _idle_timeout(self) -> float | None:
+        if self.config.PROVIDER_IDLE_TIMEOUT is None:
+            return None
+
+        return self.config.PROVIDER_IDLE_TIMEOUT.total_seconds()
+
     async def handle(
         self,
         reader: asyncio.StreamReader,
@@ -94,16 +209,7 @@ class ProviderHandler:
         except (EOFError, ConnectionResetError):
             LOGGER.warn("Client closed connection unexpectedly.")
         except asyncio.QueueFull as e:
-            LOGGER.warn(
-                "Failed to requeue connection request because either the queue"
-                "was full or because the client did not want to wait."
-            )
-            probe_writer = e.args[0].writer
-            await write_msg(
-                probe_writer, ConnectResponse(ConnectStatus.ProviderTimedOut)
-            )
-            probe_writer.close()
-            await probe_writer.wait_closed()
+            await connection_queue.reject_requeued(e)
         except Exception as e:
             LOGGER.exception(f"Exception occurred while handling connection: {e}")
         finally:
@@ -131,10 +237,13 @@ class ProviderHandler:
                     connection_queue.get(provider_id), name="q"
                 )
 
-                # poll whether the provider is still connected
-                # in order to prevent a buildup of tasks that
-                # cannot make progress but wait on a connection request to arrive regardless
-                eof_task = asyncio.create_task(poll_eof(writer), name="eof")
+                # notice immediately when the provider disconnects in order to
+                # prevent a buildup of tasks that cannot make progress but wait on
+                # a connection request to arrive regardless
+                #
+                # idle providers are not timed out: a heartbeat crossing the
+                # connect request could not be told apart from the response
+                eof_task = asyncio.create_task(watch_idle(reader), name="eof")
 
                 done, _ = await asyncio.wait(
                     [q_task, eof_task], return_when=asyncio.FIRST_COMPLETED
@@ -142,6 +251,9 @@ class ProviderHandler:
 
                 if q_task in done and eof_task not in done:
                     eof_task.cancel()
+                    # the connect request must not be sent before the watcher
+                    # stopped reading from the provider
+                    await asyncio.wait([eof_task])
                     qe = q_task.result()
                     asyncio.current_task().add_done_callback(  # pyright: ignore[reportOptionalMemberAccess]
                         lambda _: connection_queue.task_done(provider_id)
@@ -151,8 +263,12 @@ class ProviderHandler:
                         connection_queue.put_nowait(provider_id, q_task.result())
                     else:
                         q_task.cancel()
-                    eof_task.result()
-                    LOGGER.info("Provider disconnected.")
+
+                    try:
+                        eof_task.result()
+                        LOGGER.info("Provider disconnected.")
+                    except ValueError as e:
+                        LOGGER.warn(f"Idle provider sent unexpected data. {e}")
 
                     if q_task in done:
                         connection_queue.task_done(provider_id)
@@ -170,12 +286,123 @@ class ProviderHandler:
             async with self.async_session() as session, session.begin():
                 await db.mark_provider_unavailable(session, provider_id)
 
+        await self._serve_request(
+            provider_id, qe, ApduStream(qe.sim, provider_id, reader, writer)
+        )
+
+    async def handle_multiplexed(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        token: Token,
+    ) -> None:
+        try:
+            await self._handle_multiplexed(reader, writer, token)
+        except (EOFError, ConnectionResetError):
+            LOGGER.warn("Client closed connection unexpectedly.")
+        except asyncio.QueueFull as e:
+            await connection_queue.reject_requeued(e)
+        except Exception as e:
+            LOGGER.exception(f"Exception occurred while handling connection: {e}")
+        finally:
+            if not writer.is_closing():
+                writer.close()
+
+    async def _handle_multiplexed(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        session_token: Token,
+    ) -> None:
+        provider_id = await auth.identity(session_token)
+        assert (
+            provider_id is not None
+        ), "Expected identity of provider to be known after successful registration."
+
+        mux = MuxConnection(reader, writer, self._idle_timeout())
+        unserved = None
+
+        async with self.async_session() as session, session.begin():
+            await db.mark_provider_available(session, provider_id)
+
+        try:
+            async with asyncio.TaskGroup() as tg:
+                mux_task = tg.create_task(mux.run(), name="mux")
+
+                while True:
+                    LOGGER.debug("waiting for connection request.")
+                    q_task = asyncio.create_task(
+                        connection_queue.get(provider_id), name="q"
+                    )
+
+                    done, _ = await asyncio.wait(
+                        [q_task, mux_task], return_when=asyncio.FIRST_COMPLETED
+                    )
+
+                    if mux_task in done or mux.closed:
+                        if q_task in done:
+                            unserved = q_task.result()
+                        else:
+                            q_task.cancel()
+                        LOGGER.info("Provider disconnected.")
+                        break
+
+                    qe = q_task.result()
+
+                    if qe.writer.is_closing():
+                        LOGGER.warn(
+                            "Probe disconnected early. Waiting for new request."
+                        )
+                        connection_queue.task_done(provider_id)
+                        qe.writer.close()
+                        await qe.writer.wait_closed()
+                        continue
+
+                    tg.create_task(
+                        self._serve_multiplexed_request(
+                            provider_id, qe, mux.open_stream(qe.sim, provider_id)
+                        )
+                    )
+        finally:
+            async with self.async_session() as session, session.begin():
+                await db.mark_provider_unavailable(session, provider_id)
+
+        if unserved is not None:
+            connection_queue.task_done(provider_id)
+            connection_queue.put_nowait(provider_id, unserved)
+
+    async def _serve_multiplexed_request(
+        self,
+        provider_id: UUID,
+        qe: connection_queue.QueueEntry,
+        provider_stream: MuxStream,
+    ) -> None:
+        # errors are confined to this session and must not affect the other
+        # sessions sharing the provider connection
+        try:
+            await self._serve_request(provider_id, qe, provider_stream)
+        except (EOFError, ConnectionResetError):
+            LOGGER.warn("Client closed connection unexpectedly.")
+        except asyncio.QueueFull as e:
+            await connection_queue.reject_requeued(e)
+        except Exception as e:
+            LOGGER.exception(f"Exception occurred while handling session: {e}")
+        finally:
+            await provider_stream.close()
+            connection_queue.task_done(provider_id)
+
+    async def _serve_request(
+        self,
+        provider_id: UUID,
+        qe: connection_queue.QueueEntry,
+        provider_stream: ApduStream | MuxStream,
+    ) -> None:
         LOGGER.debug(f"Received a connection request: {qe.con_req}")
 
         # TODO recheck request validity?
 
         try:
-            await write_msg(writer, qe.con_req)
+            await provider_stream.send_connect_request(qe.con_req)
         except Exception as e:
             LOGGER.warn(f"Provider disconnected. {e}")
             connection_queue.put_nowait(provider_id, qe)
@@ -188,8 +415,9 @@ class ProviderHandler:
                 if self.config.PROVIDER_RESPONSE_TIMEOUT
                 else None
             ):
-                con_res = await read_msg(reader, ConnectResponse.decode)
+                con_res = await provider_stream.recv_connect_response()
         except TimeoutError:
+            _SESSIONS.inc(result="timed_out")
             LOGGER.info("Provider timed out.")
             await write_msg(qe.writer, ConnectResponse(ConnectStatus.ProviderTimedOut))
             qe.writer.close()
@@ -198,11 +426,11 @@ class ProviderHandler:
         LOGGER.debug(f"Received a response for a connection request: {con_res}")
 
         if con_res is None:
+            _SESSIONS.inc(result="malformed")
             LOGGER.warn(
                 "Received malformed connection request status. Closing connections."
             )
-            writer.close()
-            await writer.wait_closed()
+            await provider_stream.close()
             qe.writer.close()
             await qe.writer.wait_closed()
             return
@@ -211,29 +439,33 @@ class ProviderHandler:
         await write_msg(qe.writer, con_res)
 
         if con_res.status != ConnectStatus.Success:
+            _SESSIONS.inc(result="rejected")
             LOGGER.debug(
                 "Received unsuccessful connection status response. Closing connections."
             )
-            writer.close()
-            await writer.wait_closed()
+            await provider_stream.close()
             qe.writer.close()
             await qe.writer.wait_closed()
             return
 
+        _SESSIONS.inc(result="established")
+        _ACTIVE_SESSIONS.inc()
+        start = time.perf_counter()
+
         sim_id = qe.sim.id
         probe_stream = None
-        provider_stream = None
         try:
             probe_stream = ApduStream(qe.sim, qe.probe_id, qe.reader, qe.writer)
-            provider_stream = ApduStream(qe.sim, qe.probe_id, reader, writer)
 
             async with self.async_session() as session, session.begin():
                 await db.sim_used(session, provider_id, sim_id)
 
             await self.handle_established_connection(probe_stream, provider_stream)
         finally:
-            if provider_stream is not None:
-                await provider_stream.close()
+            _ACTIVE_SESSIONS.dec()
+            _SESSION_DURATION.observe(time.perf_counter() - start)
+
+            await provider_stream.close()
             if probe_stream is not None:
                 await probe_stream.close()
 
@@ -0,0 +1,171 @@
+import asyncio
+import logging
+import os
+import socket
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from uuid import UUID
+
+from moatt_types.connect import AuthRequest
+
+from .util import read_msg, splice
+
+LOGGER = logging.getLogger(__name__)
+
+_CONNECT_ATTEMPTS = 10
+_CONNECT_RETRY_DELAY = 0.5  # seconds
+
+ForwardedHandler = Callable[
+    [asyncio.StreamReader, asyncio.StreamWriter, AuthRequest], Awaitable[None]
+]
+
+
+class Router(ABC):
+    """Decides which worker process serves the connections of a provider.
+
+    All connections of a provider and of the probes requesting its SIM cards have to
+    be served by the same process because they share the provider's connection
+    queue. Connections accepted by any other process are forwarded to it.
+    """
+
+    @abstractmethod
+    def is_local(self, provider_id: UUID) -> bool:
+        """Whether the connections of provider are served by this process."""
+
+    @property
+    def primary(self) -> bool:
+        """Whether this process runs tasks that must only run once per server."""
+        return True
+
+    @abstractmethod
+    async def forward(
+        self,
+        provider_id: UUID,
+        auth_req: AuthRequest,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        consumed: bytes = b"",
+    ) -> None:
+        """Hand an authenticated connection over to the process serving provider.
+
+        Parameters
+        ----------
+        auth_req
+            Authorisation message of the connection. Its version is the negotiated
+            protocol version.
+        consumed
+            Messages that were already read from the connection after the
+            authorisation message and have to be replayed.
+        """
+
+    @abstractmethod
+    async def serve(self, handler: ForwardedHandler) -> None:
+        """Accept connections forwarded by other processes until cancelled."""
+
+
+class LocalRouter(Router):
+    """Router of a server consisting of a single process."""
+
+    def is_local(self, provider_id: UUID) -> bool:
+        return True
+
+    async def forward(
+        self,
+        provider_id: UUID,
+        auth_req: AuthRequest,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        consumed: bytes = b"",
+    ) -> None:
+        raise AssertionError("Connections never have to be forwarded.")
+
+    async def serve(self, handler: ForwardedHandler) -> None:
+        pass
+
+
+class ShardedRouter(Router):
+    """Distributes providers over multiple worker processes.
+
+    Every provider is assigned to a worker based on its ID, so no state has to be
+    shared between the workers. Workers accept forwarded connections on a Unix
+    socket inside socket_dir, which must only be accessible by the server.
+    """
+
+    def __init__(self, worker: int, workers: int, socket_dir: Path):
+        if not 0 <= worker < workers:
+            raise ValueError(f"Expected 0 <= worker < workers. ({worker=}; {workers=})")
+
+        self.worker = worker
+        self.workers = workers
+        self.socket_dir = socket_dir
+
+    def _socket_path(self, worker: int) -> Path:
+        return self.socket_dir / f"worker-{worker}.sock"
+
+    @property
+    def primary(self) -> bool:
+        return self.worker == 0
+
+    def home(self, provider_id: UUID) -> int:
+        return provider_id.int % self.workers
+
+    def is_local(self, provider_id: UUID) -> bool:
+        return self.home(provider_id) == self.worker
+
+    async def forward(
+        self,
+        provider_id: UUID,
+        auth_req: AuthRequest,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        consumed: bytes = b"",
+    ) -> None:
+        home = self.home(provider_id)
+        LOGGER.debug(f"Forwarding connection of {auth_req.auth_type} to worker {home}.")
+
+        for attempt in range(_CONNECT_ATTEMPTS):
+            try:
+                home_reader, home_writer = await asyncio.open_unix_connection(
+                    self._socket_path(home)
+                )
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                # the worker might still be starting up
+                if attempt == _CONNECT_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(_CONNECT_RETRY_DELAY)
+
+        home_writer.writelines((auth_req.encode(), consumed))
+
+        await splice(reader, writer, home_reader, home_writer)
+
+    async def serve(self, handler: ForwardedHandler) -> None:
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                auth_req = await read_msg(reader, AuthRequest.decode)
+            except (asyncio.IncompleteReadError, ValueError):
+                LOGGER.warning("Received malformed forwarded connection.")
+                writer.close()
+                return
+
+            await handler(reader, writer, auth_req)
+
+        path = self._socket_path(self.worker)
+        path.unlink(missing_ok=True)
+
+        # the socket must not be accessible by others even briefly
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(str(path))
+        except BaseException:
+            sock.close()
+            raise
+        finally:
+            os.umask(umask)
+
+        server = await asyncio.start_unix_server(handle, sock=sock)
+
+        async with server:
+            await server.serve_forever()
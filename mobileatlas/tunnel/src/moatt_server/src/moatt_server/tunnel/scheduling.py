@@ -0,0 +1,208 @@
+import collections
+import heapq
+import itertools
+import math
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Iterator
+from typing import TYPE_CHECKING, Optional
+from uuid import UUID
+
+if TYPE_CHECKING:
+    from .connection_queue import QueueEntry
+
+
+class Scheduler(ABC):
+    """Decides in which order waiting connection requests are served."""
+
+    @abstractmethod
+    def push(self, qe: "QueueEntry") -> None: ...
+
+    @abstractmethod
+    def pop(self) -> "QueueEntry":
+        """Remove and return the next entry. Raises IndexError if empty."""
+
+    @abstractmethod
+    def remove_if(self, pred: Callable[["QueueEntry"], bool]) -> list["QueueEntry"]:
+        """Remove and return all entries matching pred."""
+
+    @abstractmethod
+    def __iter__(self) -> Iterator["QueueEntry"]: ...
+
+    @abstractmethod
+    def __len__(self) -> int: ...
+
+
+class FifoScheduler(Scheduler):
+    """Serves requests in the order of their arrival."""
+
+    def __init__(self):
+        self._queue: collections.deque["QueueEntry"] = collections.deque()
+
+    def push(self, qe: "QueueEntry") -> None:
+        self._queue.append(qe)
+
+    def pop(self) -> "QueueEntry":
+        return self._queue.popleft()
+
+    def remove_if(self, pred: Callable[["QueueEntry"], bool]) -> list["QueueEntry"]:
+        removed = [qe for qe in self._queue if pred(qe)]
+
+        if len(removed) > 0:
+            self._queue = collections.deque(qe for qe in self._queue if not pred(qe))
+
+        return removed
+
+    def __iter__(self) -> Iterator["QueueEntry"]:
+        return iter(self._queue)
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+
+class _HeapScheduler(Scheduler):
+    def __init__(self):
+        self._heap: list[tuple] = []
+        # breaks ties in FIFO order and prevents comparisons between entries
+        self._seq = itertools.count()
+
+    @abstractmethod
+    def _key(self, qe: "QueueEntry") -> tuple: ...
+
+    def push(self, qe: "QueueEntry") -> None:
+        heapq.heappush(self._heap, (*self._key(qe), next(self._seq), qe))
+
+    def pop(self) -> "QueueEntry":
+        return heapq.heappop(self._heap)[-1]
+
+    def remove_if(self, pred: Callable[["QueueEntry"], bool]) -> list["QueueEntry"]:
+        removed = [e[-1] for e in self._heap if pred(e[-1])]
+
+        if len(removed) > 0:
+            self._heap = [e for e in self._heap if not pred(e[-1])]
+            heapq.heapify(self._heap)
+
+        return removed
+
+    def __iter__(self) -> Iterator["QueueEntry"]:
+        return (e[-1] for e in sorted(self._heap, key=lambda e: e[:-1]))
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class PriorityScheduler(_HeapScheduler):
+    """Serves requests with a higher priority first and in FIFO order otherwise."""
+
+    def _key(self, qe: "QueueEntry") -> tuple:
+        return (-qe.priority,)
+
+
+class DeadlineScheduler(_HeapScheduler):
+    """Serves the request with the earliest deadline first (EDF).
+
+    A request has to be served within its maximum wait time, which is halved for
+    every priority level. Urgent requests therefore overtake requests that still
+    have more time left. Requests without a maximum wait time are served last.
+    Ties are broken by priority.
+    """
+
+    def _key(self, qe: "QueueEntry") -> tuple:
+        if qe.deadline is None:
+            return (math.inf, -qe.priority)
+
+        budget = (qe.deadline - qe.enqueued) / 2 ** max(qe.priority, 0)
+        return (qe.enqueued + budget, -qe.priority)
+
+
+class FairScheduler(_HeapScheduler):
+    """Weighted fair queueing across probes.
+
+    Every probe gets an equal share of the SIM unless its requests have a higher
+    priority, which doubles the request's weight for every priority level. A single
+    probe can therefore not starve other probes by queueing many requests.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._vtime = 0.0
+        self._finish: dict[UUID, float] = {}
+
+    def _key(self, qe: "QueueEntry") -> tuple:
+        start = max(self._vtime, self._finish.get(qe.probe_id, 0.0))
+        tag = start + 1 / 2 ** max(qe.priority, 0)
+        self._finish[qe.probe_id] = tag
+        return (tag,)
+
+    def pop(self) -> "QueueEntry":
+        tag, _, qe = heapq.heappop(self._heap)
+        self._vtime = tag
+
+        if self._finish.get(qe.probe_id) == tag:
+            # last queued request of this probe
+            del self._finish[qe.probe_id]
+
+        return qe
+
+    def remove_if(self, pred: Callable[["QueueEntry"], bool]) -> list["QueueEntry"]:
+        removed = super().remove_if(pred)
+
+        if len(removed) > 0:
+            waiting = {e[-1].probe_id for e in self._heap}
+            self._finish = {k: v for k, v in self._finish.items() if k in waiting}
+
+        return removed
+
+
+SCHEDULERS: dict[str, Callable[[], Scheduler]] = {
+    "fifo": FifoScheduler,
+    "priority": PriorityScheduler,
+    "fair": FairScheduler,
+    "deadline": DeadlineScheduler,
+}
+
+
+def create_scheduler(name: str) -> Scheduler:
+    try:
+        return SCHEDULERS[name]()
+    except KeyError:
+        raise ValueError(f'Unknown scheduler: "{name}".') from None
+
+
+class QueueStats:
+    """Statistics of a single connection queue."""
+
+    def __init__(self, max_samples: int = 1024):
+        self.enqueued = 0
+        self.served = 0
+        self.dropped = 0
+        self.expired = 0
+        self.abandoned = 0
+        self._wait_times: collections.deque[float] = collections.deque(
+            maxlen=max_samples
+        )
+
+    def record_wait(self, seconds: float) -> None:
+        self.served += 1
+        self._wait_times.append(seconds)
+
+    def wait_percentiles(
+        self, percentiles: tuple[int, ...] = (50, 90, 99)
+    ) -> Optional[dict[int, float]]:
+        """Wait time percentiles (in seconds) of the most recently served requests."""
+        if len(self._wait_times) == 0:
+            return None
+
+        samples = sorted(self._wait_times)
+        return {
+            p: samples[
+                min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))
+            ]
+            for p in percentiles
+        }
+
+    def __repr__(self):
+        return (
+            f"QueueStats(enqueued={self.enqueued}, served={self.served}, "
+            f"dropped={self.dropped}, expired={self.expired}, "
+            f"abandoned={self.abandoned}, wait={self.wait_percentiles()})"
+        )
@@ -1,32 +1,47 @@
 import asyncio
 import logging
+import os
 import socket
 import ssl
 from collections.abc import Sequence
 from datetime import timedelta
+from pathlib import Path
 
 from moatt_types.connect import (
+    PROTOCOL_VERSION,
     AuthRequest,
     AuthResponse,
     AuthStatus,
     AuthType,
-    ConnectResponse,
-    ConnectStatus,
     Token,
 )
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 
-from .. import auth
+from .. import apdu_log, auth, metrics, sim_registry
 from ..auth import TokenError
 from ..config import Config
 from ..gc import gc
-from .connection_queue import queue_gc_coro_factory
+from .apdu_logger import ApduLogger
+from .connection_queue import queue_gc_coro_factory, reject_requeued
 from .probe_handler import ProbeHandler
 from .provider_handler import ProviderHandler
+from .routing import LocalRouter, Router
 from .util import read_msg, write_msg
 
 LOGGER = logging.getLogger(__name__)
 
+_CONNECTIONS = metrics.counter(
+    "moat_tunnel_connections",
+    "Accepted connections by the outcome of their authorisation.",
+    ["result"],
+)
+_CONNECTION_ERRORS = metrics.counter(
+    "moat_tunnel_connection_errors", "Connections closed because of an error."
+)
+_AUTH_LATENCY = metrics.histogram(
+    "moat_tunnel_auth_seconds", "Time spent validating session tokens.", ["type"]
+)
+
 
 class Server:
     def __init__(
@@ -37,9 +52,11 @@ class Server:
         tls_ctx: ssl.SSLContext | None = None,
         *,
         limit: int = 64 * 2**10,
+        router: Router | None = None,
         **kwargs,
     ):
         self._config = config
+        self._router = router if router is not None else LocalRouter()
 
         if tls_ctx is None:
             LOGGER.warning(
@@ -64,22 +81,14 @@ class Server:
             LOGGER.warn("Client closed connection unexpectedly.")
             close = True
         except asyncio.QueueFull as e:
-            LOGGER.warn(
-                "Failed to requeue connection request because either the queue"
-                "was full or because the client did not want to wait."
-            )
-            probe_writer = e.args[0].writer
-            await write_msg(
-                probe_writer, ConnectResponse(ConnectStatus.ProviderTimedOut)
-            )
-            probe_writer.close()
-            await probe_writer.wait_closed()
+            await reject_requeued(e)
             close = True
         except Exception as e:
             LOGGER.exception("Exception occurred while handling connection.")
             close = True
 
         if close:
+            _CONNECTION_ERRORS.inc()
             if not writer.is_closing():
                 writer.close()
 
@@ -96,14 +105,17 @@ class Server:
         LOGGER.debug("Received authorisation message: %s", auth_req)
 
         if auth_req is None:
+            _CONNECTIONS.inc(result="malformed")
             LOGGER.warn("Received malformed authorisation message. Closing connection.")
             writer.close()
             await writer.wait_closed()
             return None
 
         try:
-            await self._valid_token(auth_req.auth_type, auth_req.session_token)
+            with _AUTH_LATENCY.time(type=auth_req.auth_type.name.lower()):
+                await self._valid_token(auth_req.auth_type, auth_req.session_token)
         except TokenError as e:
+            _CONNECTIONS.inc(result="unauthorized")
             LOGGER.debug(
                 f"Received an invalid session token. Closing connection. (Reason: %s)",
                 e.etype,
@@ -113,16 +125,76 @@ class Server:
             await writer.wait_closed()
             return None
 
-        LOGGER.debug("Sending successful authorisation message.")
-        await write_msg(writer, AuthResponse(AuthStatus.Success))
+        # only providers can make use of protocol version 2 (multiplexing)
+        version = (
+            min(auth_req.version, PROTOCOL_VERSION)
+            if auth_req.auth_type == AuthType.Provider
+            else 1
+        )
 
-        match auth_req.auth_type:
-            case AuthType.Provider:
-                await self._provider_handler.handle(
-                    reader, writer, auth_req.session_token
+        _CONNECTIONS.inc(result=auth_req.auth_type.name.lower())
+
+        LOGGER.debug("Sending successful authorisation message. (version %d)", version)
+        await write_msg(writer, AuthResponse(AuthStatus.Success, version=version))
+
+        if auth_req.auth_type == AuthType.Provider:
+            provider_id = await auth.identity(auth_req.session_token)
+            assert provider_id is not None
+
+            if not self._router.is_local(provider_id):
+                await self._router.forward(
+                    provider_id,
+                    AuthRequest(
+                        auth_req.auth_type, auth_req.session_token, version=version
+                    ),
+                    reader,
+                    writer,
                 )
+                return
+
+        await self._serve(
+            reader, writer, auth_req.auth_type, auth_req.session_token, version
+        )
+
+    async def _handle_forwarded(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        auth_req: AuthRequest,
+    ) -> None:
+        # the forwarding worker already authenticated the client and negotiated
+        # the protocol version
+        LOGGER.debug("Handling forwarded connection...")
+        try:
+            await self._serve(
+                reader,
+                writer,
+                auth_req.auth_type,
+                auth_req.session_token,
+                auth_req.version,
+            )
+        except Exception:
+            LOGGER.exception("Exception occurred while handling forwarded connection.")
+            if not writer.is_closing():
+                writer.close()
+
+    async def _serve(
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        auth_type: AuthType,
+        session_token: Token,
+        version: int,
+    ) -> None:
+        match auth_type:
+            case AuthType.Provider if version >= 2:
+                await self._provider_handler.handle_multiplexed(
+                    reader, writer, session_token
+                )
+            case AuthType.Provider:
+                await self._provider_handler.handle(reader, writer, session_token)
             case AuthType.Probe:
-                await self._probe_handler.handle(reader, writer, auth_req.session_token)
+                await self._probe_handler.handle(reader, writer, session_token)
             case _:
                 raise NotImplementedError
 
@@ -141,8 +213,18 @@ class Server:
             raise AssertionError("Server is already running.")
 
         self._sessionmaker = await self._create_session_factory()
-        self._probe_handler = ProbeHandler(self._config, self._sessionmaker)
-        self._provider_handler = ProviderHandler(self._config, self._sessionmaker)
+        self._probe_handler = ProbeHandler(
+            self._config, self._sessionmaker, self._router
+        )
+        self._apdu_logger = ApduLogger(
+            self._sessionmaker,
+            self._config.APDU_LOG_BATCH_SIZE,
+            self._config.APDU_LOG_FLUSH_INTERVAL,
+            self._config.APDU_LOG_MAX_PENDING,
+        )
+        self._provider_handler = ProviderHandler(
+            self._config, self._sessionmaker, self._apdu_logger
+        )
 
         LOGGER.debug(
             "Creating asyncio server. (Host: %s; Port: %d)", self._host, self._port
@@ -160,26 +242,63 @@ class Server:
         for s in self._server.sockets:
             self._set_keepalive_opts(s)
 
+        async with self._sessionmaker() as session, session.begin():
+            await sim_registry.get_registry().load(session)
+
+        gc_coros = [sim_registry.reload_coro_factory(self._sessionmaker)]
+        if self._router.primary:
+            gc_coros.append(
+                apdu_log.maintenance_coro_factory(self._engine, self._config)
+            )
+        if self._config.MAX_PROBE_WAITTIME is not None:
+            gc_coros.append(queue_gc_coro_factory(self._config.MAX_PROBE_WAITTIME))
+
         LOGGER.info("Starting tunnel server...")
-        async with asyncio.TaskGroup() as tg:
-            tg.create_task(self._server.serve_forever())
-            if self._config.MAX_PROBE_WAITTIME is not None:
-                tg.create_task(
-                    gc(
-                        [queue_gc_coro_factory(self._config.MAX_PROBE_WAITTIME)],
-                        self._config.GC_INTERVAL,
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._server.serve_forever())
+                tg.create_task(self._apdu_logger.run())
+                tg.create_task(self._router.serve(self._handle_forwarded))
+                if self._config.METRICS_DIR is not None:
+                    tg.create_task(
+                        metrics.snapshot_writer(
+                            Path(self._config.METRICS_DIR),
+                            f"tunnel-{os.getpid()}",
+                            self._config.METRICS_INTERVAL,
+                        )
                     )
-                )
+                tg.create_task(gc(gc_coros, self._config.GC_INTERVAL))
+        finally:
+            await self._shutdown()
+
+    async def _shutdown(self) -> None:
+        LOGGER.info("Shutting down tunnel server...")
+
+        if self._server is not None:
+            self._server.close()
+
+        LOGGER.debug(
+            "Flushing %d buffered APDU log entries.", self._apdu_logger.pending
+        )
+        await self._apdu_logger.flush()
+
+        if self._apdu_logger.dropped > 0:
+            LOGGER.warning(
+                "%d APDU log entries were dropped during operation.",
+                self._apdu_logger.dropped,
+            )
+
+        await self._config.AUTH_HANDLER.close()
+        await self._engine.dispose()
 
     async def _create_session_factory(self) -> async_sessionmaker[AsyncSession]:
         engine = create_async_engine(self._config.db_url())
+        self._engine = engine
 
         while True:
             try:
                 async with engine.begin() as conn:
-                    from .. import models as dbm
-
-                    await conn.run_sync(dbm.Base.metadata.create_all)
+                    await conn.run_sync(apdu_log.create_schema, self._config)
                 break
             except Exception:
                 LOGGER.exception(f"Failed to connect to database.\nRetrying in 10s...")
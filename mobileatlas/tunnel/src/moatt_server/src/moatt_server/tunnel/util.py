@@ -1,8 +1,8 @@
 import asyncio
 import logging
-from typing import Callable, TypeVar
+from typing import Callable, Optional, TypeVar
 
-from moatt_types.connect import PartialInput
+from moatt_types.connect import ApduOp, ApduPacket, PartialInput
 
 LOGGER = logging.getLogger(__name__)
 
@@ -22,16 +22,72 @@ async def read_msg(reader: asyncio.StreamReader, parser: Callable[[bytes], T]) -
         try:
             return parser(buf)
         except PartialInput as e:
-            r = await reader.read(n=e.bytes_missing)
+            # parsers report exactly how many bytes are missing so the message
+            # is read in as few chunks as possible
+            try:
+                buf += await reader.readexactly(e.bytes_missing)
+            except asyncio.IncompleteReadError as ie:
+                raise asyncio.IncompleteReadError(buf + ie.partial, ie.expected)
 
-            if len(r) == 0:
-                raise asyncio.IncompleteReadError(buf, e.bytes_missing)
 
-            buf += r
+async def watch_idle(
+    reader: asyncio.StreamReader, timeout: Optional[float] = None
+) -> None:
+    """Consume heartbeats of an idle peer until it disconnects.
 
+    Returns as soon as the peer closes the connection or the connection is lost.
+    Raises ValueError if the peer sends anything but heartbeats and TimeoutError if
+    it sends nothing for timeout seconds.
 
-async def poll_eof(writer: asyncio.StreamWriter, interval=10) -> None:
+    Cancelling this coroutine never loses data because heartbeats carry no payload.
+    """
     while True:
-        if writer.is_closing():
+        try:
+            async with asyncio.timeout(timeout):
+                header = await reader.readexactly(ApduPacket.HEADER_LEN)
+        except asyncio.IncompleteReadError as e:
+            if len(e.partial) > 0:
+                LOGGER.debug("Peer closed connection while sending a packet.")
+            return
+        except ConnectionResetError:
             return
-        await asyncio.sleep(interval)
+
+        op, plen = ApduPacket.decode_header(header)
+
+        if op != ApduOp.Heartbeat or plen != 0:
+            raise ValueError(f"Expected a heartbeat but received {op} ({plen=}).")
+
+        LOGGER.debug("Received heartbeat.")
+
+
+async def splice(
+    reader_a: asyncio.StreamReader,
+    writer_a: asyncio.StreamWriter,
+    reader_b: asyncio.StreamReader,
+    writer_b: asyncio.StreamWriter,
+    chunk_size: int = 64 * 2**10,
+) -> None:
+    """Copy data between two connections until either of them is closed.
+
+    Both connections are closed afterwards.
+    """
+
+    async def copy(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while len(data := await reader.read(chunk_size)) > 0:
+            writer.write(data)
+            await writer.drain()
+
+    tasks = [
+        asyncio.create_task(copy(reader_a, writer_b)),
+        asyncio.create_task(copy(reader_b, writer_a)),
+    ]
+
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        writer_a.close()
+        writer_b.close()
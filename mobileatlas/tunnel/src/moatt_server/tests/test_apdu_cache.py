@@ -0,0 +1,144 @@
+import uuid
+
+import pytest
+
+from moatt_server.tunnel.apdu_cache import ResponseCache, _classify, _Kind
+
+SIM = (uuid.UUID(int=1), 0, "8943000000000000001", "232010000000001")
+
+SELECT_ICCID = bytes.fromhex("00a4000c022fe2")
+READ_BINARY = bytes.fromhex("00b000000a")
+ICCID = bytes.fromhex("98340000000000000010") + b"\x90\x00"
+OK = b"\x90\x00"
+
+
+def _exchange(session, command, response):
+    """Relay command as a provider handler would and return the cached response"""
+    cached = session.lookup(command)
+    if cached is not None:
+        return cached
+
+    for _ in session.replay(command):
+        pass
+    session.forwarded(command)
+    session.answered(response)
+    return None
+
+
+def _boot(cache, read_response=ICCID):
+    """Session reading EF.ICCID; returns the responses answered from the cache"""
+    session = cache.session(SIM)
+    return [
+        _exchange(session, SELECT_ICCID, OK),
+        _exchange(session, READ_BINARY, read_response),
+    ]
+
+
+@pytest.mark.parametrize(
+    "command,kind",
+    [
+        ("00b000000a", _Kind.READ),
+        ("00b2010404", _Kind.READ),
+        ("00b2000204", _Kind.STATE),
+        ("00a4000c022fe2", _Kind.STATE),
+        ("00d6000001ff", _Kind.WRITE),
+        ("0088008110", _Kind.VOLATILE),
+        ("8012000010", _Kind.VOLATILE),
+        ("801400000c", _Kind.VOLATILE),
+        # event download (location status)
+        ("80c2000009d607020282811b0100", _Kind.VOLATILE),
+        # SMS-PP data download
+        ("80c2000009d107020283810b0100", _Kind.WRITE),
+        ("0cb000000a", _Kind.OTHER),
+        ("00ee000000", _Kind.OTHER),
+        ("00b0", _Kind.OTHER),
+    ],
+)
+def test_classify(command, kind):
+    assert _classify(bytes.fromhex(command)) == kind
+
+
+def test_answered_from_cache():
+    cache = ResponseCache(100, 60)
+
+    assert _boot(cache) == [None, None]
+    assert _boot(cache) == [OK, ICCID]
+
+
+def test_selected_file_is_part_of_key():
+    cache = ResponseCache(100, 60)
+    _boot(cache)
+
+    # same READ BINARY without a preceding SELECT
+    session = cache.session(SIM)
+    assert _exchange(session, READ_BINARY, ICCID) is None
+
+
+def test_replays_state_changes():
+    cache = ResponseCache(100, 60)
+    _boot(cache)
+
+    session = cache.session(SIM)
+    assert session.lookup(SELECT_ICCID) == OK
+    assert session.replay(bytes.fromhex("00b0000014")) == [SELECT_ICCID]
+    assert session.replaying
+
+
+@pytest.mark.parametrize("sw", ["910f", "9f10", "6110", "6c0a", "6a82"])
+def test_pending_status_words_are_not_cached(sw):
+    cache = ResponseCache(100, 60)
+
+    _boot(cache, ICCID[:-2] + bytes.fromhex(sw))
+    assert _boot(cache)[1] is None
+
+
+@pytest.mark.parametrize("sw", ["9000", "6282", "63c1"])
+def test_final_status_words_are_cached(sw):
+    cache = ResponseCache(100, 60)
+    response = ICCID[:-2] + bytes.fromhex(sw)
+
+    _boot(cache, response)
+    assert _boot(cache, response)[1] == response
+
+
+@pytest.mark.parametrize(
+    "command,invalidates",
+    [
+        ("00d6000001ff", True),
+        ("80c2000009d107020283810b0100", True),
+        ("00ee000000", True),
+        ("8012000010", False),
+        ("801400000c", False),
+        ("80c2000009d607020282811b0100", False),
+        ("0088008110", False),
+    ],
+)
+def test_invalidation(command, invalidates):
+    cache = ResponseCache(100, 60)
+    _boot(cache)
+
+    session = cache.session(SIM)
+    _exchange(session, bytes.fromhex(command), OK)
+
+    assert (cache.epoch(SIM) == 1) == invalidates
+    assert (_boot(cache)[1] is None) == invalidates
+
+
+def test_session_disabled_after_unmodelled_command():
+    cache = ResponseCache(100, 60)
+    _boot(cache)
+
+    session = cache.session(SIM)
+    _exchange(session, bytes.fromhex("8012000010"), OK)
+    assert session.lookup(SELECT_ICCID) is None
+
+    # a reset restores the state the cached responses were learned in
+    session.reset()
+    assert session.lookup(SELECT_ICCID) == OK
+
+
+def test_expiry():
+    cache = ResponseCache(100, 0)
+    _boot(cache)
+
+    assert _boot(cache) == [None, None]
@@ -0,0 +1,69 @@
+import asyncio
+import uuid
+
+from moatt_types.connect import Token
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from moatt_server import auth, config
+from moatt_server import models as dbm
+from moatt_server.auth_handler import AuthHandler, AuthResult
+
+
+class _AuthHandler(AuthHandler):
+    """Allows everything. Tokens are the provider's ID."""
+
+    async def allowed_provider_registration(self, token):
+        return AuthResult.Success
+
+    async def allowed_sim_registration(self, token, sims):
+        return AuthResult.Success
+
+    async def allowed_probe_registration(self, token):
+        return AuthResult.Success
+
+    async def allowed_sim_request(self, token, provider_id, sim_id):
+        return AuthResult.Success
+
+    async def identity(self, token):
+        return uuid.UUID(bytes=token.token)
+
+
+def _use_config(monkeypatch):
+    cfg = config.Config(
+        DB_USER="", DB_PASSWORD="", DB_NAME="", AUTH_HANDLER=_AuthHandler(None)
+    )
+    monkeypatch.setattr(config, "_CONFIG", cfg)
+
+
+async def _register(providers, sims):
+    """Register sims for every provider in turn; returns all registered SIMs"""
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(dbm.Base.metadata.create_all)
+
+        sessionmaker = async_sessionmaker(engine, expire_on_commit=False)
+
+        for provider_id in providers:
+            async with sessionmaker() as session, session.begin():
+                await auth.register_provider(session, Token(provider_id.bytes), sims)
+
+        async with sessionmaker() as session:
+            return sorted(
+                (sim.provider_id, sim.id)
+                for sim in await session.scalars(select(dbm.Sim))
+            )
+    finally:
+        await engine.dispose()
+
+
+def test_register_provider_keeps_sims_of_other_providers(monkeypatch):
+    _use_config(monkeypatch)
+    a, b = uuid.UUID(int=1), uuid.UUID(int=2)
+
+    # SIM IDs are only unique per provider
+    registered = asyncio.run(_register([a, b], {0: (None, None), 1: (None, None)}))
+
+    assert registered == [(a, 0), (a, 1), (b, 0), (b, 1)]
@@ -0,0 +1,59 @@
+import uuid
+from datetime import timedelta
+
+from moatt_server.tunnel.connection_queue import QueueEntry
+from moatt_server.tunnel.scheduling import DeadlineScheduler
+
+MAX_WAIT = timedelta(seconds=60)
+
+
+def _entry(name, enqueued, priority=0, max_wait=MAX_WAIT):
+    qe = QueueEntry(
+        None, uuid.uuid4(), None, None, None, priority=priority, max_wait=max_wait
+    )
+    qe.name = name
+
+    # pretend the request arrived at enqueued
+    if qe.deadline is not None:
+        qe.deadline += enqueued - qe.enqueued
+    qe.enqueued = enqueued
+
+    return qe
+
+
+def _served(scheduler):
+    order = []
+    while len(scheduler) > 0:
+        order.append(scheduler.pop().name)
+    return order
+
+
+def test_deadline_same_priority_is_fifo():
+    scheduler = DeadlineScheduler()
+    for i, name in enumerate("abc"):
+        scheduler.push(_entry(name, 10.0 * i))
+
+    assert _served(scheduler) == ["a", "b", "c"]
+
+
+def test_deadline_urgent_requests_overtake():
+    scheduler = DeadlineScheduler()
+    # deadlines 60, 70 and 80
+    for i, name in enumerate("abc"):
+        scheduler.push(_entry(name, 10.0 * i))
+
+    # deadline 25 + 60 / 2 = 55
+    scheduler.push(_entry("urgent", 25.0, priority=1))
+    # deadline 45 + 60 / 2 = 75
+    scheduler.push(_entry("late", 45.0, priority=1))
+
+    assert [qe.name for qe in scheduler] == ["urgent", "a", "b", "late", "c"]
+    assert _served(scheduler) == ["urgent", "a", "b", "late", "c"]
+
+
+def test_deadline_requests_without_max_wait_last():
+    scheduler = DeadlineScheduler()
+    scheduler.push(_entry("unbounded", 0.0, priority=1, max_wait=None))
+    scheduler.push(_entry("bounded", 10.0))
+
+    assert _served(scheduler) == ["bounded", "unbounded"]
@@ -1,9 +1,17 @@
 import base64
 import enum
 import struct
-from typing import Union
+from collections.abc import Callable
+from typing import TypeVar, Union
 from uuid import UUID
 
+# Buffers accepted by the decoders
+Buffer = Union[bytes, bytearray, memoryview]
+
+# Highest protocol version supported. Version 2 adds multiplexing of SIM sessions
+# over a single provider connection (see MuxPacket).
+PROTOCOL_VERSION = 2
+
 
 class PartialInput(Exception):
     def __init__(self, bytes_missing: int):
@@ -11,6 +19,8 @@ class PartialInput(Exception):
 
 
 class Token:
+    __slots__ = ("token",)
+
     def __init__(self, token: bytes):
         assert len(token) < 2**16
         self.token = token
@@ -69,48 +79,316 @@ class ConnectStatus(enum.Enum):
 class ApduOp(enum.Enum):
     Apdu = 0
     Reset = 1
+    # keepalive; carries no payload and is never relayed
+    Heartbeat = 2
+
+
+_APDU_HEADER = struct.Struct("!BBI")
+_MUX_HEADER = struct.Struct("!BBII")
+_AUTH_REQUEST_HEADER = struct.Struct("!BBH")
+_AUTH_RESPONSE = struct.Struct("!BB")
+_CONNECT_REQUEST_HEADER = struct.Struct("!BBB")
+_CONNECT_RESPONSE = struct.Struct("!BB")
+_SIM_REF = struct.Struct("!16sQ")
+_IMSI = struct.Struct("15s")
+_ICCID = struct.Struct("20s")
+
+
+class _Structs(dict):
+    """Structs of a header followed by a payload, keyed by the payload's length.
+
+    Packing and unpacking the payload together with the header saves slicing and
+    copying it separately.
+    """
+
+    def __init__(self, header: str):
+        self.header = header
+
+    def __missing__(self, plen: int) -> struct.Struct:
+        s = self[plen] = struct.Struct(f"{self.header}{plen}s")
+        return s
+
+
+_APDU_PACKETS = _Structs(_APDU_HEADER.format)
+_MUX_PACKETS = _Structs(_MUX_HEADER.format)
+
+E = TypeVar("E", bound=enum.Enum)
+
+
+def _lookup(values: dict[int, E], value: int, name: str) -> E:
+    # considerably faster than calling the enum
+    try:
+        return values[value]
+    except KeyError:
+        raise ValueError(f"{value} is not a valid {name}") from None
+
+
+_APDU_OPS = {op.value: op for op in ApduOp}
+
+T = TypeVar("T")
+
+
+def _decode_all(decode_from: Callable[[Buffer, int], tuple[T, int]], msg: Buffer) -> T:
+    res, length = decode_from(msg, 0)
+
+    if len(msg) > length:
+        raise ValueError(
+            f"Expected message of length {length} but got {len(msg)} bytes."
+        )
+
+    return res
+
+
+def _check_space(buf: bytearray | memoryview, offset: int, length: int) -> None:
+    # slice assignments would silently grow bytearrays
+    if len(buf) < offset + length:
+        raise ValueError(
+            f"Buffer too small. (needed: {offset + length}; available: {len(buf)})"
+        )
+
+
+# All message types are immutable. Besides decode and encode every message type
+# provides decode_from and encode_into to decode from and encode into arbitrary
+# positions of caller-provided buffers.
 
 
 class ApduPacket:
+    __slots__ = ("op", "payload")
+
+    HEADER_LEN = _APDU_HEADER.size
+    MAX_PAYLOAD_LEN = 32**2 - 1
+
     def __init__(self, op: ApduOp, payload: bytes):
-        assert len(payload) < 32**2
+        assert len(payload) <= ApduPacket.MAX_PAYLOAD_LEN
         self.op = op
         self.payload = payload
 
+    def __repr__(self):
+        return f"ApduPacket({self.op}, {self.payload})"
+
+    def __eq__(self, other):
+        if not isinstance(other, ApduPacket):
+            return NotImplemented
+
+        return self.op == other.op and self.payload == other.payload
+
+    def __hash__(self):
+        return hash((self.op, self.payload))
+
     @staticmethod
-    def decode(msg: bytes) -> "ApduPacket":
-        if len(msg) < 6:
-            raise PartialInput(6 - len(msg))
+    def decode_header(header: Buffer, offset: int = 0) -> tuple[ApduOp, int]:
+        """Decode the header of an ApduPacket.
 
-        if msg[0] != 1:
-            raise ValueError(f"Wrong version ({msg[0]}). Expected version 1.")
+        Returns
+        -------
+        The opcode and the length of the payload following the header.
+        """
+        if len(header) - offset < ApduPacket.HEADER_LEN:
+            raise PartialInput(ApduPacket.HEADER_LEN - (len(header) - offset))
 
-        op = ApduOp(msg[1])
-        (plen,) = struct.unpack("!I", msg[2:6])
+        (version, op, plen) = _APDU_HEADER.unpack_from(header, offset)
 
-        if len(msg) < 6 + plen:
-            raise PartialInput((6 + plen) - len(msg))
+        if version != 1:
+            raise ValueError(f"Wrong version ({version}). Expected version 1.")
 
-        if len(msg) > 6 + plen:
+        if plen > ApduPacket.MAX_PAYLOAD_LEN:
             raise ValueError(
-                f"Expected message of length {6 + plen} but got {len(msg)} bytes."
+                f"Payload length ({plen}) exceeds maximum of {ApduPacket.MAX_PAYLOAD_LEN}."
             )
 
-        return ApduPacket(op, msg[6:])
+        return _lookup(_APDU_OPS, op, "ApduOp"), plen
+
+    @staticmethod
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["ApduPacket", int]:
+        """Decode the packet starting at offset. Any bytes following it are ignored.
+
+        Returns
+        -------
+        The packet and the number of bytes it was encoded as.
+        """
+        op, plen = ApduPacket.decode_header(buf, offset)
+        length = ApduPacket.HEADER_LEN + plen
+
+        if len(buf) < offset + length:
+            raise PartialInput(offset + length - len(buf))
+
+        return ApduPacket(op, _APDU_PACKETS[plen].unpack_from(buf, offset)[3]), length
+
+    @staticmethod
+    def decode(msg: Buffer) -> "ApduPacket":
+        return _decode_all(ApduPacket.decode_from, msg)
+
+    def encoded_len(self) -> int:
+        return ApduPacket.HEADER_LEN + len(self.payload)
+
+    def encode_header(self) -> bytes:
+        # _value_ is considerably faster than the value property
+        return _APDU_HEADER.pack(1, self.op._value_, len(self.payload))
 
     def encode(self) -> bytes:
-        return struct.pack("!BBI", 1, self.op.value, len(self.payload)) + self.payload
+        plen = len(self.payload)
+        return _APDU_PACKETS[plen].pack(1, self.op._value_, plen, self.payload)
 
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        """Encode the packet into buf starting at offset.
 
-def _only_digits(msg: bytes) -> bool:
-    def _is_digit(x: int):
-        return x >= ord(b"0") and x <= ord(b"9")
+        Returns
+        -------
+        The number of bytes written.
+        """
+        plen = len(self.payload)
+
+        try:
+            _APDU_PACKETS[plen].pack_into(
+                buf, offset, 1, self.op._value_, plen, self.payload
+            )
+        except struct.error:
+            _check_space(buf, offset, ApduPacket.HEADER_LEN + plen)
+            raise
+
+        return ApduPacket.HEADER_LEN + plen
+
+
+@enum.unique
+class MuxOp(enum.Enum):
+    Apdu = 0
+    Reset = 1
+    ConnectRequest = 2
+    ConnectResponse = 3
+    Close = 4
+    # connection level keepalive (stream ID 0); carries no payload
+    Heartbeat = 5
+
+
+_MUX_OPS = {op.value: op for op in MuxOp}
+
+
+class MuxPacket:
+    """Packet exchanged on multiplexed (protocol version 2) provider connections.
+
+    Every packet belongs to the SIM session identified by its stream ID.
+    """
+
+    __slots__ = ("stream_id", "op", "payload")
+
+    HEADER_LEN = _MUX_HEADER.size
+    MAX_STREAM_ID = 2**32 - 1
+
+    def __init__(self, stream_id: int, op: MuxOp, payload: bytes = b""):
+        assert 0 <= stream_id <= MuxPacket.MAX_STREAM_ID
+        assert len(payload) <= ApduPacket.MAX_PAYLOAD_LEN
+        self.stream_id = stream_id
+        self.op = op
+        self.payload = payload
+
+    def __repr__(self):
+        return f"MuxPacket({self.stream_id}, {self.op}, {self.payload})"
+
+    def __eq__(self, other):
+        if not isinstance(other, MuxPacket):
+            return NotImplemented
+
+        return (
+            self.stream_id == other.stream_id
+            and self.op == other.op
+            and self.payload == other.payload
+        )
+
+    def __hash__(self):
+        return hash((self.stream_id, self.op, self.payload))
+
+    @staticmethod
+    def from_apdu(stream_id: int, apdu: ApduPacket) -> "MuxPacket":
+        if apdu.op not in (ApduOp.Apdu, ApduOp.Reset):
+            raise ValueError(f"{apdu.op} packets cannot be sent on a stream.")
+
+        return MuxPacket(stream_id, _MUX_OPS[apdu.op.value], apdu.payload)
+
+    def to_apdu(self) -> ApduPacket:
+        if self.op not in (MuxOp.Apdu, MuxOp.Reset):
+            raise ValueError(f"{self.op} packets do not carry APDUs.")
+
+        return ApduPacket(_APDU_OPS[self.op.value], self.payload)
+
+    @staticmethod
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["MuxPacket", int]:
+        """Decode the packet starting at offset. Any bytes following it are ignored.
+
+        Returns
+        -------
+        The packet and the number of bytes it was encoded as.
+        """
+        if len(buf) - offset < MuxPacket.HEADER_LEN:
+            raise PartialInput(MuxPacket.HEADER_LEN - (len(buf) - offset))
+
+        (version, op, stream_id, plen) = _MUX_HEADER.unpack_from(buf, offset)
+
+        if version != 2:
+            raise ValueError(f"Wrong version ({version}). Expected version 2.")
+
+        if plen > ApduPacket.MAX_PAYLOAD_LEN:
+            raise ValueError(
+                f"Payload length ({plen}) exceeds maximum of {ApduPacket.MAX_PAYLOAD_LEN}."
+            )
+
+        length = MuxPacket.HEADER_LEN + plen
+
+        if len(buf) < offset + length:
+            raise PartialInput(offset + length - len(buf))
+
+        return (
+            MuxPacket(
+                stream_id,
+                _lookup(_MUX_OPS, op, "MuxOp"),
+                _MUX_PACKETS[plen].unpack_from(buf, offset)[4],
+            ),
+            length,
+        )
+
+    @staticmethod
+    def decode(msg: Buffer) -> "MuxPacket":
+        return _decode_all(MuxPacket.decode_from, msg)
 
-    return all(map(_is_digit, msg))
+    def encoded_len(self) -> int:
+        return MuxPacket.HEADER_LEN + len(self.payload)
+
+    def encode_header(self) -> bytes:
+        return _MUX_HEADER.pack(2, self.op._value_, self.stream_id, len(self.payload))
+
+    def encode(self) -> bytes:
+        plen = len(self.payload)
+        return _MUX_PACKETS[plen].pack(
+            2, self.op._value_, self.stream_id, plen, self.payload
+        )
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        """Encode the packet into buf starting at offset.
+
+        Returns
+        -------
+        The number of bytes written.
+        """
+        plen = len(self.payload)
+
+        try:
+            _MUX_PACKETS[plen].pack_into(
+                buf, offset, 2, self.op._value_, self.stream_id, plen, self.payload
+            )
+        except struct.error:
+            _check_space(buf, offset, MuxPacket.HEADER_LEN + plen)
+            raise
+
+        return MuxPacket.HEADER_LEN + plen
+
+
+def _only_digits(msg: bytes) -> bool:
+    return msg.isdigit() and msg.isascii()
 
 
 class Imsi:
-    _LEN = 15
+    __slots__ = ("_imsi",)
+
+    _LEN = _IMSI.size
 
     def __init__(self, imsi: str):
         if not _only_digits(imsi.encode()) or len(imsi) < 5 or len(imsi) > 15:
@@ -138,29 +416,42 @@ class Imsi:
         return self._imsi
 
     @staticmethod
-    def decode(msg: bytes) -> "Imsi":
-        if len(msg) < Imsi._LEN:
-            raise PartialInput(Imsi._LEN - len(msg))
-
-        if len(msg) > Imsi._LEN:
-            raise ValueError(
-                f"Expected IMSI to be encoded as {Imsi._LEN} bytes. (actual: {len(msg)})"
-            )
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["Imsi", int]:
+        if len(buf) - offset < Imsi._LEN:
+            raise PartialInput(Imsi._LEN - (len(buf) - offset))
 
+        (msg,) = _IMSI.unpack_from(buf, offset)
         msg = msg.rstrip(b"\x00")
 
         if not _only_digits(msg) or len(msg) < 5 or len(msg) > 15:
             raise ValueError("Expected IMSI to consist of 5 to 15 ascii digits.")
 
-        return Imsi(msg.decode())
+        return Imsi(msg.decode()), Imsi._LEN
+
+    @staticmethod
+    def decode(msg: Buffer) -> "Imsi":
+        return _decode_all(Imsi.decode_from, msg)
+
+    def encoded_len(self) -> int:
+        return Imsi._LEN
 
     def encode(self) -> bytes:
-        imsi = self._imsi.encode()
-        return imsi + b"\x00" * (Imsi._LEN - len(imsi))
+        return _IMSI.pack(self._imsi.encode())
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        try:
+            _IMSI.pack_into(buf, offset, self._imsi.encode())
+        except struct.error:
+            _check_space(buf, offset, Imsi._LEN)
+            raise
+
+        return Imsi._LEN
 
 
 class Iccid:
-    _LEN = 20
+    __slots__ = ("_iccid",)
+
+    _LEN = _ICCID.size
 
     def __init__(self, iccid: str):
         if not _only_digits(iccid.encode()) or len(iccid) < 5 or len(iccid) > 20:
@@ -188,32 +479,45 @@ class Iccid:
         return IdentifierType.Iccid
 
     @staticmethod
-    def decode(msg: bytes) -> "Iccid":
-        if len(msg) < Iccid._LEN:
-            raise PartialInput(Iccid._LEN - len(msg))
-
-        if len(msg) > Iccid._LEN:
-            raise ValueError(
-                f"Expected ICCID to be encoded as {Iccid._LEN} bytes. (actual: {len(msg)})"
-            )
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["Iccid", int]:
+        if len(buf) - offset < Iccid._LEN:
+            raise PartialInput(Iccid._LEN - (len(buf) - offset))
 
+        (msg,) = _ICCID.unpack_from(buf, offset)
         msg = msg.rstrip(b"\x00")
 
         if not _only_digits(msg) or len(msg) < 5 or len(msg) > 20:
-            raise ValueError("Expected IMSI to consist of 5 to 20 ascii digits.")
+            raise ValueError("Expected ICCID to consist of 5 to 20 ascii digits.")
+
+        return Iccid(msg.decode()), Iccid._LEN
+
+    @staticmethod
+    def decode(msg: Buffer) -> "Iccid":
+        return _decode_all(Iccid.decode_from, msg)
 
-        return Iccid(msg.decode())
+    def encoded_len(self) -> int:
+        return Iccid._LEN
 
     def encode(self) -> bytes:
-        iccid = self._iccid.encode()
-        return iccid + b"\x00" * (Iccid._LEN - len(iccid))
+        return _ICCID.pack(self._iccid.encode())
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        try:
+            _ICCID.pack_into(buf, offset, self._iccid.encode())
+        except struct.error:
+            _check_space(buf, offset, Iccid._LEN)
+            raise
+
+        return Iccid._LEN
 
 
 class SimId:
-    _LEN = 24
+    __slots__ = ("_provider", "_id")
+
+    _LEN = _SIM_REF.size
 
     def __init__(self, provider: UUID, id: int):
-        assert id < 2 ** (8 * SimId._LEN)
+        assert 0 <= id < 2**64
 
         self._provider = provider
         self._id = id
@@ -242,24 +546,40 @@ class SimId:
         return IdentifierType.Id
 
     @staticmethod
-    def decode(msg: bytes) -> "SimId":
-        if len(msg) < SimId._LEN:
-            raise PartialInput(SimId._LEN - len(msg))
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["SimId", int]:
+        if len(buf) - offset < SimId._LEN:
+            raise PartialInput(SimId._LEN - (len(buf) - offset))
 
-        if len(msg) > SimId._LEN:
-            raise ValueError(f"Expected {SimId._LEN} bytes got {len(msg)}.")
+        provider, id = _SIM_REF.unpack_from(buf, offset)
+        return SimId(UUID(bytes=provider), id), SimId._LEN
 
-        return SimId(UUID(bytes=msg[:16]), struct.unpack("!Q", msg[16:])[0])
+    @staticmethod
+    def decode(msg: Buffer) -> "SimId":
+        return _decode_all(SimId.decode_from, msg)
+
+    def encoded_len(self) -> int:
+        return SimId._LEN
 
     def encode(self) -> bytes:
-        return self._provider.bytes + struct.pack("!Q", self._id)
+        return _SIM_REF.pack(self._provider.bytes, self._id)
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        try:
+            _SIM_REF.pack_into(buf, offset, self._provider.bytes, self._id)
+        except struct.error:
+            _check_space(buf, offset, SimId._LEN)
+            raise
+
+        return SimId._LEN
 
 
 class SimIndex:
-    _LEN = 24
+    __slots__ = ("_provider", "_idx")
+
+    _LEN = _SIM_REF.size
 
     def __init__(self, provider: UUID, idx: int):
-        assert idx < 2 ** (8 * SimIndex._LEN)
+        assert 0 <= idx < 2**64
 
         self._provider = provider
         self._idx = idx
@@ -288,86 +608,202 @@ class SimIndex:
         return IdentifierType.Index
 
     @staticmethod
-    def decode(msg: bytes) -> "SimIndex":
-        if len(msg) < SimIndex._LEN:
-            raise PartialInput(SimIndex._LEN - len(msg))
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["SimIndex", int]:
+        if len(buf) - offset < SimIndex._LEN:
+            raise PartialInput(SimIndex._LEN - (len(buf) - offset))
+
+        provider, idx = _SIM_REF.unpack_from(buf, offset)
+        return SimIndex(UUID(bytes=provider), idx), SimIndex._LEN
 
-        if len(msg) > SimIndex._LEN:
-            raise ValueError(f"Expected {SimId._LEN} bytes got {len(msg)}.")
+    @staticmethod
+    def decode(msg: Buffer) -> "SimIndex":
+        return _decode_all(SimIndex.decode_from, msg)
 
-        return SimIndex(UUID(bytes=msg[:16]), struct.unpack("!Q", msg[16:])[0])
+    def encoded_len(self) -> int:
+        return SimIndex._LEN
 
     def encode(self) -> bytes:
-        return self._provider.bytes + struct.pack("!Q", self._idx)
+        return _SIM_REF.pack(self._provider.bytes, self._idx)
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        try:
+            _SIM_REF.pack_into(buf, offset, self._provider.bytes, self._idx)
+        except struct.error:
+            _check_space(buf, offset, SimIndex._LEN)
+            raise
+
+        return SimIndex._LEN
 
 
 SimIdentifierType = Union[SimId, SimIndex, Iccid, Imsi]
 
+_IDENTIFIER_TYPES = {t.value: t for t in IdentifierType}
+_IDENTIFIERS: dict[IdentifierType, type[SimIdentifierType]] = {
+    IdentifierType.Id: SimId,
+    IdentifierType.Iccid: Iccid,
+    IdentifierType.Imsi: Imsi,
+    IdentifierType.Index: SimIndex,
+}
+_AUTH_TYPES = {t.value: t for t in AuthType}
+_AUTH_STATUSES = {s.value: s for s in AuthStatus}
+_CONNECT_STATUSES = {s.value: s for s in ConnectStatus}
+
 
 class AuthRequest:
-    _MIN_LEN = 4
+    __slots__ = ("auth_type", "session_token", "version")
+
+    _MIN_LEN = _AUTH_REQUEST_HEADER.size
 
-    def __init__(self, auth_type: AuthType, session_token: Token):
+    def __init__(self, auth_type: AuthType, session_token: Token, version: int = 1):
+        assert 1 <= version <= PROTOCOL_VERSION
         self.auth_type = auth_type
         self.session_token = session_token
+        self.version = version
+
+    def __repr__(self):
+        return f"AuthRequest({self.auth_type}, {self.session_token}, {self.version})"
+
+    def __eq__(self, other):
+        if not isinstance(other, AuthRequest):
+            return NotImplemented
+
+        return (
+            self.auth_type == other.auth_type
+            and self.session_token == other.session_token
+            and self.version == other.version
+        )
+
+    def __hash__(self):
+        return hash((self.auth_type, self.session_token, self.version))
 
     @staticmethod
-    def decode(msg: bytes) -> "AuthRequest":
-        if len(msg) < AuthRequest._MIN_LEN:
-            raise PartialInput(AuthRequest._MIN_LEN - len(msg))
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["AuthRequest", int]:
+        if len(buf) - offset < AuthRequest._MIN_LEN:
+            raise PartialInput(AuthRequest._MIN_LEN - (len(buf) - offset))
 
-        (version, auth_type, plen) = struct.unpack("!BBH", msg[:4])
+        (version, auth_type, plen) = _AUTH_REQUEST_HEADER.unpack_from(buf, offset)
 
-        if version != 1:
-            raise ValueError(f"Wrong version ({version}). Expected version 1.")
+        if version < 1 or version > PROTOCOL_VERSION:
+            raise ValueError(
+                f"Unsupported version ({version}). Expected version 1 to {PROTOCOL_VERSION}."
+            )
 
-        if len(msg) < plen + 4:
-            raise PartialInput((plen + 4) - len(msg))
+        start = offset + AuthRequest._MIN_LEN
 
-        if len(msg) != plen + 4:
-            raise ValueError
+        if len(buf) < start + plen:
+            raise PartialInput(start + plen - len(buf))
 
-        return AuthRequest(AuthType(auth_type), Token(msg[4:]))
+        return (
+            AuthRequest(
+                _lookup(_AUTH_TYPES, auth_type, "AuthType"),
+                Token(bytes(buf[start : start + plen])),
+                version=version,
+            ),
+            start + plen - offset,
+        )
+
+    @staticmethod
+    def decode(msg: Buffer) -> "AuthRequest":
+        return _decode_all(AuthRequest.decode_from, msg)
+
+    def encoded_len(self) -> int:
+        return AuthRequest._MIN_LEN + len(self.session_token.token)
 
     def encode(self) -> bytes:
-        token_bytes = self.session_token.as_bytes()
+        token_bytes = self.session_token.token
         return (
-            struct.pack("!BBH", 1, self.auth_type.value, len(token_bytes)) + token_bytes
+            _AUTH_REQUEST_HEADER.pack(
+                self.version, self.auth_type.value, len(token_bytes)
+            )
+            + token_bytes
         )
 
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        token_bytes = self.session_token.token
+        start = offset + AuthRequest._MIN_LEN
+        _check_space(buf, start, len(token_bytes))
+
+        _AUTH_REQUEST_HEADER.pack_into(
+            buf, offset, self.version, self.auth_type.value, len(token_bytes)
+        )
+        buf[start : start + len(token_bytes)] = token_bytes
+
+        return AuthRequest._MIN_LEN + len(token_bytes)
+
 
 class AuthResponse:
-    _LEN = 2
+    __slots__ = ("status", "version")
 
-    def __init__(self, status: AuthStatus):
+    _LEN = _AUTH_RESPONSE.size
+
+    def __init__(self, status: AuthStatus, version: int = 1):
+        assert 1 <= version <= PROTOCOL_VERSION
         self.status = status
+        self.version = version
+
+    def __repr__(self):
+        return f"AuthResponse({self.status}, {self.version})"
+
+    def __eq__(self, other):
+        if not isinstance(other, AuthResponse):
+            return NotImplemented
+
+        return self.status == other.status and self.version == other.version
+
+    def __hash__(self):
+        return hash((self.status, self.version))
 
     @staticmethod
-    def decode(msg: bytes) -> "AuthResponse":
-        if len(msg) < AuthResponse._LEN:
-            raise PartialInput(AuthResponse._LEN - len(msg))
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["AuthResponse", int]:
+        if len(buf) - offset < AuthResponse._LEN:
+            raise PartialInput(AuthResponse._LEN - (len(buf) - offset))
+
+        (version, status) = _AUTH_RESPONSE.unpack_from(buf, offset)
 
-        if len(msg) > AuthResponse._LEN:
+        if version < 1 or version > PROTOCOL_VERSION:
             raise ValueError(
-                f"Expected message of length {AuthResponse._LEN} but got {len(msg)} bytes."
+                f"Unsupported version ({version}). Expected version 1 to {PROTOCOL_VERSION}."
             )
 
-        if msg[0] != 1:
-            raise ValueError(f"Wrong version ({msg[0]}). Expected version 1.")
+        return (
+            AuthResponse(
+                _lookup(_AUTH_STATUSES, status, "AuthStatus"), version=version
+            ),
+            AuthResponse._LEN,
+        )
+
+    @staticmethod
+    def decode(msg: Buffer) -> "AuthResponse":
+        return _decode_all(AuthResponse.decode_from, msg)
 
-        return AuthResponse(AuthStatus(msg[1]))
+    def encoded_len(self) -> int:
+        return AuthResponse._LEN
 
     def encode(self) -> bytes:
-        return struct.pack("!BB", 1, self.status.value)
+        return _AUTH_RESPONSE.pack(self.version, self.status.value)
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        try:
+            _AUTH_RESPONSE.pack_into(buf, offset, self.version, self.status.value)
+        except struct.error:
+            _check_space(buf, offset, AuthResponse._LEN)
+            raise
+
+        return AuthResponse._LEN
 
 
 @enum.verify(enum.NAMED_FLAGS)
 class ConnectionRequestFlags(enum.Flag):
     DEFAULT = 0
     NO_WAIT = 1
+    URGENT = 2
 
 
 class ConnectRequest:
+    __slots__ = ("flags", "identifier")
+
+    _HEADER_LEN = _CONNECT_REQUEST_HEADER.size
+
     def __init__(
         self,
         identifier: SimIdentifierType,
@@ -376,59 +812,116 @@ class ConnectRequest:
         self.flags = flags
         self.identifier = identifier
 
+    def __repr__(self):
+        return f"ConnectRequest({self.identifier}, {self.flags})"
+
+    def __eq__(self, other):
+        if not isinstance(other, ConnectRequest):
+            return NotImplemented
+
+        return self.flags == other.flags and self.identifier == other.identifier
+
+    def __hash__(self):
+        return hash((self.flags, self.identifier))
+
     @staticmethod
-    def decode(msg: bytes) -> "ConnectRequest":
-        if len(msg) < 3:
-            raise PartialInput(3 - len(msg))
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["ConnectRequest", int]:
+        if len(buf) - offset < ConnectRequest._HEADER_LEN:
+            raise PartialInput(ConnectRequest._HEADER_LEN - (len(buf) - offset))
+
+        (version, flags, ident_type) = _CONNECT_REQUEST_HEADER.unpack_from(buf, offset)
+
+        if version != 1:
+            raise ValueError(f"Wrong version ({version}). Expected version 1.")
+
+        flags = ConnectionRequestFlags(flags)
+        ident_type = _lookup(_IDENTIFIER_TYPES, ident_type, "IdentifierType")
 
-        if msg[0] != 1:
-            raise ValueError(f"Wrong version ({msg[0]}). Expected version 1.")
+        identifier, length = _IDENTIFIERS[ident_type].decode_from(
+            buf, offset + ConnectRequest._HEADER_LEN
+        )
 
-        flags = ConnectionRequestFlags(msg[1])
-        ident_type = IdentifierType(msg[2])
+        return (
+            ConnectRequest(identifier, flags),
+            ConnectRequest._HEADER_LEN + length,
+        )
 
-        if ident_type == IdentifierType.Id:
-            identifier = SimId.decode(msg[3:])
-        elif ident_type == IdentifierType.Imsi:
-            identifier = Imsi.decode(msg[3:])
-        elif ident_type == IdentifierType.Iccid:
-            identifier = Iccid.decode(msg[3:])
-        elif ident_type == IdentifierType.Index:
-            identifier = SimIndex.decode(msg[3:])
-        else:
-            raise NotImplementedError
+    @staticmethod
+    def decode(msg: Buffer) -> "ConnectRequest":
+        return _decode_all(ConnectRequest.decode_from, msg)
 
-        return ConnectRequest(identifier, flags)
+    def encoded_len(self) -> int:
+        return ConnectRequest._HEADER_LEN + self.identifier.encoded_len()
 
     def encode(self) -> bytes:
         return (
-            struct.pack(
-                "!BBB", 1, self.flags.value, self.identifier.identifier_type().value
+            _CONNECT_REQUEST_HEADER.pack(
+                1, self.flags.value, self.identifier.identifier_type().value
             )
             + self.identifier.encode()
         )
 
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        _check_space(buf, offset, self.encoded_len())
+
+        _CONNECT_REQUEST_HEADER.pack_into(
+            buf, offset, 1, self.flags.value, self.identifier.identifier_type().value
+        )
+        return ConnectRequest._HEADER_LEN + self.identifier.encode_into(
+            buf, offset + ConnectRequest._HEADER_LEN
+        )
+
 
 class ConnectResponse:
-    _LEN = 2
+    __slots__ = ("status",)
+
+    _LEN = _CONNECT_RESPONSE.size
 
     def __init__(self, status: ConnectStatus):
         self.status = status
 
+    def __repr__(self):
+        return f"ConnectResponse({self.status})"
+
+    def __eq__(self, other):
+        if not isinstance(other, ConnectResponse):
+            return NotImplemented
+
+        return self.status == other.status
+
+    def __hash__(self):
+        return hash(self.status)
+
     @staticmethod
-    def decode(msg: bytes) -> "ConnectResponse":
-        if len(msg) < ConnectResponse._LEN:
-            raise PartialInput(ConnectResponse._LEN - len(msg))
+    def decode_from(buf: Buffer, offset: int = 0) -> tuple["ConnectResponse", int]:
+        if len(buf) - offset < ConnectResponse._LEN:
+            raise PartialInput(ConnectResponse._LEN - (len(buf) - offset))
 
-        if len(msg) > ConnectResponse._LEN:
-            raise ValueError(
-                f"Expected message of length {ConnectResponse._LEN} but got {len(msg)} bytes."
-            )
+        (version, status) = _CONNECT_RESPONSE.unpack_from(buf, offset)
+
+        if version != 1:
+            raise ValueError(f"Wrong version ({version}). Expected version 1.")
 
-        if msg[0] != 1:
-            raise ValueError(f"Wrong version ({msg[0]}). Expected version 1.")
+        return (
+            ConnectResponse(_lookup(_CONNECT_STATUSES, status, "ConnectStatus")),
+            ConnectResponse._LEN,
+        )
 
-        return ConnectResponse(ConnectStatus(msg[1]))
+    @staticmethod
+    def decode(msg: Buffer) -> "ConnectResponse":
+        return _decode_all(ConnectResponse.decode_from, msg)
+
+    def encoded_len(self) -> int:
+        return ConnectResponse._LEN
 
     def encode(self) -> bytes:
-        return struct.pack("!BB", 1, self.status.value)
+        return _CONNECT_RESPONSE.pack(1, self.status.value)
+
+    def encode_into(self, buf: bytearray | memoryview, offset: int = 0) -> int:
+        try:
+            _CONNECT_RESPONSE.pack_into(buf, offset, 1, self.status.value)
+        except struct.error:
+            _check_space(buf, offset, ConnectResponse._LEN)
+            raise
+
+        return ConnectResponse._LEN
@@ -0,0 +1,152 @@
+"""Round-trip and truncation properties of the wire protocol types.
+
+Every message type is checked on randomly generated messages: encoding and
+decoding (both into fresh and into caller-provided buffers) must round trip,
+every truncated encoding must raise `PartialInput` with the number of missing
+bytes and trailing bytes must be rejected by `decode` but ignored by
+`decode_from`.
+"""
+
+import random
+import uuid
+from collections.abc import Callable
+from typing import Any
+
+import pytest
+
+from moatt_types.connect import (
+    ApduOp,
+    ApduPacket,
+    AuthRequest,
+    AuthResponse,
+    AuthStatus,
+    AuthType,
+    ConnectionRequestFlags,
+    ConnectRequest,
+    ConnectResponse,
+    ConnectStatus,
+    Iccid,
+    Imsi,
+    MuxOp,
+    MuxPacket,
+    PartialInput,
+    SimId,
+    SimIndex,
+    Token,
+)
+
+ITERATIONS = 200
+
+
+def _digits(rng: random.Random, lo: int, hi: int) -> str:
+    return "".join(rng.choices("0123456789", k=rng.randint(lo, hi)))
+
+
+def _payload(rng: random.Random) -> bytes:
+    n = rng.choice([0, 1, 5, rng.randint(0, ApduPacket.MAX_PAYLOAD_LEN)])
+    return rng.randbytes(n)
+
+
+def _identifier(rng: random.Random):
+    match rng.randrange(4):
+        case 0:
+            return SimId(uuid.UUID(bytes=rng.randbytes(16)), rng.getrandbits(64))
+        case 1:
+            return SimIndex(uuid.UUID(bytes=rng.randbytes(16)), rng.getrandbits(64))
+        case 2:
+            return Imsi(_digits(rng, 5, 15))
+        case _:
+            return Iccid(_digits(rng, 5, 20))
+
+
+GENERATORS: dict[type, Callable[[random.Random], Any]] = {
+    ApduPacket: lambda rng: ApduPacket(rng.choice(list(ApduOp)), _payload(rng)),
+    MuxPacket: lambda rng: MuxPacket(
+        rng.getrandbits(32), rng.choice(list(MuxOp)), _payload(rng)
+    ),
+    Imsi: lambda rng: Imsi(_digits(rng, 5, 15)),
+    Iccid: lambda rng: Iccid(_digits(rng, 5, 20)),
+    SimId: lambda rng: SimId(uuid.UUID(bytes=rng.randbytes(16)), rng.getrandbits(64)),
+    SimIndex: lambda rng: SimIndex(
+        uuid.UUID(bytes=rng.randbytes(16)), rng.getrandbits(64)
+    ),
+    AuthRequest: lambda rng: AuthRequest(
+        rng.choice(list(AuthType)),
+        Token(rng.randbytes(rng.randint(0, 64))),
+        version=rng.randint(1, 2),
+    ),
+    AuthResponse: lambda rng: AuthResponse(
+        rng.choice(list(AuthStatus)), version=rng.randint(1, 2)
+    ),
+    ConnectRequest: lambda rng: ConnectRequest(
+        _identifier(rng), rng.choice(list(ConnectionRequestFlags))
+    ),
+    ConnectResponse: lambda rng: ConnectResponse(rng.choice(list(ConnectStatus))),
+}
+
+
+def _messages(cls: type) -> list:
+    rng = random.Random(cls.__name__)
+    return [GENERATORS[cls](rng) for _ in range(ITERATIONS)]
+
+
+@pytest.mark.parametrize("cls", GENERATORS, ids=lambda cls: cls.__name__)
+def test_round_trip(cls):
+    for msg in _messages(cls):
+        encoded = msg.encode()
+        assert len(encoded) == msg.encoded_len()
+        assert cls.decode(encoded) == msg
+        assert cls.decode(bytearray(encoded)) == msg
+        assert cls.decode(memoryview(encoded)) == msg
+
+
+@pytest.mark.parametrize("cls", GENERATORS, ids=lambda cls: cls.__name__)
+def test_buffer_round_trip(cls):
+    for msg in _messages(cls):
+        encoded = msg.encode()
+
+        # caller-provided buffers at an arbitrary offset followed by other data
+        buf = bytearray(3 + len(encoded) + 5)
+        assert msg.encode_into(buf, 3) == len(encoded)
+        assert buf[3 : 3 + len(encoded)] == encoded
+        assert cls.decode_from(memoryview(buf), 3) == (msg, len(encoded))
+        assert cls.decode_from(bytes(buf), 3) == (msg, len(encoded))
+
+        view = memoryview(bytearray(len(encoded)))
+        assert msg.encode_into(view) == len(encoded)
+        assert view == encoded
+
+
+@pytest.mark.parametrize("cls", GENERATORS, ids=lambda cls: cls.__name__)
+def test_encode_into_short_buffer(cls):
+    for msg in _messages(cls):
+        n = msg.encoded_len()
+
+        with pytest.raises(ValueError):
+            msg.encode_into(bytearray(n - 1))
+
+        with pytest.raises(ValueError):
+            msg.encode_into(bytearray(n), 1)
+
+
+@pytest.mark.parametrize("cls", GENERATORS, ids=lambda cls: cls.__name__)
+def test_trailing_bytes(cls):
+    for msg in _messages(cls):
+        with pytest.raises(ValueError):
+            cls.decode(msg.encode() + b"\x00")
+
+
+@pytest.mark.parametrize("cls", GENERATORS, ids=lambda cls: cls.__name__)
+def test_partial_input(cls):
+    for msg in _messages(cls)[:20]:
+        encoded = msg.encode()
+
+        # every truncation has to report how many bytes are missing at least
+        for n in range(len(encoded)):
+            with pytest.raises(PartialInput) as e:
+                cls.decode(encoded[:n])
+
+            assert 0 < e.value.bytes_missing <= len(encoded) - n
+
+            with pytest.raises(PartialInput):
+                cls.decode_from(b"\xff" + encoded[:n], 1)
@@ -21,15 +21,16 @@ sys.real_prefix = sys.prefix
 sys.prefix = venv_path
 # END venv hack
 
-import pyudev
+import concurrent.futures
 import pexpect
 import kmod
 import ssl
-import time
 import base64
 from datetime import datetime, timezone
 import logging
 from pathlib import Path
+from mobileatlas.probe.modem_discovery import ModemDiscovery
+from mobileatlas.probe.netns import NetnsManager
 from mobileatlas.probe.probe_args import ProbeParser
 from mobileatlas.probe.tunnel.modem_tunnel import ModemTunnel
 from moatt_types.connect import Token
@@ -51,12 +52,6 @@ MODULES_BLACKLIST_ALLOWED = {
     "usbcore",
 }
 
-MODEM_IDS = [
-    ("2c7c", "0125"),  # 4G Quectel EG25-G
-    ("2c7c", "0800"),  # 5G Quectel RM500Q
-]
-
-
 def blacklist_kernel_modules(module_list):
     # filter modules, only allow certain modules to be blacklisted
     module_list = MODULES_BLACKLIST_ALLOWED.intersection(module_list)
@@ -77,21 +72,6 @@ def blacklist_kernel_modules(module_list):
             km.rmmod(mod.name)
 
 
-def wait_for_modem():
-    context = pyudev.Context()
-    modem_device = None
-    while not modem_device:
-        for vendor_id, model_id in MODEM_IDS:
-            modem_device = list(
-                context.list_devices(
-                    subsystem="usb", ID_VENDOR_ID=vendor_id, ID_MODEL_ID=model_id
-                )
-            )  # alternatively a more generic filter could be used?
-            if modem_device:
-                break
-        time.sleep(1)
-
-
 def main():
     start = datetime.now(timezone.utc)
     """
@@ -147,6 +127,8 @@ def main():
             tls_ctx=tls_ctx,
             tls_server_name=parser.get_tls_server_name(),
             direct_connection=True,
+            latency_path=parser.get_latency_path(),
+            latency_report_interval=parser.get_latency_report_interval(),
         )
     else:
         try:
@@ -169,12 +151,23 @@ def main():
             parser.get_imsi(),
             tls_ctx=tls_ctx,
             tls_server_name=parser.get_tls_server_name(),
+            latency_path=parser.get_latency_path(),
+            latency_report_interval=parser.get_latency_report_interval(),
         )
 
+    # started before the power cycle, so that no udev event is missed
+    modem_discovery = ModemDiscovery()
     tunnel.setup()  # resets modem
 
-    logger.info("wait some time until modem is initialized...")
-    wait_for_modem()
+    if parser.is_measurement_namespace_enabled():
+        # the network namespace does not depend on the modem, so it is provisioned
+        # while waiting for the modem (and reused if a previous test prepared it)
+        netns_manager = NetnsManager()
+        netns_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        netns_setup = netns_executor.submit(netns_manager.setup)
+
+    logger.info("wait until modem is initialized...")
+    modem_discovery.wait()
     modem_reset_time = datetime.now(timezone.utc) - start
     logger.info(
         f"modem was detected after {modem_reset_time.total_seconds():.2f} seconds"
@@ -183,6 +176,8 @@ def main():
     if parser.is_measurement_namespace_enabled():
         # Start ModemManager and NetworkManager and generate namespace  with Magic Script
         logger.info("create measurement namespace...")
+        netns_setup.result()
+        netns_executor.shutdown()
         ps_ns = pexpect.spawn("./mobileatlas/probe/setup_measure_ns.sh")
         # give setup script some time to startup modemmanager
         ps_ns.expect("root@mobileatlas")
@@ -202,10 +197,14 @@ def main():
     ps_test.interact()  # invalidates timeout?!
 
     if parser.is_measurement_namespace_enabled():
-        # exit netns process, which kills the net namespace and all processes that were running inside it
+        # exit netns process, which kills all processes that were running inside the namespace
         ps_ns.sendline("exit")
         ps_ns.expect(pexpect.EOF, timeout=5)  # wait max 5 sec for process to exit
 
+        # the network namespace itself is kept for the next test
+        if parser.get_teardown_namespace():
+            netns_manager.teardown()
+
     # shutdown sim tunnel connection
     tunnel.shutdown()
     stop = datetime.now(timezone.utc)
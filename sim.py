@@ -6,110 +6,79 @@ SIM Server Script
 import os
 import sys
 import ssl
-import socket
-import struct
 import logging
 import argparse
+import asyncio
 import base64
-import time
+import threading
 from mobileatlas.simprovider.sim_provider import SimProvider
-from mobileatlas.simprovider.tunnel.sim_tunnel import SimTunnel
+from mobileatlas.simprovider.daemon import ProviderDaemon
+from mobileatlas.simprovider.emulator import load_config
 
-from moatt_clients.provider_client import ProviderClient, register_sims, SIM
+from moatt_clients.provider_client import register_sims, update_sims, SIM
 from moatt_clients.errors import AuthError
 from moatt_clients.moat_management import register_provider, deregister_provider
-from moatt_types.connect import Token, ConnectStatus, Imsi, Iccid, SimId, SimIndex
+from moatt_types.connect import Token, Imsi, Iccid
 
 
-def init_server(host, port, tls_ctx):
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+def to_sim(sim_info):
+    return SIM(id=sim_info.id, iccid=Iccid(sim_info.iccid), imsi=Imsi(sim_info.imsi))
 
-    try:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_address = (host, port)
-
-        logging.info("starting up on {} port {}".format(*server_address))
-        s.bind(server_address)
-        s.listen(1)
-    except Exception as e:
-        s.close()
-        raise e
-
-    if tls_ctx is None:
-        return s
-    else:
-        return tls_ctx.wrap_socket(s, server_side=True)
 
+def get_sims(sim_provider):
+    return [to_sim(x) for x in sim_provider.get_sims()]
 
-def accept_connection(s):
-    logging.info("waiting for a connection")
-    connection, client_address = s.accept()
-    logging.info("accept connection " + str(client_address))
-    return connection
 
+class SimRegistration:
+    """
+    Keeps the SIMs registered with the tunnel server in sync with the SimProvider
 
-def provides_sim(sim_provider, req):
-    sim = get_sim(sim_provider, req.identifier)
+    Changes are sent as deltas. If the server does not support them or the delta
+    cannot be applied all SIMs are registered again.
+    """
 
-    return ConnectStatus.Success if sim is not None else ConnectStatus.NotFound
+    def __init__(self, api_url, session_token, sim_provider):
+        self.api_url = api_url
+        self.session_token = session_token
+        self.sim_provider = sim_provider
+        self.lock = threading.Lock()
+        # version of the registered SIMs; None if deltas are not supported
+        self.version = None
 
+    def register(self):
+        with self.lock:
+            self.register_all()
 
-def get_sims(sim_provider):
-    return [
-        SIM(id=i, iccid=Iccid(x.iccid), imsi=Imsi(x.imsi))
-        for i, x in enumerate(sim_provider.get_sims())
-    ]
-
-
-def get_sim(sim_provider, ident):
-    sims = sim_provider.get_sims()
-
-    if isinstance(ident, SimId):
-        if ident.id < len(sims):
-            return sims[ident.id]
-    elif isinstance(ident, SimIndex):
-        if ident.index < len(sims):
-            return sims[ident.index]
-    else:
-        sim = next(
-            (x for x in sims if Imsi(x.imsi) == ident or Iccid(x.iccid) == ident), None
+    def register_all(self):
+        self.version = register_sims(
+            self.api_url, self.session_token, get_sims(self.sim_provider)
         )
 
-        if sim is not None:
-            return sim
-
-    return None
-
-
-def direct_connection(host, port, sim_provider, tls_ctx):
-    srv = init_server(host, port, tls_ctx)
+    def update(self, added, removed):
+        with self.lock:
+            if self.version is None:
+                self.register_all()
+                return
 
-    while True:
-        connection = accept_connection(srv)
+            added_ids = {x.id for x in added}
+            try:
+                self.version = update_sims(
+                    self.api_url,
+                    self.session_token,
+                    self.version,
+                    [to_sim(x) for x in added],
+                    # SIMs with the same ID are replaced by the added ones
+                    [x.id for x in removed if x.id not in added_ids],
+                )
+            except Exception as e:
+                logging.warning(
+                    f"SIM update failed ({e!r}). Registering all SIMs again."
+                )
+                self.register_all()
 
-        # First 8 Byte is the IMSI
-        requested_imsi = struct.unpack("!Q", connection.recv(8))[0]
 
-        device = next(
-            (x for x in sim_provider.get_sims() if x.imsi == requested_imsi), None
-        )
-        if device:
-            logging.info(
-                f"requested imsi {requested_imsi} is on device {device.device_name}"
-            )
-            # Start SimTunnel for connection to serial device
-            tunnel = SimTunnel(
-                connection, device.sl, device.iccid, direct_connection=True
-            )
-            tunnel.start()
-        else:
-            logging.info(
-                f"requested imsi {requested_imsi} is currently not connected to the system"
-            )
-            if tls_ctx is not None:
-                connection.unwrap()
-            connection.shutdown(socket.SHUT_RDWR)
-            connection.close()
+def emulated_cards(args):
+    return [card for path in args.emulate for card in load_config(path)]
 
 
 def main():
@@ -135,6 +104,36 @@ certificate.",
     )
     parser.add_argument("--cert", help="Certificate served to clients.")
     parser.add_argument("--key", help="Certificate key.")
+    parser.add_argument(
+        "--replay",
+        action="append",
+        default=[],
+        metavar="TRACE",
+        help="Provide a recorded session as a SIM card. (May be repeated.)",
+    )
+    parser.add_argument(
+        "--replay-latency",
+        action="store_true",
+        help="Delay replayed responses by the recorded card latency.",
+    )
+    parser.add_argument(
+        "--emulate",
+        action="append",
+        default=[],
+        metavar="CONFIG",
+        help="Provide the software SIM cards described in CONFIG. (May be repeated.)",
+    )
+    parser.add_argument(
+        "--record",
+        metavar="DIR",
+        help="Record every session to a trace file in DIR.",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=60,
+        help="Seconds between SIM card utilisation reports. [Default: %(default)s]",
+    )
 
     subparsers = parser.add_subparsers(
         title="subcommands", required=True, dest="subcommand"
@@ -190,7 +189,9 @@ verification. (defaults to the value of --host)",
         # sni_callback cannot be used to verify the peer cert because it is not available
         # when the callback runs
 
-        sim_provider = SimProvider(args.bluetooth_mac)
+        sim_provider = SimProvider(
+            args.bluetooth_mac, args.replay, args.replay_latency, emulated_cards(args)
+        )
 
         if not args.allow_insecure_transport:
             tls_ctx = ssl.create_default_context(
@@ -201,7 +202,10 @@ verification. (defaults to the value of --host)",
         else:
             tls_ctx = None
 
-        direct_connection(args.host, args.port, sim_provider, tls_ctx)
+        daemon = ProviderDaemon(
+            sim_provider, report_interval=args.report_interval, record_dir=args.record
+        )
+        asyncio.run(daemon.serve_direct(args.host, args.port, tls_ctx))
         return
 
     env_token = os.environ.get("TUNNEL_API_TOKEN")
@@ -218,9 +222,10 @@ verification. (defaults to the value of --host)",
         )
         return
 
-    sim_provider = SimProvider(args.bluetooth_mac)
+    sim_provider = SimProvider(
+        args.bluetooth_mac, args.replay, args.replay_latency, emulated_cards(args)
+    )
 
-    sims = get_sims(sim_provider)
     try:
         session_token = register_provider(args.api_url, token)
     except Exception:
@@ -228,20 +233,16 @@ verification. (defaults to the value of --host)",
         return
 
     try:
-        sim_provider.set_device_change_callback(
-            lambda: register_sims(
-                "https://" + args.host + "/" + args.tunnel_api_prefix,
-                session_token,
-                get_sims(sim_provider),
-            )
+        registration = SimRegistration(
+            "https://" + args.host + "/" + args.tunnel_api_prefix,
+            session_token,
+            sim_provider,
         )
+        # called only when the set of SIM cards changed
+        sim_provider.set_device_change_callback(registration.update)
 
         try:
-            register_sims(
-                "https://" + args.host + "/" + args.tunnel_api_prefix,
-                session_token,
-                sims,
-            )
+            registration.register()
         except Exception:
             logging.exception("SIM card registration failed.")
             return
@@ -256,60 +257,25 @@ verification. (defaults to the value of --host)",
         else:
             server_hostname = args.tls_server_name
 
-        srv = ProviderClient(
-            session_token,
-            args.host,
-            args.port,
-            lambda x: provides_sim(sim_provider, x),
-            tls_ctx=tls_ctx,
-            server_hostname=server_hostname,
+        # all SIM cards are served concurrently from a single event loop
+        daemon = ProviderDaemon(
+            sim_provider, report_interval=args.report_interval, record_dir=args.record
         )
 
-        failed_connections = 0
-        while True:
-            id_connection = None
-            try:
-                id_connection = srv.wait_for_connection()
-            except AuthError as e:
-                logging.error(
-                    f"Authentication with SIM tunnel failed: {e}\nStopping..."
-                )
-                return
-            except Exception as e:
-                logging.warning(f"Error while establishing connection: {e}")
-
-                failed_connections += 1
-
-                if failed_connections > 10:
-                    logging.error(
-                        "Multiple consecutive connection attempts failed. Stopping..."
-                    )
-                    return
-
-                time.sleep(1)
-                continue
-
-            failed_connections = 0
-
-            requested_sim = id_connection[0]
-            connection = id_connection[1]
-
-            sim_info = get_sim(sim_provider, requested_sim)
-            if sim_info is not None:
-                logging.info(
-                    f"requested imsi {requested_sim} is on device {sim_info.device_name}"
-                )
-                # Start SimTunnel for connection to serial device
-                # tunnel = SimTunnel(connection, SerialSimLink(device))
-                # tunnel = SimTunnel(connection, BluetoothSapSimLink("80:5A:04:0E:90:F6"))
-                # tunnel = SimTunnel(connection, ModemATCommandLink("/dev/ttyACM0"))
-                tunnel = SimTunnel(connection, sim_info.sl, sim_info.iccid)
-                tunnel.start()
-            else:
-                logging.info(
-                    f"requested imsi {requested_sim} is currently not connected to the system"
+        try:
+            asyncio.run(
+                daemon.serve_tunnel(
+                    session_token,
+                    args.host,
+                    args.port,
+                    tls_ctx=tls_ctx,
+                    server_hostname=server_hostname,
                 )
-                connection.close()
+            )
+        except AuthError as e:
+            logging.error(f"Authentication with SIM tunnel failed: {e}\nStopping...")
+        except ConnectionError as e:
+            logging.error(f"{e} Stopping...")
     finally:
         deregister_provider(args.api_url, session_token)
 